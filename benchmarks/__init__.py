@@ -0,0 +1,4 @@
+import os
+
+# s3proxy settings require APP_NAME, benchmarks should be runnable without any `.env` file
+os.environ.setdefault("APP_NAME", "s3proxy-benchmark")
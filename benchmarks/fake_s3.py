@@ -0,0 +1,163 @@
+"""
+In-memory S3 stand-in for the tests and the benchmarks, served in the same process as the proxy.
+
+Implements just enough of the API for them: GET and HEAD (with Range and conditional headers), PUT, DELETE,
+multipart uploads and ListObjectsV2 of path-style requests. Signatures are not verified.
+"""
+import hashlib
+import itertools
+import xml.etree.ElementTree as ET
+
+from starlette.applications import Starlette
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+
+from s3proxy.s3 import get_bucket_key, parse_range, resolve_range
+
+S3_NAMESPACE = "http://s3.amazonaws.com/doc/2006-03-01/"
+
+
+def get_etag(body):
+    return '"%s"' % hashlib.md5(body).hexdigest()
+
+
+def to_xml(root, fields):
+    element = ET.Element(root, xmlns=S3_NAMESPACE)
+    for name, value in fields:
+        if isinstance(value, list):
+            child = ET.SubElement(element, name)
+            for child_name, child_value in value:
+                ET.SubElement(child, child_name).text = str(child_value)
+        else:
+            ET.SubElement(element, name).text = str(value)
+    return Response(ET.tostring(element, xml_declaration=True, encoding="utf-8"), media_type="application/xml")
+
+
+class FakeS3:
+    """
+    Objects are bodies addressed by path, their ETag is md5 of the body. With `record` every request is kept
+    in `received` as (method, url, headers, body).
+    """
+
+    def __init__(self, objects=None, chunk_size=64 * 1024, record=False):
+        self.chunk_size = chunk_size
+        self.record = record
+        # path -> body
+        self.objects = dict(objects or {})
+        # path -> x-amz-meta-* headers of the object
+        self.metadata = {}
+        # upload id -> {part number: body}
+        self.uploads = {}
+        self.received = []
+        # path -> (body, etag), large bodies are not hashed by every GET
+        self._etags = {}
+        self._upload_ids = itertools.count(1)
+        self.app = Starlette(
+            routes=[Route("/{path:path}", self.handle, methods=["GET", "HEAD", "PUT", "POST", "DELETE"])]
+        )
+
+    def put_object(self, path, body, metadata=None):
+        self.objects[path] = body
+        self.metadata[path] = metadata or {}
+
+    def get_object_etag(self, path):
+        body = self.objects[path]
+        cached = self._etags.get(path)
+        if cached is None or cached[0] is not body:
+            cached = self._etags[path] = (body, get_etag(body))
+        return cached[1]
+
+    async def handle(self, request):
+        body = await request.body()
+        if self.record:
+            self.received.append((request.method, request.url, dict(request.headers), body))
+        bucket, key = get_bucket_key(request.url.path)
+        params = request.query_params
+        if key is None:
+            if request.method == "GET":
+                return self.list_objects(bucket, params)
+            return Response(status_code=200)
+        if request.method == "POST" and "uploads" in params:
+            return self.create_multipart_upload(bucket, key)
+        if "uploadId" in params:
+            return self.multipart_upload(request, body, bucket, key)
+        if request.method == "PUT":
+            metadata = {name: value for name, value in request.headers.items() if name.startswith("x-amz-meta-")}
+            self.put_object(request.url.path, body, metadata)
+            return Response(status_code=200, headers={"etag": self.get_object_etag(request.url.path)})
+        if request.method == "DELETE":
+            self.objects.pop(request.url.path, None)
+            return Response(status_code=204)
+        return self.get_object(request)
+
+    def get_object(self, request):
+        if request.url.path not in self.objects:
+            return Response(status_code=404)
+        body = self.objects[request.url.path]
+        etag = self.get_object_etag(request.url.path)
+        headers = {"etag": etag, "accept-ranges": "bytes", **self.metadata.get(request.url.path, {})}
+        if request.headers.get("if-match", etag) != etag:
+            return Response(status_code=412)
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers=headers)
+        status_code = 200
+        start, end = 0, len(body) - 1
+        byte_range = parse_range(request.headers.get("range"))
+        if byte_range is not None:
+            resolved = resolve_range(byte_range, len(body))
+            if resolved is None:
+                return Response(status_code=416)
+            start, end = resolved
+            status_code = 206
+            headers["content-range"] = f"bytes {start}-{end}/{len(body)}"
+        headers["content-length"] = str(end - start + 1)
+        if request.method == "HEAD":
+            return Response(status_code=status_code, headers=headers)
+        return StreamingResponse(self.stream(body, start, end + 1), status_code=status_code, headers=headers)
+
+    async def stream(self, body, start, stop):
+        for offset in range(start, stop, self.chunk_size):
+            chunk_end = min(offset + self.chunk_size, stop)
+            yield body[offset:chunk_end]
+
+    def list_objects(self, bucket, params):
+        prefix = f"/{bucket}/{params.get('prefix', '')}"
+        after = params.get("continuation-token") or params.get("start-after") or ""
+        max_keys = int(params.get("max-keys", 1000))
+        paths = sorted(path for path in self.objects if path.startswith(prefix) and path > f"/{bucket}/{after}")
+        fields = [("Name", bucket), ("Prefix", params.get("prefix", "")), ("MaxKeys", max_keys)]
+        bucket_prefix = f"/{bucket}/"
+        for path in paths[:max_keys]:
+            key = path.removeprefix(bucket_prefix)
+            fields.append(
+                ("Contents", [("Key", key), ("ETag", self.get_object_etag(path)), ("Size", len(self.objects[path]))])
+            )
+        fields.append(("KeyCount", min(len(paths), max_keys)))
+        fields.append(("IsTruncated", "true" if len(paths) > max_keys else "false"))
+        if len(paths) > max_keys:
+            fields.append(("NextContinuationToken", paths[max_keys - 1].removeprefix(bucket_prefix)))
+        return to_xml("ListBucketResult", fields)
+
+    def create_multipart_upload(self, bucket, key):
+        upload_id = str(next(self._upload_ids))
+        self.uploads[upload_id] = {}
+        return to_xml("InitiateMultipartUploadResult", [("Bucket", bucket), ("Key", key), ("UploadId", upload_id)])
+
+    def multipart_upload(self, request, body, bucket, key):
+        """
+        UploadPart, CompleteMultipartUpload and AbortMultipartUpload.
+        """
+        upload_id = request.query_params["uploadId"]
+        parts = self.uploads.get(upload_id)
+        if parts is None:
+            return Response(status_code=404)
+        if request.method == "PUT":
+            parts[int(request.query_params["partNumber"])] = body
+            return Response(status_code=200, headers={"etag": get_etag(body)})
+        del self.uploads[upload_id]
+        if request.method == "DELETE":
+            return Response(status_code=204)
+        self.put_object(request.url.path, b"".join(parts[number] for number in sorted(parts)))
+        digests = b"".join(bytes.fromhex(get_etag(parts[number]).strip('"')) for number in sorted(parts))
+        etag = f'"{hashlib.md5(digests).hexdigest()}-{len(parts)}"'
+        return to_xml("CompleteMultipartUploadResult", [("Bucket", bucket), ("Key", key), ("ETag", etag)])
@@ -0,0 +1,92 @@
+"""
+Cold start benchmark, reports import time and RSS growth of the modules on the runtime import path.
+
+    $ python -m benchmarks.startup
+
+Every module is imported in a fresh interpreter, so numbers include everything the module pulls in. The last row
+imports `s3proxy.main` and builds the application with `app_factory`, which is what uvicorn does before it's ready
+to serve `/healthcheck`. Packages contributing the most to `python -X importtime` are listed below the table.
+"""
+import argparse
+import json
+import subprocess
+import sys
+from collections import Counter
+
+MODULES = [
+    "pydantic_settings",
+    "httpx",
+    "starlette.applications",
+    "sentry_sdk",
+    "boto3",
+    "s3proxy.config",
+    "s3proxy.aws",
+]
+
+MEASURE_SCRIPT = """
+import json, sys, time
+
+def rss_kb():
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+
+rss_before = rss_kb()
+started = time.perf_counter()
+module = __import__(sys.argv[1], fromlist=["_"])
+if sys.argv[2] == "app_factory":
+    module.app_factory()
+elapsed = time.perf_counter() - started
+print(json.dumps({"seconds": elapsed, "rss_kb": rss_kb() - rss_before, "loaded": sorted(sys.modules)}))
+"""
+
+
+def measure(module, call=""):
+    output = subprocess.run(
+        [sys.executable, "-c", MEASURE_SCRIPT, module, call], capture_output=True, check=True, text=True
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def get_import_time_by_package():
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import s3proxy.main as m; m.app_factory()"],
+        capture_output=True,
+        text=True,
+    ).stderr
+    self_us = Counter()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_time, _, name = line.removeprefix("import time:").split("|")
+        self_us[name.strip().split(".")[0]] += int(self_time)
+    return self_us
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top", type=int, default=10, help="number of packages listed by import time")
+    args = parser.parse_args()
+
+    print(f"{'module':<32} {'import ms':>10} {'RSS MB':>8}")
+    for module in MODULES:
+        try:
+            result = measure(module)
+        except subprocess.CalledProcessError:
+            print(f"{module:<32} {'not installed':>19}")
+            continue
+        print(f"{module:<32} {result['seconds'] * 1000:>10.1f} {result['rss_kb'] / 1024:>8.1f}")
+    result = measure("s3proxy.main", "app_factory")
+    print(f"{'s3proxy.main.app_factory()':<32} {result['seconds'] * 1000:>10.1f} {result['rss_kb'] / 1024:>8.1f}")
+    for module in ("boto3", "sentry_sdk"):
+        if module in result["loaded"]:
+            print(f"warning: {module} is imported on the runtime path")
+
+    print(f"\n{'package':<32} {'self import ms':>14}")
+    for package, self_us in get_import_time_by_package().most_common(args.top):
+        print(f"{package:<32} {self_us / 1000:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
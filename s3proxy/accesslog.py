@@ -0,0 +1,42 @@
+"""
+Structured access log: line of JSON per proxied request, written once its response is sent.
+"""
+import json
+import time
+
+from .logging import root_logger
+from .s3 import get_access_key_id, get_bucket_key
+
+logger = root_logger.getChild("access")
+
+
+class AccessEntry:
+    """
+    Access log entry of single request, the upstream timer of every attempt records its time to response headers.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.started = time.perf_counter()
+        self.upstream_ttfb = None
+        self.attempts = 0
+
+    def finish(self, status, sent):
+        request = self.request
+        bucket, key = get_bucket_key(request.url.path)
+        client = request.scope.get("client")
+        entry = {
+            "time": time.time(),
+            "client": client[0] if client else None,
+            "access_key": get_access_key_id(request.headers),
+            "method": request.method,
+            "bucket": bucket,
+            "key": key,
+            "status": int(status) if status.isdigit() else status,
+            "received": int(request.headers.get("content-length", 0)),
+            "sent": sent,
+            "attempts": self.attempts,
+            "upstream_ttfb_ms": round(self.upstream_ttfb * 1000, 3) if self.upstream_ttfb is not None else None,
+            "duration_ms": round((time.perf_counter() - self.started) * 1000, 3),
+        }
+        logger.info(json.dumps(entry))
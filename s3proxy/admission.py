@@ -0,0 +1,301 @@
+"""
+Admission control: concurrency limits with bounded wait queues, per tenant bandwidth limits and fast rejection
+of requests over the limits with 503 SlowDown.
+"""
+import asyncio
+import time
+from collections import deque
+
+from starlette.requests import Request
+
+from . import metrics
+from .logging import root_logger
+from .s3 import get_access_key_id, get_bucket_key, get_error_body
+
+logger = root_logger.getChild(__name__)
+
+SLOW_DOWN_BODY = get_error_body("SlowDown", "Please reduce your request rate.")
+
+
+class Rejected(Exception):
+    pass
+
+
+class SlowClient(Exception):
+    pass
+
+
+class ConcurrencyLimit:
+    """
+    Limit of requests handled at a time, requests over the limit wait in FIFO queue of at most `max_queue` requests
+    for at most `timeout` seconds.
+    """
+
+    def __init__(self, limit, max_queue, timeout):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.active = 0
+        self._waiters = deque()
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    async def acquire(self):
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            raise Rejected()
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            async with asyncio.timeout(self.timeout):
+                await future
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # the slot was handed over meanwhile
+                self.release()
+            else:
+                future.cancel()
+                self._waiters.remove(future)
+            if isinstance(e, TimeoutError):
+                raise Rejected() from None
+            raise
+
+    def release(self):
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                # the slot is handed over, so requests over the limit can't jump the queue
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    @property
+    def idle(self):
+        return self.active == 0 and not self._waiters
+
+
+class TokenBucket:
+    """
+    Bandwidth limit of `rate` bytes per second with bursts of `burst` bytes. Consumers go into debt and sleep it off,
+    so concurrent streams of a tenant share the rate.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.tokens + (now - self.updated) * self.rate, self.burst)
+        self.updated = now
+
+    async def consume(self, amount):
+        self.refill()
+        self.tokens -= amount
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+    @property
+    def full(self):
+        self.refill()
+        return self.tokens >= self.burst
+
+
+class Tenant:
+    def __init__(self, limit, bandwidth):
+        self.limit = limit
+        self.bandwidth = bandwidth
+        self.rejected = 0
+
+    @property
+    def idle(self):
+        return self.limit.idle and (self.bandwidth is None or self.bandwidth.full)
+
+
+class Permit:
+    """
+    Admission of a request, held until its response is sent.
+    """
+
+    def __init__(self, controller, key, tenant):
+        self.controller = controller
+        self.key = key
+        self.tenant = tenant
+        self.released = False
+
+    async def throttle(self, amount):
+        if self.tenant.bandwidth is not None and amount:
+            await self.tenant.bandwidth.consume(amount)
+
+    def wrap_receive(self, receive):
+        async def throttled_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                await self.throttle(len(message.get("body", b"")))
+            return message
+
+        return throttled_receive
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller.release(self)
+
+
+class AdmittedResponse:
+    """
+    Wraps ASGI response of admitted request. Body is paced by bandwidth limit of the tenant and the response is
+    aborted when the client doesn't take a chunk within `send_timeout` seconds, so a stalled client can't pin
+    the upstream response and its buffers. The permit is released once the response is sent.
+    """
+
+    def __init__(self, response, permit, send_timeout):
+        self.response = response
+        self.status_code = response.status_code
+        self.permit = permit
+        self.send_timeout = send_timeout
+
+    async def __call__(self, scope, receive, send):
+        async def admitted_send(message):
+            if message["type"] == "http.response.body":
+                await self.permit.throttle(len(message.get("body", b"")))
+            elif message["type"] == "http.response.zerocopysend":
+                await self.permit.throttle(message.get("count", 0))
+            try:
+                async with asyncio.timeout(self.send_timeout):
+                    await send(message)
+            except TimeoutError:
+                raise SlowClient() from None
+
+        try:
+            await self.response(scope, receive, admitted_send)
+        except SlowClient:
+            logger.warning("Client of %s didn't read the response for %ss, aborted", scope["path"], self.send_timeout)
+        finally:
+            self.permit.release()
+
+
+class SlowDownResponse:
+    def __init__(self, retry_after):
+        self.status_code = 503
+        self.headers = [
+            (b"content-type", b"application/xml"),
+            (b"content-length", str(len(SLOW_DOWN_BODY)).encode()),
+            (b"retry-after", str(retry_after).encode()),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.headers})
+        await send({"type": "http.response.body", "body": SLOW_DOWN_BODY, "more_body": False})
+
+
+class AdmissionController:
+    """
+    Admits requests within the global limit of `max_requests` and per tenant limits of `tenant_max_requests` and
+    `tenant_bandwidth` bytes per second (both directions). Tenant is the access key id of the client, or the access
+    key id and the bucket with `by_bucket`. Requests over a limit wait in a bounded queue, once the queue is full
+    or the wait is too long they're rejected with 503 SlowDown and `Retry-After: <retry_after>`.
+    """
+
+    def __init__(
+        self,
+        max_requests,
+        tenant_max_requests,
+        max_queue=100,
+        queue_timeout=5.0,
+        tenant_bandwidth=None,
+        by_bucket=False,
+        send_timeout=60.0,
+        retry_after=1,
+    ):
+        self.tenant_max_requests = tenant_max_requests
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.tenant_bandwidth = tenant_bandwidth
+        self.by_bucket = by_bucket
+        self.send_timeout = send_timeout
+        self.retry_after = retry_after
+        self.limit = ConcurrencyLimit(max_requests, max_queue, queue_timeout)
+        self.tenants = {}
+        self.admitted = 0
+        self.rejected = 0
+
+    def get_tenant_key(self, request):
+        access_key_id = get_access_key_id(request.headers) or "anonymous"
+        if not self.by_bucket:
+            return access_key_id
+        bucket, _ = get_bucket_key(request.url.path)
+        return f"{access_key_id}/{bucket or ''}"
+
+    def get_tenant(self, key):
+        tenant = self.tenants.get(key)
+        if tenant is None:
+            bandwidth = None
+            if self.tenant_bandwidth is not None:
+                # a second worth of bytes may be sent at once
+                bandwidth = TokenBucket(self.tenant_bandwidth, self.tenant_bandwidth)
+            tenant = Tenant(ConcurrencyLimit(self.tenant_max_requests, self.max_queue, self.queue_timeout), bandwidth)
+            self.tenants[key] = tenant
+        return tenant
+
+    async def admit(self, request):
+        key = self.get_tenant_key(request)
+        tenant = self.get_tenant(key)
+        try:
+            await tenant.limit.acquire()
+        except Rejected:
+            tenant.rejected += 1
+            self._forget_idle(key, tenant)
+            raise
+        try:
+            await self.limit.acquire()
+        except BaseException:
+            tenant.limit.release()
+            self._forget_idle(key, tenant)
+            raise
+        return Permit(self, key, tenant)
+
+    def release(self, permit):
+        self.limit.release()
+        permit.tenant.limit.release()
+        self._forget_idle(permit.key, permit.tenant)
+
+    def _forget_idle(self, key, tenant):
+        if tenant.idle and self.tenants.get(key) is tenant:
+            del self.tenants[key]
+
+    async def handle(self, request, handler):
+        """
+        Returns ASGI response of `handler(request)` coroutine once the request is admitted, or 503 SlowDown.
+        """
+        try:
+            permit = await self.admit(request)
+        except Rejected:
+            self.rejected += 1
+            metrics.ADMISSION_REJECTED.inc()
+            return SlowDownResponse(self.retry_after)
+        self.admitted += 1
+        try:
+            response = await handler(Request(request.scope, permit.wrap_receive(request.receive)))
+        except BaseException:
+            permit.release()
+            raise
+        return AdmittedResponse(response, permit, self.send_timeout)
+
+    def stats(self):
+        return {
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "active": self.limit.active,
+            "queued": self.limit.queued,
+            "tenants": {
+                key: {"active": tenant.limit.active, "queued": tenant.limit.queued, "rejected": tenant.rejected}
+                for key, tenant in self.tenants.items()
+            },
+        }
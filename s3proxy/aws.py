@@ -1,47 +1,89 @@
 import asyncio
 import os
+import time
+import urllib.parse
+import xml.etree.ElementTree as ET
 from datetime import datetime
+from hashlib import sha256
+from typing import NamedTuple
 
-import boto3
 import httpx
 
+from . import metrics
+from .awssigv4 import SigV4Signer
 from .http_client import AsyncHttpClient
 from .logging import root_logger
 
 logger = root_logger.getChild(__name__)
 
+STS_NAMESPACE = {"sts": "https://sts.amazonaws.com/doc/2011-06-15/"}
 
-def get_credentials_for_role(role_arn):
-    sts_client = boto3.client("sts")
-    response = sts_client.assume_role(RoleArn=role_arn, RoleSessionName="s3proxy")
-
-    # Retrieve the temporary credentials
-    credentials = response["Credentials"]
-
-    # Create a new session using the assumed role's credentials
-    # assumed_session = boto3.Session(
-    #     aws_access_key_id=credentials['AccessKeyId'],
-    #     aws_secret_access_key=credentials['SecretAccessKey'],
-    #     aws_session_token=credentials['SessionToken']
-    # )
-    # ec2_client = assumed_session.client('ec2')
-    return (
-        credentials["AccessKeyId"],
-        credentials["SecretAccessKey"],
-        credentials["SessionToken"],
-        credentials["Expiration"],
+
+class Credentials(NamedTuple):
+    access_key: str
+    secret_key: str
+    session_token: str | None = None
+    # unix timestamp, None means credentials never expire
+    expiration: float | None = None
+
+    def expires_in(self):
+        if self.expiration is None:
+            return float("inf")
+        return self.expiration - time.time()
+
+
+def parse_expiration(expiration_date):
+    # expiration date and time format: 2023-07-26T22:16:38Z, STS may add milliseconds: 2023-07-26T22:16:38.359Z
+    if expiration_date is None:
+        return None
+    return datetime.fromisoformat(expiration_date.replace("Z", "+00:00")).timestamp()
+
+
+def parse_assume_role_response(content):
+    credentials = ET.fromstring(content).find("./sts:AssumeRoleResult/sts:Credentials", STS_NAMESPACE)
+    if credentials is None:
+        raise Exception("Credentials not found in AssumeRole response")
+    return Credentials(
+        credentials.findtext("sts:AccessKeyId", namespaces=STS_NAMESPACE),
+        credentials.findtext("sts:SecretAccessKey", namespaces=STS_NAMESPACE),
+        credentials.findtext("sts:SessionToken", namespaces=STS_NAMESPACE),
+        parse_expiration(credentials.findtext("sts:Expiration", namespaces=STS_NAMESPACE)),
     )
 
 
 class AwsAccessProvider:
-    def __init__(self, access_key=None, secret_key=None):
+    """
+    Provides credentials used to re-sign proxied requests.
+
+    Temporary credentials are refreshed by a single task shared by all waiting requests and renewed in
+    the background `refresh_margin` seconds before they expire. When renewal fails the last good credentials are
+    served until they actually expire.
+    """
+
+    def __init__(
+        self,
+        access_key=None,
+        secret_key=None,
+        role_arn=None,
+        sts_endpoint_url="https://sts.amazonaws.com",
+        sts_region="us-east-1",
+        refresh_margin=300,
+        retry_delay=30,
+        http_client=None,
+    ):
+        self._static_credentials = None
         if access_key is not None and secret_key is not None:
             root_logger.info("Using provided AWS credentials instead of IAM role")
-        self._access_key = access_key
-        self._secret_key = secret_key
-        self._role_arn = None
-        self._invalidation_callback = None
-        self._http_client = AsyncHttpClient()
+            self._static_credentials = Credentials(access_key, secret_key)
+        self._credentials = self._static_credentials
+        self._role_arn = role_arn
+        self._sts_url = httpx.URL(sts_endpoint_url)
+        self._sts_signer = SigV4Signer(sts_region, "sts")
+        self._refresh_margin = refresh_margin
+        self._retry_delay = retry_delay
+        self._refresh_task = None
+        self._renewal_handle = None
+        self._http_client = http_client or AsyncHttpClient()
 
     def get_iam_host(self):
         # AWS_CONTAINER_CREDENTIALS_RELATIVE_URI is available only in fargate
@@ -64,11 +106,21 @@ class AwsAccessProvider:
         return self._role_arn
 
     async def get_access_secret_key(self):
-        if self._access_key is None or self._secret_key is None:
-            await self.refresh_access_key()
-        return self._access_key, self._secret_key
+        credentials = await self.get_access_credentials()
+        return credentials.access_key, credentials.secret_key
+
+    async def get_access_credentials(self) -> Credentials:
+        credentials = self._credentials
+        if credentials is None or credentials.expires_in() <= 0:
+            credentials = await self.refresh_access_key()
+        return credentials
 
     async def close(self):
+        if self._renewal_handle is not None:
+            self._renewal_handle.cancel()
+            self._renewal_handle = None
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
         await self._http_client.close_session()
 
     async def get_iam_role_arn(self):
@@ -92,31 +144,94 @@ class AwsAccessProvider:
         response = await self._http_client.request("get", iam_url)
         response.raise_for_status()
         credentials = response.json()
-        return (
+        return Credentials(
             credentials["AccessKeyId"],
             credentials["SecretAccessKey"],
             credentials.get("SessionToken") or credentials.get("Token"),
-            credentials.get("Expiration"),
+            parse_expiration(credentials.get("Expiration")),
         )
 
-    async def invalidate_access_key(self):
-        self._access_key = None
-        self._secret_key = None
-        self._invalidation_callback = None
+    async def assume_role(self, role_arn, credentials: Credentials):
+        """
+        Calls STS AssumeRole signed with given credentials and returns temporary credentials of the role.
+        """
+        body = urllib.parse.urlencode(
+            {"Action": "AssumeRole", "Version": "2011-06-15", "RoleArn": role_arn, "RoleSessionName": "s3proxy"}
+        ).encode("utf-8")
+        headers = {
+            "host": self._sts_url.netloc.decode("ascii"),
+            "content-type": "application/x-www-form-urlencoded; charset=utf-8",
+        }
+        if credentials.session_token is not None:
+            headers["x-amz-security-token"] = credentials.session_token
+        headers["authorization"] = self._sts_signer.sign(
+            credentials.access_key,
+            credentials.secret_key,
+            "POST",
+            self._sts_url.path,
+            headers,
+            body_hash=sha256(body).hexdigest(),
+        )
+        response = await self._http_client.request("post", str(self._sts_url), content=body, headers=headers)
+        response.raise_for_status()
+        return parse_assume_role_response(response.content)
 
-    async def refresh_access_key(self):
-        loop = asyncio.get_event_loop()
+    async def fetch_credentials(self):
+        if self._static_credentials is not None:
+            return self._static_credentials
+        credentials = await self.get_credentials()
         try:
             role_arn = await self.get_role_arn()
-            access_key, access_secret, session_token, expiration_date = get_credentials_for_role(role_arn)
+            return await self.assume_role(role_arn, credentials)
         except Exception as e:
-            logger.warning("Failed to get role arn, performing fallback", exc_info=e)
-            access_key, access_secret, session_token, expiration_date = await self.get_credentials()
-        if self._invalidation_callback is not None:
-            self._invalidation_callback.cancel()
-        # expiration date and time format: 2023-07-26T22:16:38Z
-        expiration_dt = datetime.strptime(expiration_date, "%Y-%m-%dT%H:%M:%SZ")
-        expiration_tm = expiration_dt.timestamp()
-        self._invalidation_callback = loop.call_at(int(expiration_tm), self.invalidate_access_key)
-        self._access_key = access_key
-        self._secret_key = access_secret
+            logger.warning("Failed to assume role, using instance credentials", exc_info=e)
+            return credentials
+
+    async def refresh_access_key(self):
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.get_running_loop().create_task(self._refresh())
+        # refresh is shared by all waiters, one of them being cancelled must not cancel it for the others
+        return await asyncio.shield(self._refresh_task)
+
+    async def _refresh(self):
+        started = time.perf_counter()
+        try:
+            try:
+                credentials = await self.fetch_credentials()
+            except Exception as e:
+                metrics.CREDENTIALS_REFRESHES.labels("failure").inc()
+                if self._credentials is None or self._credentials.expires_in() <= 0:
+                    raise
+                logger.warning("Failed to refresh credentials, using current ones until they expire", exc_info=e)
+                self._schedule_renewal(failed=True)
+                return self._credentials
+            metrics.CREDENTIALS_REFRESHES.labels("success").inc()
+            self._credentials = credentials
+            self._schedule_renewal()
+            return credentials
+        finally:
+            metrics.CREDENTIALS_REFRESH_DURATION.observe(time.perf_counter() - started)
+            self._refresh_task = None
+
+    def _schedule_renewal(self, failed=False):
+        if self._renewal_handle is not None:
+            self._renewal_handle.cancel()
+            self._renewal_handle = None
+        expires_in = self._credentials.expires_in()
+        if expires_in == float("inf"):
+            return
+        if failed:
+            delay = min(self._retry_delay, expires_in / 2)
+        elif expires_in > self._refresh_margin:
+            delay = expires_in - self._refresh_margin
+        else:
+            # credentials live shorter than refresh margin, renew them in the half of their lifetime
+            delay = expires_in / 2
+        self._renewal_handle = asyncio.get_running_loop().call_later(max(delay, 0), self._renew)
+
+    def _renew(self):
+        self._renewal_handle = None
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.get_running_loop().create_task(self._refresh())
+            # nobody awaits background renewal, failures are already logged or will be raised to the next waiter
+            self._refresh_task.add_done_callback(lambda task: task.cancelled() or task.exception())
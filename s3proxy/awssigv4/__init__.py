@@ -1 +1,8 @@
+from .chunked import (  # noqa: F401
+    STREAMING_PAYLOAD,
+    ChunkedPayloadError,
+    ChunkedPayloadSigner,
+    ChunkSignatureError,
+)
+from .signer import SigningRequest, SigV4Signer  # noqa: F401
 from .sigv4 import get_v4_signature  # noqa: F401
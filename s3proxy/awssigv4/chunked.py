@@ -0,0 +1,154 @@
+"""
+Re-signing of aws-chunked request bodies (x-amz-content-sha256: STREAMING-AWS4-HMAC-SHA256-PAYLOAD).
+
+Body is a sequence of chunks `<hex size>;chunk-signature=<signature>\\r\\n<data>\\r\\n` terminated by zero sized
+chunk. Signature of every chunk is chained from the signature of the previous one, the first from the seed
+signature in the authorization header:
+https://docs.aws.amazon.com/AmazonS3/latest/API/sigv4-streaming.html
+"""
+import hmac
+from hashlib import sha256
+
+from .signer import EMPTY_BODY_HASH
+
+STREAMING_PAYLOAD = "STREAMING-AWS4-HMAC-SHA256-PAYLOAD"
+# chunk header is hex size and the signature extension, anything longer is not aws-chunked body
+MAX_CHUNK_HEADER_SIZE = 1024
+CHUNK_SIGNATURE_PREFIX = b";chunk-signature="
+
+
+class ChunkedPayloadError(Exception):
+    pass
+
+
+class ChunkSignatureError(ChunkedPayloadError):
+    pass
+
+
+class ChunkReader:
+    """
+    Reads lines and exact amounts of bytes from async iterator of bytes. Data is returned as memoryviews of the
+    chunks coming from the iterator, so payload is never copied.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream.__aiter__()
+        self._data = b""
+        self._offset = 0
+
+    async def _fill(self):
+        while self._offset >= len(self._data):
+            try:
+                self._data = await self._stream.__anext__()
+            except StopAsyncIteration:
+                raise ChunkedPayloadError("Truncated aws-chunked body") from None
+            self._offset = 0
+
+    async def readline(self, limit):
+        """
+        Returns line including `\\r\\n`.
+        """
+        line = b""
+        while True:
+            await self._fill()
+            start = self._offset
+            end = self._data.find(b"\n", start, start + limit - len(line)) + 1
+            if end:
+                line += self._data[start:end]
+                self._offset = end
+                return line
+            line += self._data[start:]
+            self._offset = len(self._data)
+            if len(line) >= limit:
+                raise ChunkedPayloadError("Chunk header too long")
+
+    async def readexactly(self, size):
+        """
+        Returns list of memoryviews with `size` bytes in total.
+        """
+        views = []
+        while size > 0:
+            await self._fill()
+            start = self._offset
+            end = min(start + size, len(self._data))
+            views.append(memoryview(self._data)[start:end])
+            size -= end - start
+            self._offset = end
+        return views
+
+
+def parse_chunk_header(line):
+    """
+    Parses `10000;chunk-signature=<signature>\\r\\n` into (b"10000", 65536).
+    """
+    if not line.endswith(b"\r\n"):
+        raise ChunkedPayloadError("Invalid chunk header")
+    size, sep, _ = line.partition(CHUNK_SIGNATURE_PREFIX)
+    try:
+        if not sep:
+            raise ValueError()
+        return size, int(size, 16)
+    except ValueError:
+        raise ChunkedPayloadError(f"Invalid chunk header: {line[:64]!r}") from None
+
+
+class ChunkedPayloadSigner:
+    """
+    Rewrites chunk signatures of aws-chunked body with the signing key of the proxy, chained from the seed
+    signature the proxy put in the authorization header.
+
+    Chunk header precedes its data, so every chunk is held until it's hashed: memory is bounded by the chunk size
+    chosen by the client, not by the size of the body. Size of the chunk is kept as the client wrote it and
+    signatures have the same length, so content-length of the body does not change.
+    """
+
+    def __init__(self, signing_key, amz_date, scope, seed_signature, max_chunk_size=16 * 1024**2):
+        self.signing_key = signing_key
+        self.amz_date = amz_date
+        self.scope = scope
+        self.previous_signature = seed_signature
+        self.max_chunk_size = max_chunk_size
+
+    def sign_chunk(self, chunk_hash):
+        string_to_sign = "\n".join(
+            (
+                "AWS4-HMAC-SHA256-PAYLOAD",
+                self.amz_date,
+                self.scope,
+                self.previous_signature,
+                EMPTY_BODY_HASH,
+                chunk_hash,
+            )
+        )
+        self.previous_signature = hmac.new(self.signing_key, string_to_sign.encode("utf-8"), sha256).hexdigest()
+        return self.previous_signature
+
+    async def resign(self, stream, verifier=None):
+        """
+        Yields aws-chunked body read from `stream` with chunk signatures replaced. Signatures of the client are
+        checked with `verifier` (signer with the key and the seed signature of the client) when it's given.
+        """
+        reader = ChunkReader(stream)
+        while True:
+            line = await reader.readline(MAX_CHUNK_HEADER_SIZE)
+            size_token, size = parse_chunk_header(line)
+            if size > self.max_chunk_size:
+                raise ChunkedPayloadError(f"Chunk of {size} bytes exceeds limit of {self.max_chunk_size}")
+            views = await reader.readexactly(size)
+            hasher = sha256()
+            for view in views:
+                hasher.update(view)
+            if b"".join(await reader.readexactly(2)) != b"\r\n":
+                raise ChunkedPayloadError("Chunk data is not followed by CRLF")
+            chunk_hash = hasher.hexdigest()
+            if verifier is not None:
+                client_signature = line.partition(CHUNK_SIGNATURE_PREFIX)[2].rstrip(b"\r\n").decode("ascii", "replace")
+                if not hmac.compare_digest(verifier.sign_chunk(chunk_hash), client_signature):
+                    raise ChunkSignatureError("Chunk signature does not match")
+            signature = self.sign_chunk(chunk_hash)
+            yield size_token + CHUNK_SIGNATURE_PREFIX + signature.encode("ascii") + b"\r\n"
+            for view in views:
+                yield view
+            yield b"\r\n"
+            if size == 0:
+                return
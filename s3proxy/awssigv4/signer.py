@@ -0,0 +1,196 @@
+import hmac
+import urllib.parse
+from collections import OrderedDict
+from functools import lru_cache
+from hashlib import sha256
+from typing import NamedTuple
+
+from .sigv4 import format_amz_date, normalize_url_path
+
+EMPTY_BODY_HASH = sha256(b"").hexdigest()
+UNSIGNED_PAYLOAD = "UNSIGNED-PAYLOAD"
+QUOTE_CACHE_SIZE = 8192
+
+
+class SigningRequest(NamedTuple):
+    method: str
+    path: str
+    headers: dict
+    params: dict | None = None
+    body_hash: str | None = None
+
+
+@lru_cache(maxsize=QUOTE_CACHE_SIZE)
+def quote_path(path):
+    if len(path) == 0:
+        path = "/"
+    if path[0] != "/":
+        path = "/" + path
+    return urllib.parse.quote(normalize_url_path(path), safe="/~")
+
+
+@lru_cache(maxsize=QUOTE_CACHE_SIZE)
+def quote_param(value):
+    return urllib.parse.quote(value, safe="~")
+
+
+def get_canonical_query(params):
+    if not params:
+        return ""
+    qs_params = []
+    for name, value in params.items():
+        qvalue = quote_param(str(value)) if value is not None else ""
+        qs_params.append(quote_param(str(name)) + "=" + qvalue)
+    qs_params.sort()
+    return "&".join(qs_params)
+
+
+def get_canonical_headers(headers):
+    headers_to_sign = sorted(
+        (name.lower(), value.strip() if value is not None else "") for name, value in headers.items()
+    )
+    canonical_headers = "".join(name + ":" + value + "\n" for name, value in headers_to_sign)
+    signed_headers = ";".join(name for name, _ in headers_to_sign)
+    return canonical_headers, signed_headers
+
+
+class SigV4Signer:
+    """
+    AWS Signature Version 4 signer bound to a single region and service.
+
+    Produces the same authorization header as `get_v4_signature` but derives the signing key once per day for
+    every access key instead of on every request. Keys are evicted when the date rolls over or when the secret
+    for given access key changes (credential rotation).
+    """
+
+    def __init__(self, region, service, max_signing_keys=64):
+        self.region = region
+        self.service = service
+        self._max_signing_keys = max_signing_keys
+        # access_key -> (secret_key, date, signing key)
+        self._signing_keys = OrderedDict()
+
+    def get_scope(self, date):
+        return date + "/" + self.region + "/" + self.service + "/aws4_request"
+
+    def get_signing_key(self, access_key, secret_key, date):
+        cached = self._signing_keys.get(access_key)
+        if cached is not None and cached[0] == secret_key and cached[1] == date:
+            self._signing_keys.move_to_end(access_key)
+            return cached[2]
+        k_date = hmac.new(("AWS4" + secret_key).encode("utf-8"), date.encode("utf-8"), sha256).digest()
+        k_region = hmac.new(k_date, self.region.encode("utf-8"), sha256).digest()
+        k_service = hmac.new(k_region, self.service.encode("utf-8"), sha256).digest()
+        k_signing = hmac.new(k_service, b"aws4_request", sha256).digest()
+        if cached is None or cached[1] != date:
+            # date rolled over, all keys derived for previous dates are useless now
+            self._evict_dates_other_than(date)
+        self._signing_keys[access_key] = (secret_key, date, k_signing)
+        self._signing_keys.move_to_end(access_key)
+        while len(self._signing_keys) > self._max_signing_keys:
+            self._signing_keys.popitem(last=False)
+        return k_signing
+
+    def _evict_dates_other_than(self, date):
+        for access_key in [key for key, cached in self._signing_keys.items() if cached[1] != date]:
+            del self._signing_keys[access_key]
+
+    def invalidate(self, access_key=None):
+        if access_key is None:
+            self._signing_keys.clear()
+        else:
+            self._signing_keys.pop(access_key, None)
+
+    def get_signature(self, signing_key, string_to_sign):
+        return hmac.new(signing_key, string_to_sign.encode("utf-8"), sha256).hexdigest()
+
+    def get_canonical_request(self, method, path, headers, params=None, body_hash=None):
+        canonical_headers, signed_headers = get_canonical_headers(headers)
+        canonical_request = "\n".join(
+            (
+                method,
+                quote_path(path),
+                get_canonical_query(params),
+                canonical_headers,
+                signed_headers,
+                body_hash if body_hash is not None else EMPTY_BODY_HASH,
+            )
+        )
+        return canonical_request, signed_headers
+
+    def get_string_to_sign(self, canonical_request, amz_date):
+        return "\n".join(
+            (
+                "AWS4-HMAC-SHA256",
+                amz_date,
+                self.get_scope(amz_date[:8]),
+                sha256(canonical_request.encode("utf-8")).hexdigest(),
+            )
+        )
+
+    def sign(self, access_key, secret_key, method, path, headers, params=None, body_hash=None):
+        """
+        Returns value of the authorization header. Just like `get_v4_signature` it sets `x-amz-date` header
+        when it's missing, so `headers` must contain exactly the headers which are going to be signed.
+        """
+        if headers.get("x-amz-content-sha256") == "UNSIGNED-PAYLOAD":
+            body_hash = "UNSIGNED-PAYLOAD"
+        amz_date = headers.setdefault("x-amz-date", format_amz_date())
+        date = amz_date[:8]
+        canonical_request, signed_headers = self.get_canonical_request(method.upper(), path, headers, params, body_hash)
+        string_to_sign = self.get_string_to_sign(canonical_request, amz_date)
+        signature = self.get_signature(self.get_signing_key(access_key, secret_key, date), string_to_sign)
+        return (
+            "AWS4-HMAC-SHA256 Credential="
+            + access_key
+            + "/"
+            + self.get_scope(date)
+            + ", SignedHeaders="
+            + signed_headers
+            + ", Signature="
+            + signature
+        )
+
+    def presign(self, access_key, secret_key, method, path, host, params, expires, session_token=None, amz_date=None):
+        """
+        Returns query parameters of presigned URL: `params` extended with X-Amz-* authentication parameters.
+        Only the host header is signed and the payload is unsigned, just like in URLs presigned by AWS SDKs.
+        """
+        amz_date = amz_date or format_amz_date()
+        date = amz_date[:8]
+        query = dict(params)
+        query["X-Amz-Algorithm"] = "AWS4-HMAC-SHA256"
+        query["X-Amz-Credential"] = access_key + "/" + self.get_scope(date)
+        query["X-Amz-Date"] = amz_date
+        query["X-Amz-Expires"] = str(expires)
+        query["X-Amz-SignedHeaders"] = "host"
+        if session_token is not None:
+            query["X-Amz-Security-Token"] = session_token
+        canonical_request, _ = self.get_canonical_request(method.upper(), path, {"host": host}, query, UNSIGNED_PAYLOAD)
+        string_to_sign = self.get_string_to_sign(canonical_request, amz_date)
+        query["X-Amz-Signature"] = self.get_signature(
+            self.get_signing_key(access_key, secret_key, date), string_to_sign
+        )
+        return query
+
+    def sign_batch(self, access_key, secret_key, requests):
+        """
+        Signs many `SigningRequest` with the same credentials, returns list of authorization headers in the same
+        order. Requests without `x-amz-date` header share single timestamp.
+        """
+        amz_date = format_amz_date()
+        authorizations = []
+        for request in requests:
+            request.headers.setdefault("x-amz-date", amz_date)
+            authorizations.append(
+                self.sign(
+                    access_key,
+                    secret_key,
+                    request.method,
+                    request.path,
+                    request.headers,
+                    params=request.params,
+                    body_hash=request.body_hash,
+                )
+            )
+        return authorizations
@@ -0,0 +1,78 @@
+"""
+Credential broker: the supervisor refreshes upstream credentials once and worker processes get them over a unix socket,
+instead of every worker calling the instance metadata service and STS on its own.
+"""
+import asyncio
+import json
+
+from .aws import AwsAccessProvider, Credentials
+from .logging import root_logger
+
+logger = root_logger.getChild(__name__)
+
+
+class CredentialBroker:
+    """
+    Serves credentials of `providers` (backend name -> `AwsAccessProvider`) on the unix socket at `path`. Request is
+    a line with the backend name, response is a line of JSON with the credentials or the error.
+    """
+
+    def __init__(self, providers, path):
+        self.providers = providers
+        self.path = path
+        self.served = 0
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_unix_server(self.handle, self.path)
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for provider in self.providers.values():
+            await provider.close()
+
+    async def get_reply(self, name):
+        provider = self.providers.get(name)
+        if provider is None:
+            return {"error": f"No credentials of backend {name}"}
+        try:
+            credentials = await provider.get_access_credentials()
+        except Exception as e:
+            logger.warning("Failed to get credentials of backend %s", name, exc_info=e)
+            return {"error": repr(e)}
+        self.served += 1
+        return credentials._asdict()
+
+    async def handle(self, reader, writer):
+        try:
+            name = (await reader.readline()).decode("utf-8").strip()
+            writer.write(json.dumps(await self.get_reply(name)).encode("utf-8") + b"\n")
+            await writer.drain()
+        finally:
+            writer.close()
+
+
+class BrokeredAccessProvider(AwsAccessProvider):
+    """
+    Provides credentials of the backend got from the broker at `path`. They're renewed `refresh_margin` seconds
+    before they expire, which should be less than the margin of the broker, so it has renewed them already.
+    """
+
+    def __init__(self, path, backend_name, refresh_margin=150, retry_delay=10):
+        super().__init__(refresh_margin=refresh_margin, retry_delay=retry_delay)
+        self._path = path
+        self._backend_name = backend_name
+
+    async def fetch_credentials(self):
+        reader, writer = await asyncio.open_unix_connection(self._path)
+        try:
+            writer.write(self._backend_name.encode("utf-8") + b"\n")
+            await writer.drain()
+            reply = json.loads(await reader.readline())
+        finally:
+            writer.close()
+        if "error" in reply:
+            raise Exception(f"Credential broker failed: {reply['error']}")
+        return Credentials(**reply)
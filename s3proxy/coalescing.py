@@ -0,0 +1,273 @@
+import asyncio
+from collections import deque
+
+from .logging import root_logger
+from .s3 import get_resource_params, is_signed
+
+logger = root_logger.getChild(__name__)
+
+COALESCED_METHODS = {"GET", "HEAD"}
+# headers which change the response, requests differing in any of them are never coalesced
+KEY_HEADERS = ("range", "if-match", "if-none-match", "if-modified-since", "if-unmodified-since")
+# x-amz-* headers which are unique for every request and don't change the response
+IGNORED_AMZ_HEADERS = {"x-amz-date", "x-amz-content-sha256", "x-amz-security-token", "x-amz-user-agent"}
+
+
+class ReaderDetached(Exception):
+    pass
+
+
+class FlightReader:
+    def __init__(self):
+        self.position = 0
+        self.detached = False
+
+
+class Flight:
+    """
+    Single upstream response shared by many readers.
+
+    Body chunks are kept in a buffer until the slowest reader consumes them. When the buffer grows over `window`
+    bytes the slowest readers are detached, so they don't stall the faster ones, and continue on their own.
+    When all readers are equally slow the upstream is not read until they catch up.
+    """
+
+    def __init__(self, key, window, on_unjoinable):
+        self.key = key
+        self.window = window
+        self.response = None
+        self.ready = asyncio.get_running_loop().create_future()
+        self.readers = []
+        self.joinable = True
+        self._on_unjoinable = on_unjoinable
+        # (offset, chunk)
+        self._chunks = deque()
+        self._end = 0
+        self._done = False
+        self._error = None
+        self._changed = asyncio.Event()
+        self._task = None
+
+    def start(self, fetch):
+        self._task = asyncio.get_running_loop().create_task(self._pump(fetch))
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def attach(self):
+        reader = FlightReader()
+        self.readers.append(reader)
+        return reader
+
+    def detach(self, reader):
+        if reader in self.readers:
+            self.readers.remove(reader)
+            reader.detached = True
+            self._trim()
+            self._notify()
+        if not self.readers and not self._done and self._task is not None:
+            # requests coming before the cancelled task finishes start a new flight
+            if self.joinable:
+                self.joinable = False
+                self._on_unjoinable(self)
+            self._task.cancel()
+
+    def _min_position(self):
+        return min(reader.position for reader in self.readers)
+
+    def _detach_slowest(self):
+        slowest = self._min_position()
+        if all(reader.position == slowest for reader in self.readers):
+            return False
+        for reader in [reader for reader in self.readers if reader.position == slowest]:
+            logger.debug("Detaching slow reader of %s at %d", self.key, reader.position)
+            self.detach(reader)
+        return True
+
+    def _trim(self):
+        if not self.readers:
+            return
+        position = self._min_position()
+        while self._chunks and self._chunks[0][0] + len(self._chunks[0][1]) <= position:
+            self._chunks.popleft()
+            if self.joinable:
+                # late readers can't join any more, beginning of the body is gone
+                self.joinable = False
+                self._on_unjoinable(self)
+
+    async def _pump(self, fetch):
+        try:
+            self.response = await fetch()
+            self.ready.set_result(self.response)
+            async for chunk in self.response.aiter_raw():
+                self._chunks.append((self._end, chunk))
+                self._end += len(chunk)
+                self._notify()
+                while self.readers and self._end - self._min_position() >= self.window:
+                    if not self._detach_slowest():
+                        await self._changed.wait()
+        except asyncio.CancelledError:
+            self._error = ReaderDetached("All readers are gone")
+        except Exception as e:
+            self._error = e
+            if not self.ready.done():
+                self.ready.set_exception(e)
+        finally:
+            self._done = True
+            if self.joinable:
+                self.joinable = False
+                self._on_unjoinable(self)
+            if not self.ready.done():
+                self.ready.cancel()
+            if self.response is not None:
+                await self.response.aclose()
+            self._notify()
+
+    async def read(self, reader):
+        """
+        Returns next chunk for the reader, None at the end of the body.
+        """
+        while True:
+            if reader.detached:
+                raise ReaderDetached()
+            for offset, chunk in self._chunks:
+                if offset == reader.position:
+                    reader.position += len(chunk)
+                    self._trim()
+                    self._notify()
+                    return chunk
+            if self._done:
+                if self._error is not None:
+                    raise self._error
+                return None
+            await self._changed.wait()
+
+
+class CoalescedResponse:
+    """
+    Quacks like streamed `httpx.Response` for the code sending it back to the client.
+    """
+
+    def __init__(self, flight, reader, fallback):
+        self._flight = flight
+        self._reader = reader
+        self._fallback = fallback
+        self.status_code = flight.response.status_code
+        self.headers = flight.response.headers
+
+    async def aiter_raw(self):
+        try:
+            while True:
+                chunk = await self._flight.read(self._reader)
+                if chunk is None:
+                    return
+                yield chunk
+        except ReaderDetached:
+            async for chunk in self._fallback(self._reader.position):
+                yield chunk
+
+    async def aclose(self):
+        self._flight.detach(self._reader)
+
+
+def get_range_from(response, position):
+    """
+    Returns Range header resuming given response from the position or None when it's not possible.
+    """
+    if response.status_code == 200 and "content-encoding" not in response.headers:
+        return f"bytes={position}-"
+    content_range = response.headers.get("content-range", "")
+    if response.status_code == 206 and content_range.startswith("bytes "):
+        start, _, end = content_range.removeprefix("bytes ").partition("/")[0].partition("-")
+        return f"bytes={int(start) + position}-{end}"
+    return None
+
+
+class RequestCoalescer:
+    """
+    Shares a single upstream request between concurrent identical GET and HEAD requests.
+    """
+
+    def __init__(self, window=8 * 1024**2):
+        self.window = window
+        self.flights = 0
+        self.coalesced = 0
+        self._in_flight = {}
+
+    def get_key(self, request, extra_headers):
+        if request.method not in COALESCED_METHODS or int(request.headers.get("content-length", 0)) > 0:
+            return None
+        headers = {**request.headers, **extra_headers}
+        return (
+            request.method,
+            # anonymous requests never get response of signed one, upstream may deny them
+            is_signed(request),
+            request.url.path,
+            tuple(sorted(get_resource_params(request.query_params))),
+            tuple(headers.get(name) for name in KEY_HEADERS),
+            tuple(
+                sorted(
+                    (name, value)
+                    for name, value in headers.items()
+                    if name.startswith("x-amz-") and name not in IGNORED_AMZ_HEADERS
+                )
+            ),
+        )
+
+    def _forget(self, flight):
+        if self._in_flight.get(flight.key) is flight:
+            del self._in_flight[flight.key]
+
+    def wrap(self, request, fetch):
+        """
+        Wraps `fetch(extra_headers)` coroutine returning upstream response of the request, so that identical
+        requests in flight share single upstream response.
+        """
+
+        async def coalesced_fetch(extra_headers=None):
+            extra_headers = extra_headers or {}
+            key = self.get_key(request, extra_headers)
+            if key is None:
+                return await fetch(extra_headers)
+            flight = self._in_flight.get(key)
+            if flight is None or not flight.joinable:
+                flight = Flight(key, self.window, self._forget)
+                self._in_flight[key] = flight
+                flight.start(lambda: fetch(extra_headers))
+                self.flights += 1
+            else:
+                self.coalesced += 1
+            reader = flight.attach()
+            try:
+                await asyncio.shield(flight.ready)
+            except BaseException:
+                flight.detach(reader)
+                raise
+
+            async def fallback(position):
+                async for chunk in self._resume(request, fetch, extra_headers, flight.response, position):
+                    yield chunk
+
+            return CoalescedResponse(flight, reader, fallback)
+
+        return coalesced_fetch
+
+    async def _resume(self, request, fetch, extra_headers, response, position):
+        """
+        Streams the rest of the shared response from the position for a reader detached from the flight.
+        """
+        range_header = get_range_from(response, position)
+        if range_header is None:
+            raise Exception(f"Can't resume detached reader of {request.url.path}")
+        response = await fetch({**extra_headers, "range": range_header})
+        try:
+            if response.status_code != 206:
+                raise Exception(f"Unexpected status {response.status_code} resuming {request.url.path}")
+            async for chunk in response.aiter_raw():
+                yield chunk
+        finally:
+            await response.aclose()
+
+    def stats(self):
+        return {"flights": self.flights, "coalesced": self.coalesced, "in_flight": len(self._in_flight)}
@@ -0,0 +1,392 @@
+"""
+Transparent compression: objects under configured prefixes are stored compressed with zstd in the seekable format,
+frames of fixed size followed by the seek table, so Range GETs decompress just the frames covering the range.
+"""
+import asyncio
+import hashlib
+import struct
+import tempfile
+
+import httpx
+
+from .logging import root_logger
+from .s3 import (
+    PRESIGNED_PARAMS,
+    BodyDigests,
+    S3Error,
+    get_bucket_key,
+    get_object_headers,
+    parse_content_range,
+    parse_range,
+    resolve_range,
+)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = root_logger.getChild(__name__)
+
+# metadata marking compressed objects, with the size of the original body
+METADATA_PREFIX = "x-amz-meta-s3proxy-"
+ENCODING_HEADER = "x-amz-meta-s3proxy-encoding"
+SIZE_HEADER = "x-amz-meta-s3proxy-size"
+ENCODING = "zstd-seekable"
+# PutObject with these is passed as it is: already encoded bodies, copies and checksums of the stored body
+BYPASS_HEADERS = ("content-encoding", "x-amz-copy-source", "x-amz-sdk-checksum-algorithm")
+# seekable format: skippable frame with entries of (compressed size, decompressed size) and footer
+SKIPPABLE_MAGIC = 0x184D2A5E
+SEEKABLE_MAGIC = 0x8F92EAB1
+SKIPPABLE_HEADER = struct.Struct("<II")
+ENTRY = struct.Struct("<II")
+FOOTER = struct.Struct("<IBI")
+CHECKSUM_FLAG = 0x80
+# end of the object fetched first by Range GET, the seek table of objects up to a few GiB fits in it
+TAIL_SIZE = 64 * 1024
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def build_seek_table(frames):
+    entries = b"".join(ENTRY.pack(compressed, decompressed) for compressed, decompressed in frames)
+    footer = FOOTER.pack(len(frames), 0, SEEKABLE_MAGIC)
+    return SKIPPABLE_HEADER.pack(SKIPPABLE_MAGIC, len(entries) + len(footer)) + entries + footer
+
+
+def get_seek_table_size(data):
+    """
+    Returns size of the seek table at the end of `data`, from its footer.
+    """
+    if len(data) < FOOTER.size:
+        raise ValueError("Seek table not found")
+    count, descriptor, magic = FOOTER.unpack_from(data, len(data) - FOOTER.size)
+    if magic != SEEKABLE_MAGIC:
+        raise ValueError("Seek table not found")
+    entry_size = ENTRY.size + (4 if descriptor & CHECKSUM_FLAG else 0)
+    return SKIPPABLE_HEADER.size + count * entry_size + FOOTER.size
+
+
+def parse_seek_table(data):
+    """
+    Returns frames of the seek table at the end of `data` as (compressed size, decompressed size).
+    """
+    offset = len(data) - get_seek_table_size(data) + SKIPPABLE_HEADER.size
+    count, descriptor, _ = FOOTER.unpack_from(data, len(data) - FOOTER.size)
+    entry_size = ENTRY.size + (4 if descriptor & CHECKSUM_FLAG else 0)
+    return [ENTRY.unpack_from(data, offset + index * entry_size) for index in range(count)]
+
+
+def find_frames(frames, start, end):
+    """
+    Returns (compressed start, compressed end, decompressed start) of the frames covering the inclusive range
+    of decompressed bytes.
+    """
+    compressed_offset = offset = 0
+    first = None
+    for compressed, decompressed in frames:
+        if first is None and offset + decompressed > start:
+            first = compressed_offset, offset
+        if offset + decompressed > end:
+            break
+        compressed_offset += compressed
+        offset += decompressed
+    return first[0], compressed_offset + compressed - 1, first[1]
+
+
+def get_decoded_headers(headers):
+    return httpx.Headers(
+        [(name, value) for name, value in headers.multi_items() if not name.startswith(METADATA_PREFIX)]
+    )
+
+
+def accepts_zstd(accept_encoding):
+    for coding in (accept_encoding or "").split(","):
+        name, _, params = coding.partition(";")
+        if name.strip().lower() == "zstd":
+            return params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+
+async def check_partial(response, description):
+    if response.status_code == 206:
+        return
+    await response.aclose()
+    if response.status_code == 412:
+        # the object was replaced between the reads, clients retry SlowDown
+        raise S3Error(503, "SlowDown", f"The object changed while {description} was read, please retry")
+    raise S3Error(500, "InternalError", f"Unexpected status {response.status_code} of {description}")
+
+
+async def read_body(response):
+    try:
+        return b"".join([chunk async for chunk in response.aiter_raw()])
+    finally:
+        await response.aclose()
+
+
+class BufferedResponse:
+    """
+    Quacks like streamed `httpx.Response` with the body read already.
+    """
+
+    def __init__(self, content):
+        self.content = content
+
+    async def aiter_raw(self):
+        yield self.content
+
+    async def aclose(self):
+        pass
+
+
+class DecodedResponse:
+    """
+    Quacks like streamed `httpx.Response`, body is the body of the `response` decompressed (unless `decompress` is
+    False) with the first `skip` bytes dropped, `length` bytes at most.
+    """
+
+    def __init__(self, status_code, headers, response, decompress=True, skip=0, length=None):
+        self.status_code = status_code
+        self.headers = headers
+        self._response = response
+        self._decompress = decompress
+        self._skip = skip
+        self._length = length
+
+    async def aiter_raw(self):
+        if not self._decompress:
+            async for chunk in self._response.aiter_raw():
+                yield chunk
+            return
+        decompressor = zstandard.ZstdDecompressor().decompressobj(read_across_frames=True)
+        skip, remaining = self._skip, self._length
+        async for chunk in self._response.aiter_raw():
+            # decompression doesn't block the event loop
+            data = await asyncio.to_thread(decompressor.decompress, chunk)
+            if skip:
+                dropped = min(skip, len(data))
+                data = data[dropped:]
+                skip -= dropped
+            if remaining is not None:
+                data = data[:remaining]
+                remaining -= len(data)
+            if data:
+                yield data
+            if remaining == 0:
+                break
+        await self._response.aclose()
+
+    async def aclose(self):
+        await self._response.aclose()
+
+
+class CompressedBody:
+    """
+    Body compressed into seekable zstd frames while it's read, spooled in memory up to `memory_size` bytes then in
+    a temporary file, since the upload needs its size and digest before it's sent.
+    """
+
+    def __init__(self, level, memory_size):
+        self.compressor = zstandard.ZstdCompressor(level=level, write_checksum=True)
+        self.file = tempfile.SpooledTemporaryFile(max_size=memory_size)
+        self.sha256 = hashlib.sha256()
+        self.frames = []
+        self.size = 0
+
+    def write(self, data):
+        self.file.write(data)
+        self.sha256.update(data)
+        self.size += len(data)
+
+    def add_frame(self, data):
+        frame = self.compressor.compress(bytes(data))
+        self.write(frame)
+        self.frames.append((len(frame), len(data)))
+
+    def finish(self):
+        self.write(build_seek_table(self.frames))
+
+    async def iterate(self):
+        self.file.seek(0)
+        while chunk := self.file.read(READ_CHUNK_SIZE):
+            yield chunk
+
+    def close(self):
+        self.file.close()
+
+
+class ObjectCompressor:
+    """
+    Compresses bodies of PutObject under `prefixes` (`bucket` or `bucket/key-prefix`) into zstd frames of
+    `frame_size` bytes and marks the objects with metadata. GETs of marked objects are decompressed, or passed
+    compressed with `content-encoding: zstd` to clients accepting it. Range GETs read the seek table from the end
+    of the object first and fetch just the frames covering the range.
+    """
+
+    def __init__(self, prefixes, level=3, frame_size=1024**2, memory_size=1024**2):
+        if zstandard is None:
+            raise RuntimeError("Compression requires `zstandard` package, install s3proxy[compression]")
+        self.prefixes = [tuple(prefix.partition("/")[::2]) for prefix in prefixes]
+        self.level = level
+        self.frame_size = frame_size
+        self.memory_size = memory_size
+        self.uploads = 0
+        self.uploaded_bytes = 0
+        self.stored_bytes = 0
+        self.decompressed = 0
+        self.passed_compressed = 0
+        self.ranged = 0
+
+    def matches(self, path):
+        bucket, key = get_bucket_key(path)
+        return key is not None and any(bucket == name and key.startswith(prefix) for name, prefix in self.prefixes)
+
+    def accepts(self, request):
+        headers = request.headers
+        if request.method != "PUT" or request.query_params or "authorization" not in headers:
+            return False
+        if "content-length" not in headers or not self.matches(request.url.path):
+            return False
+        if headers.get("x-amz-content-sha256", "").startswith("STREAMING-"):
+            return False
+        return not any(name in headers for name in BYPASS_HEADERS) and not any(
+            name.startswith("x-amz-checksum-") for name in headers
+        )
+
+    async def compress(self, request, body):
+        compressed = CompressedBody(self.level, self.memory_size)
+        digests = BodyDigests(request.headers)
+        buffer = bytearray()
+        try:
+            async for chunk in body:
+                digests.update(chunk)
+                buffer += chunk
+                while len(buffer) >= self.frame_size:
+                    # compression doesn't block the event loop
+                    await asyncio.to_thread(compressed.add_frame, buffer[: self.frame_size])
+                    del buffer[: self.frame_size]
+            if buffer:
+                await asyncio.to_thread(compressed.add_frame, buffer)
+            digests.check()
+            compressed.finish()
+        except BaseException:
+            compressed.close()
+            raise
+        return compressed, digests.size
+
+    async def upload(self, backend, request, body=None):
+        """
+        Returns response of the upload of the compressed request body, or of `body` replaying it.
+        """
+        compressed, size = await self.compress(request, body if body is not None else request.stream())
+        headers = get_object_headers(request.headers)
+        headers.update({ENCODING_HEADER: ENCODING, SIZE_HEADER: str(size), "content-length": str(compressed.size)})
+        try:
+            response = await backend.send(
+                "PUT", request.url, {}, headers, compressed.iterate(), compressed.sha256.hexdigest(), stream=True
+            )
+        finally:
+            compressed.close()
+        self.uploads += 1
+        self.uploaded_bytes += size
+        self.stored_bytes += compressed.size
+        return response
+
+    def decode(self, request, response):
+        """
+        Returns response of compressed object as the client expects it.
+        """
+        if response.headers.get(ENCODING_HEADER) != ENCODING:
+            return response
+        # headers of coalesced response are shared by its readers
+        headers = get_decoded_headers(response.headers)
+        if response.status_code != 200:
+            return DecodedResponse(response.status_code, headers, response, decompress=False)
+        headers["vary"] = "accept-encoding"
+        if accepts_zstd(request.headers.get("accept-encoding")):
+            self.passed_compressed += 1
+            headers["content-encoding"] = "zstd"
+            return DecodedResponse(200, headers, response, decompress=False)
+        size = response.headers.get(SIZE_HEADER)
+        if size is None:
+            logger.warning("Size of compressed %s is not known, passing it as it is", request.url.path)
+            return response
+        self.decompressed += 1
+        headers["content-length"] = size
+        return DecodedResponse(200, headers, response)
+
+    def wrap(self, request, fetch):
+        """
+        Wraps `fetch(extra_headers)` coroutine returning upstream response, so that compressed objects are
+        decompressed.
+        """
+        if request.method not in ("GET", "HEAD") or not self.matches(request.url.path):
+            return fetch
+        if any(name not in PRESIGNED_PARAMS and name != "versionId" for name in request.query_params):
+            return fetch
+
+        async def decompressing_fetch(extra_headers=None):
+            extra_headers = extra_headers or {}
+            byte_range = parse_range(extra_headers.get("range", request.headers.get("range")))
+            if request.method == "GET" and byte_range is not None:
+                return await self._fetch_range(fetch, extra_headers, byte_range)
+            return self.decode(request, await fetch(extra_headers))
+
+        return decompressing_fetch
+
+    async def _read_seek_table(self, fetch, extra_headers, tail):
+        """
+        Returns frames of the object, its stored size and the end of it read along.
+        """
+        content = await read_body(tail)
+        total = len(content)
+        content_range = parse_content_range(tail.headers.get("content-range"))
+        if content_range is not None:
+            total = content_range[2]
+        table_size = get_seek_table_size(content)
+        if table_size > len(content):
+            range_header = f"bytes={total - table_size}-{total - 1}"
+            table = await fetch({**extra_headers, "range": range_header, "if-match": tail.headers.get("etag")})
+            await check_partial(table, "seek table")
+            content = await read_body(table)
+        return parse_seek_table(content), total, content
+
+    async def _fetch_range(self, fetch, extra_headers, byte_range):
+        tail = await fetch({**extra_headers, "range": f"bytes=-{TAIL_SIZE}"})
+        if tail.status_code >= 300:
+            return tail
+        if tail.headers.get(ENCODING_HEADER) != ENCODING:
+            # the object is not compressed, the range is fetched as it is
+            await tail.aclose()
+            return await fetch(extra_headers)
+        frames, total, content = await self._read_seek_table(fetch, extra_headers, tail)
+        size = sum(decompressed for _, decompressed in frames)
+        span = resolve_range(byte_range, size)
+        if span is None:
+            raise S3Error(416, "InvalidRange", "The requested range is not satisfiable")
+        start, end = span
+        compressed_start, compressed_end, frame_start = find_frames(frames, start, end)
+        self.ranged += 1
+        headers = get_decoded_headers(tail.headers)
+        headers["content-range"] = f"bytes {start}-{end}/{size}"
+        headers["content-length"] = str(end - start + 1)
+        offset = total - len(content)
+        if compressed_start >= offset:
+            # the frames were read along with the seek table
+            first, stop = compressed_start - offset, compressed_end - offset + 1
+            body = BufferedResponse(content[first:stop])
+        else:
+            range_header = f"bytes={compressed_start}-{compressed_end}"
+            body = await fetch({**extra_headers, "range": range_header, "if-match": tail.headers.get("etag")})
+            await check_partial(body, f"frames {range_header}")
+        return DecodedResponse(206, headers, body, skip=start - frame_start, length=end - start + 1)
+
+    def stats(self):
+        return {
+            "uploads": self.uploads,
+            "uploaded_bytes": self.uploaded_bytes,
+            "stored_bytes": self.stored_bytes,
+            "decompressed": self.decompressed,
+            "passed_compressed": self.passed_compressed,
+            "ranged": self.ranged,
+        }
@@ -1,8 +1,30 @@
+from typing import Literal
+
+from pydantic import BaseModel
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 from .version import __version__
 
 
+class BackendSettings(BaseModel):
+    name: str
+    endpoint_url: str
+    region: str = "us-east-1"
+    # instance credentials (or the role assumed with them) are used when keys are not set
+    access_key_id: str | None = None
+    secret_access_key: str | None = None
+    role_arn: str | None = None
+
+
+class RouteSettings(BaseModel):
+    bucket: str
+    # key prefix, the longest matching prefix of the bucket wins
+    prefix: str = ""
+    # replicas of the bucket, writes go to the first one
+    backends: list[str]
+    balancing: Literal["ewma", "least_outstanding"] = "ewma"
+
+
 class GlobalSettings(BaseSettings):
     model_config = SettingsConfigDict(
         # `.env.prod` takes priority over `.env`
@@ -15,11 +37,133 @@ class GlobalSettings(BaseSettings):
     SENTRY_DSN: str | None = None
     DEBUG: bool = False
     LOG_LEVEL: str = "INFO"
+    # log records are written by a background thread, records over the queue size are dropped
+    LOG_QUEUE_SIZE: int = 10000
+    LOG_BATCH_SIZE: int = 256
+    # line of JSON per proxied request, logged by `<APP_NAME>.access` logger
+    ACCESS_LOG: bool = False
+    # fraction of proxied requests traced, with spans of credentials, signing, upstream send and body streaming
+    TRACES_SAMPLE_RATE: float = 0.0
+    # `sentry` requires SENTRY_DSN, `opentelemetry` requires `opentelemetry-sdk` and
+    # `opentelemetry-exporter-otlp-proto-http` packages to be installed, OTLP endpoint is set by OTEL_EXPORTER_OTLP_*
+    TRACING_EXPORTER: Literal["sentry", "opentelemetry"] = "sentry"
+    # enables /_profile endpoint capturing CPU profile or event loop lag trace of the worker serving it
+    PROFILING: bool = False
+    PROFILING_MAX_DURATION: float = 60
     AWS_ACCESS_KEY_ID: str | None = None
     AWS_SECRET_ACCESS_KEY: str | None = None
     AWS_S3_ENDPOINT_URL: str | None = None
+    AWS_S3_REGION: str = "us-east-1"
+    # role assumed with instance credentials, instance profile of the host is used when not set
+    AWS_ROLE_ARN: str | None = None
+    AWS_STS_ENDPOINT_URL: str = "https://sts.amazonaws.com"
+    AWS_STS_REGION: str = "us-east-1"
+    # temporary credentials are renewed in the background that many seconds before they expire
+    AWS_CREDENTIALS_REFRESH_MARGIN: int = 300
+    # unix socket of the credential broker run by `s3proxy serve`, workers get upstream credentials from it
+    CREDENTIAL_BROKER_SOCKET: str | None = None
+    # worker processes of `s3proxy serve`, number of CPUs when not set
+    WORKERS: int | None = None
+    # worker which doesn't beat that many seconds (startup included) is restarted
+    WORKER_TIMEOUT: float = 30
+    # stopped worker finishes its requests within that many seconds
+    WORKER_GRACEFUL_TIMEOUT: int = 30
     B2_APP_KEY_ID: str | None = None
     B2_APP_KEY: str | None = None
+    UPSTREAM_MAX_CONNECTIONS: int = 1000
+    UPSTREAM_MAX_KEEPALIVE_CONNECTIONS: int = 100
+    UPSTREAM_KEEPALIVE_EXPIRY: float = 5.0
+    # requires `h2` package to be installed
+    UPSTREAM_HTTP2: bool = False
+    # signatures of the clients are verified against CLIENT_CREDENTIALS, JSON object of access key id -> secret key
+    VERIFY_CLIENT_SIGNATURES: bool = False
+    CLIENT_CREDENTIALS: dict[str, str] = {}
+    # requests signed that many seconds away from now are rejected
+    CLIENT_SIGNATURE_MAX_SKEW: int = 900
+    # requests over the limits wait in a queue, when it's full or the wait takes too long they get 503 SlowDown
+    ADMISSION_CONTROL: bool = False
+    ADMISSION_MAX_REQUESTS: int = 1000
+    # limits of a tenant: access key id of the client, or the access key id and the bucket with ADMISSION_BY_BUCKET
+    ADMISSION_TENANT_MAX_REQUESTS: int = 100
+    # bytes per second of request and response bodies, not limited when not set
+    ADMISSION_TENANT_BANDWIDTH: int | None = None
+    ADMISSION_BY_BUCKET: bool = False
+    ADMISSION_MAX_QUEUE: int = 100
+    ADMISSION_QUEUE_TIMEOUT: float = 5
+    ADMISSION_RETRY_AFTER: int = 1
+    # response is aborted when the client doesn't read a chunk for that many seconds
+    ADMISSION_SEND_TIMEOUT: float | None = 60
+    # GET object cache is enabled when directory is set, only signed requests are served from it
+    OBJECT_CACHE_DIR: str | None = None
+    OBJECT_CACHE_MAX_SIZE: int = 10 * 1024**3
+    OBJECT_CACHE_MAX_OBJECT_SIZE: int = 512 * 1024**2
+    # cached objects are served without revalidation for that many seconds
+    OBJECT_CACHE_TTL: float = 60
+    # concurrent identical GET and HEAD requests share single upstream request
+    REQUEST_COALESCING: bool = False
+    # body buffered for readers of shared upstream response, slower readers are detached and continue on their own
+    REQUEST_COALESCING_BUFFER_SIZE: int = 8 * 1024**2
+    # HEAD Object responses and ListObjects pages are cached in memory for METADATA_CACHE_TTL seconds,
+    # only signed requests are served from it
+    METADATA_CACHE: bool = False
+    METADATA_CACHE_TTL: float = 10
+    METADATA_CACHE_MAX_SIZE: int = 64 * 1024**2
+    # larger list pages are not cached
+    METADATA_CACHE_MAX_ENTRY_SIZE: int = 1024**2
+    # GETs larger than the threshold are fetched as parallel Range requests, disabled when not set
+    PARALLEL_GET_THRESHOLD: int | None = None
+    PARALLEL_GET_PART_SIZE: int = 8 * 1024**2
+    # parts fetched or buffered at a time by single GET
+    PARALLEL_GET_CONCURRENCY: int = 4
+    # sequential Range GETs of the same object are answered from prefetched windows
+    READAHEAD: bool = False
+    READAHEAD_MIN_WINDOW: int = 1024**2
+    READAHEAD_MAX_WINDOW: int = 16 * 1024**2
+    # memory shared by windows of all read streams
+    READAHEAD_BUFFER_SIZE: int = 256 * 1024**2
+    # number of adjacent Range GETs after which the stream is considered sequential
+    READAHEAD_TRIGGER: int = 2
+    # upstreams besides the default one (AWS_S3_ENDPOINT_URL) as JSON list of `BackendSettings`
+    BACKENDS: list[BackendSettings] = []
+    # buckets or key prefixes served by the backends as JSON list of `RouteSettings`, the rest goes to the default one
+    ROUTES: list[RouteSettings] = []
+    # replica is ejected from balancing for BACKEND_EJECT_DURATION seconds after that many consecutive failures
+    BACKEND_EJECT_AFTER: int = 3
+    BACKEND_EJECT_DURATION: float = 30
+    # GETs and HEADs still waiting for response headers after HEDGING_PERCENTILE of recent waits are sent again
+    HEDGING: bool = False
+    HEDGING_PERCENTILE: float = 0.95
+    # fraction of requests which may be duplicated
+    HEDGING_BUDGET: float = 0.05
+    HEDGING_MIN_DELAY: float = 0.005
+    # upstream connection errors and 5xx responses of GETs and HEADs are retried that many times with exponential
+    # backoff and jitter, 0 disables retries
+    UPSTREAM_RETRIES: int = 2
+    # PUTs and DELETEs are retried too, their bodies are spooled to be replayed
+    UPSTREAM_RETRY_WRITES: bool = False
+    UPSTREAM_RETRY_BASE_DELAY: float = 0.05
+    UPSTREAM_RETRY_MAX_DELAY: float = 1.0
+    # fraction of requests which may be retried
+    UPSTREAM_RETRY_BUDGET: float = 0.1
+    # bodies of retried writes up to that size are spooled to be replayed, in memory up to UPSTREAM_RETRY_MEMORY_SIZE
+    # then on disk
+    UPSTREAM_RETRY_MAX_BODY_SIZE: int = 16 * 1024**2
+    UPSTREAM_RETRY_MEMORY_SIZE: int = 1024**2
+    # PUTs larger than the threshold are uploaded as multipart uploads with parallel parts, disabled when not set,
+    # their ETag is the one of the multipart upload, not the MD5 of the body (PUTs with Content-MD5 are not converted)
+    MULTIPART_UPLOAD_THRESHOLD: int | None = None
+    # at least 5 MiB, S3 limit of all parts but the last one
+    MULTIPART_UPLOAD_PART_SIZE: int = 16 * 1024**2
+    # parts uploaded or buffered at a time by single PUT
+    MULTIPART_UPLOAD_CONCURRENCY: int = 4
+    # objects under these `bucket` or `bucket/key-prefix` are stored compressed with zstd, requires the `compression`
+    # extra to be installed
+    COMPRESSED_PREFIXES: list[str] = []
+    COMPRESSION_LEVEL: int = 3
+    # uncompressed bytes per frame, Range GETs decompress whole frames covering the range
+    COMPRESSION_FRAME_SIZE: int = 1024**2
+    # compressed bodies are spooled before the upload, in memory up to that size then on disk
+    COMPRESSION_MEMORY_SIZE: int = 1024**2
 
 
 settings = GlobalSettings()
@@ -33,13 +177,25 @@ LOGGING_CONFIG = {
             "format": "%(asctime)s %(levelname)s [%(name)s:%(lineno)d] %(message)s",
             "datefmt": "%d-%m-%Y %I:%M:%S",
         },
+        "access": {
+            "format": "%(message)s",
+        },
     },
     "handlers": {
         "console": {
-            "class": "logging.StreamHandler",
+            "class": "s3proxy.logqueue.QueueStreamHandler",
             "level": settings.LOG_LEVEL,
             "formatter": "standard",
             "stream": "ext://sys.stdout",
+            "queue_size": settings.LOG_QUEUE_SIZE,
+            "batch_size": settings.LOG_BATCH_SIZE,
+        },
+        "access": {
+            "class": "s3proxy.logqueue.QueueStreamHandler",
+            "formatter": "access",
+            "stream": "ext://sys.stdout",
+            "queue_size": settings.LOG_QUEUE_SIZE,
+            "batch_size": settings.LOG_BATCH_SIZE,
         },
     },
     "loggers": {
@@ -48,6 +204,11 @@ LOGGING_CONFIG = {
             "level": settings.LOG_LEVEL,
             "propagate": True,
         },
+        f"{settings.APP_NAME}.access": {
+            "handlers": ["access"],
+            "level": "INFO",
+            "propagate": False,
+        },
         "app": {
             "handlers": ["console"],
             "level": "ERROR",
@@ -0,0 +1,155 @@
+import asyncio
+from collections import deque
+
+from . import metrics
+from .logging import root_logger
+
+logger = root_logger.getChild(__name__)
+
+HEDGED_METHODS = {"GET", "HEAD"}
+# the delay is recomputed from the recent samples every that many samples
+RECOMPUTE_EVERY = 50
+
+
+async def close_response(task):
+    """
+    Cancels upstream request of the losing task or closes its response when it completed anyway.
+    """
+    if not task.done():
+        task.cancel()
+    try:
+        response = await task
+    except BaseException:
+        return
+    await response.aclose()
+
+
+class LatencyWindow:
+    """
+    Recent times to response headers of one backend and method, and hedging delay at their `percentile`.
+    """
+
+    def __init__(self, percentile, min_delay, size, min_samples):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.delay = None
+        self._samples = deque(maxlen=size)
+        self._new_samples = 0
+
+    def record(self, latency):
+        self._samples.append(latency)
+        self._new_samples += 1
+        if self._new_samples >= RECOMPUTE_EVERY and len(self._samples) >= self.min_samples:
+            self._new_samples = 0
+            samples = sorted(self._samples)
+            index = min(int(len(samples) * self.percentile), len(samples) - 1)
+            self.delay = max(samples[index], self.min_delay)
+
+
+class Hedger:
+    """
+    Sends duplicate of idempotent read which did not get response headers within `percentile` of recent times to
+    response headers of the same backend and method, the response coming first is used and the other request is
+    cancelled.
+
+    Hedges are limited by a budget: every request earns `budget` tokens (up to `max_tokens`) and every hedge spends
+    one, so at most `budget` fraction of requests is duplicated in the long run. Delay is never shorter than
+    `min_delay` and hedging starts once `min_samples` responses were measured. Primary request losing the race
+    is recorded with its time till then, so slow requests keep raising the percentile even when they're hedged.
+    """
+
+    def __init__(self, percentile=0.95, budget=0.05, min_delay=0.005, window=1000, min_samples=100, max_tokens=10):
+        self.percentile = percentile
+        self.budget = budget
+        self.min_delay = min_delay
+        self.window = window
+        self.min_samples = min_samples
+        self.max_tokens = max_tokens
+        self.tokens = 0.0
+        self.requests = 0
+        self.hedged = 0
+        self.wins = 0
+        # (backend, method) -> latency window
+        self._windows = {}
+
+    def get_window(self, backend, method):
+        window = self._windows.get((backend, method))
+        if window is None:
+            window = LatencyWindow(self.percentile, self.min_delay, self.window, self.min_samples)
+            self._windows[(backend, method)] = window
+        return window
+
+    def can_hedge(self, request):
+        return request.method in HEDGED_METHODS and int(request.headers.get("content-length", 0)) == 0
+
+    async def send(self, request, send, backend=None):
+        """
+        Returns upstream response of `send()` coroutine to the `backend`, hedged with another `send()` when it's late.
+        """
+        if not self.can_hedge(request):
+            return await send()
+        self.requests += 1
+        self.tokens = min(self.tokens + self.budget, self.max_tokens)
+        window = self.get_window(backend, request.method)
+        delay = window.delay
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        primary = loop.create_task(send())
+        try:
+            if delay is not None:
+                await asyncio.wait({primary}, timeout=delay)
+            if primary.done() or delay is None or self.tokens < 1:
+                response = await primary
+                window.record(loop.time() - started)
+                return response
+        except BaseException:
+            await close_response(primary)
+            raise
+        self.tokens -= 1
+        self.hedged += 1
+        metrics.HEDGED_REQUESTS.inc()
+        logger.debug("Hedging %s %s after %.3fs", request.method, request.url.path, delay)
+        return await self._race(window, primary, loop.create_task(send()), started, loop.time())
+
+    async def _race(self, window, primary, hedge, started, hedge_started):
+        loop = asyncio.get_running_loop()
+        pending = {primary, hedge}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((task for task in done if task.exception() is None), None)
+                if winner is None:
+                    if not pending:
+                        # both failed, primary error is raised
+                        return primary.result()
+                    continue
+                loser = hedge if winner is primary else primary
+                now = loop.time()
+                if not primary.done() or primary.exception() is None:
+                    # the primary which lost took at least that long
+                    window.record(now - started)
+                if winner is hedge:
+                    self.wins += 1
+                    metrics.HEDGE_WINS.inc()
+                    window.record(now - hedge_started)
+                await close_response(loser)
+                return winner.result()
+        except BaseException:
+            await close_response(primary)
+            await close_response(hedge)
+            raise
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "wins": self.wins,
+            "hedge_rate": self.hedged / self.requests if self.requests else 0.0,
+            "win_rate": self.wins / self.hedged if self.hedged else 0.0,
+            "delay_ms": {
+                f"{backend} {method}": window.delay * 1000
+                for (backend, method), window in self._windows.items()
+                if window.delay is not None
+            },
+        }
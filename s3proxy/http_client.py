@@ -1,16 +1,39 @@
+from collections import Counter
+
 import httpx
 
 
 class AsyncHttpClient:
-    def __init__(self, max_keepalive_connections=100, max_connections=1000):
+    def __init__(
+        self,
+        max_keepalive_connections=100,
+        max_connections=1000,
+        keepalive_expiry=5.0,
+        http2=False,
+        follow_redirects=False,
+        transport=None,
+    ):
         self._limits = httpx.Limits(
-            max_keepalive_connections=max_keepalive_connections, max_connections=max_connections
+            max_keepalive_connections=max_keepalive_connections,
+            max_connections=max_connections,
+            keepalive_expiry=keepalive_expiry,
         )
+        self._http2 = http2
+        self._follow_redirects = follow_redirects
+        # custom transport is used to plug in-process upstreams (e.g. ASGI apps) instead of the network
+        self._transport = transport
         self._session = None
+        self._requests_by_host = Counter()
+        self._in_flight_by_host = Counter()
 
     async def _get_session(self):
         if self._session is None:
-            self._session = await httpx.AsyncClient(limits=self._limits).__aenter__()
+            self._session = await httpx.AsyncClient(
+                limits=self._limits,
+                http2=self._http2,
+                follow_redirects=self._follow_redirects,
+                transport=self._transport,
+            ).__aenter__()
         return self._session
 
     async def close_session(self):
@@ -29,3 +52,54 @@ class AsyncHttpClient:
             await self.close_session()
             self._session = None
             return await self.request(*args, **kwargs)
+
+    async def build_request(self, *args, **kwargs):
+        session = await self._get_session()
+        return session.build_request(*args, **kwargs)
+
+    async def send(self, request, stream=False):
+        """
+        Sends prepared request through the shared connection pool.
+
+        When `stream` is True the caller owns the response and must close it (`await response.aclose()`) in order
+        to return the connection back to the pool.
+        """
+        session = await self._get_session()
+        host = request.url.netloc.decode("ascii")
+        self._requests_by_host[host] += 1
+        self._in_flight_by_host[host] += 1
+        try:
+            return await session.send(request, stream=stream)
+        finally:
+            self._in_flight_by_host[host] -= 1
+
+    def stats(self):
+        """
+        Returns per host statistics of the connection pool:
+
+        {"s3.amazonaws.com": {"requests": 10, "in_flight": 1, "connections": 2, "idle": 1}}
+
+        `requests` counts all requests sent to the host, `in_flight` counts requests waiting for response headers,
+        `connections` and `idle` describe the connections currently kept in the pool.
+        """
+        stats = {}
+        for host, requests in self._requests_by_host.items():
+            stats[host] = {
+                "requests": requests,
+                "in_flight": self._in_flight_by_host[host],
+                "connections": 0,
+                "idle": 0,
+            }
+        pool = getattr(getattr(self._session, "_transport", None), "_pool", None)
+        for connection in getattr(pool, "connections", []):
+            origin = getattr(connection, "_origin", None)
+            if origin is None:
+                continue
+            host = origin.host.decode("ascii")
+            if origin.port is not None and origin.port not in (80, 443):
+                host = f"{host}:{origin.port}"
+            host_stats = stats.setdefault(host, {"requests": 0, "in_flight": 0, "connections": 0, "idle": 0})
+            host_stats["connections"] += 1
+            if connection.is_idle():
+                host_stats["idle"] += 1
+        return stats
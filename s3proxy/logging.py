@@ -1,4 +1,5 @@
 import logging
+import logging.config
 
 from .config import LOGGING_CONFIG, settings
 
@@ -0,0 +1,120 @@
+"""
+Non-blocking logging: records are queued by the event loop and formatted and written by a background thread in
+batches, records over the queue size are dropped rather than waited for.
+"""
+import logging
+import queue
+import threading
+
+# seconds flush waits for the queued records to be written
+FLUSH_TIMEOUT = 5.0
+
+
+class LogWriter:
+    """
+    Writes records queued by handlers to the `stream`, up to `batch_size` records with single write and flush.
+    At most `queue_size` records wait for the writer, the ones over that are dropped and counted.
+    """
+
+    def __init__(self, stream, queue_size=10000, batch_size=256):
+        self.stream = stream
+        self.batch_size = batch_size
+        self.written = 0
+        self.dropped = 0
+        self._queue = queue.Queue(queue_size)
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, handler, record):
+        try:
+            self._queue.put_nowait((handler, record))
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout=FLUSH_TIMEOUT):
+        """
+        Waits until the records queued so far are written.
+        """
+        written = threading.Event()
+        try:
+            self._queue.put((None, written), timeout=timeout)
+        except queue.Full:
+            return
+        written.wait(timeout)
+
+    def _get_batch(self):
+        batch = [self._queue.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        lines = []
+        for handler, record in batch:
+            try:
+                lines.append(handler.format(record) + "\n")
+            except Exception:
+                handler.handleError(record)
+        if not lines:
+            return
+        try:
+            self.stream.write("".join(lines))
+            self.stream.flush()
+            self.written += len(lines)
+        except Exception:
+            self.dropped += len(lines)
+
+    def _run(self):
+        while True:
+            batch = self._get_batch()
+            self._write([(handler, record) for handler, record in batch if handler is not None])
+            for handler, flushed in batch:
+                if handler is None:
+                    flushed.set()
+
+    def stats(self):
+        return {"written": self.written, "dropped": self.dropped, "queued": self._queue.qsize()}
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(stream, queue_size, batch_size):
+    """
+    Returns writer of the stream, handlers writing to the same stream share it, so their lines are not interleaved.
+    """
+    with _writers_lock:
+        if id(stream) not in _writers:
+            _writers[id(stream)] = LogWriter(stream, queue_size, batch_size)
+        return _writers[id(stream)]
+
+
+def stats():
+    return {"written": sum(w.written for w in _writers.values()), "dropped": sum(w.dropped for w in _writers.values())}
+
+
+class QueueStreamHandler(logging.Handler):
+    """
+    Handler of `logging` writing to the stream through the background `LogWriter`.
+    """
+
+    def __init__(self, stream, queue_size=10000, batch_size=256):
+        super().__init__()
+        self.writer = get_writer(stream, queue_size, batch_size)
+
+    def emit(self, record):
+        try:
+            # arguments are rendered now, they may change before the writer gets to the record
+            record.msg = record.getMessage()
+            record.args = None
+        except Exception:
+            self.handleError(record)
+            return
+        self.writer.put(self, record)
+
+    def flush(self):
+        self.writer.flush()
@@ -1,20 +1,63 @@
+import argparse
+import asyncio
+import copy
+import os
 import time
 
-import httpx
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
 from starlette.applications import Starlette
-from starlette.datastructures import URL
-from starlette.responses import Response, StreamingResponse
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
 from starlette.routing import Route
 
-from . import sentry  # noqa: F401
+from . import logqueue, metrics, sentry  # noqa: F401
+from .accesslog import AccessEntry
+from .admission import AdmissionController
+from .auth import KeyStore, SignatureVerifier
 from .aws import AwsAccessProvider
-from .awssigv4 import get_v4_signature
-from .config import settings
+from .awssigv4 import (
+    STREAMING_PAYLOAD,
+    ChunkedPayloadError,
+    ChunkedPayloadSigner,
+    ChunkSignatureError,
+)
+from .awssigv4.sigv4 import format_amz_date
+from .broker import BrokeredAccessProvider
+from .coalescing import RequestCoalescer
+from .compression import ObjectCompressor
+from .config import BackendSettings, settings
+from .hedging import Hedger
 from .http_client import AsyncHttpClient
 from .logging import root_logger
+from .metadata_cache import MetadataCache
+from .multipart import MultipartUploader
+from .object_cache import ObjectCache
+from .passthrough import PassthroughApplication, PassthroughResponse
+from .presign import UrlPresigner, get_upstream_query
+from .profiling import Profiler, ProfilerBusy
+from .ranged import ParallelRangeFetcher
+from .readahead import ReadAhead
+from .retry import RetryPolicy
+from .routing import Backend, BucketRoute, ReplicaSet, Router
+from .s3 import S3Error
+from .tracing import OpenTelemetryExporter, SentryExporter, Tracer
+from .workers import Supervisor
 
-http_client = None
-aws_access_provider: AwsAccessProvider | None = None
+router: Router | None = None
+admission: AdmissionController | None = None
+verifier: SignatureVerifier | None = None
+url_presigner: UrlPresigner | None = None
+object_cache: ObjectCache | None = None
+metadata_cache: MetadataCache | None = None
+request_coalescer: RequestCoalescer | None = None
+range_fetcher: ParallelRangeFetcher | None = None
+read_ahead: ReadAhead | None = None
+hedger: Hedger | None = None
+retry_policy: RetryPolicy | None = None
+multipart_uploader: MultipartUploader | None = None
+compressor: ObjectCompressor | None = None
+tracer: Tracer | None = None
+profiler: Profiler | None = None
 
 
 def get_signed_headers(headers):
@@ -39,99 +82,592 @@ def get_signed_headers(headers):
         return []
 
 
-async def get_proxied_response(aws_provider: AwsAccessProvider, client, incoming_req):
+def get_chunk_signer(signer, credentials, amz_date, authorization):
+    """
+    Returns signer of aws-chunked body chained from the seed signature of the re-signed authorization header.
+    """
+    date = amz_date[:8]
+    return ChunkedPayloadSigner(
+        signer.get_signing_key(credentials.access_key, credentials.secret_key, date),
+        amz_date,
+        signer.get_scope(date),
+        authorization.rpartition("Signature=")[2],
+    )
+
+
+async def sign_headers(backend, incoming_req, headers, signed_headers_names, timer):
+    """
+    Replaces the authorization header with the one signed by the proxy, returns signer of aws-chunked body if any.
+    """
+    chunk_signer = None
+    # security token of the client is meaningless for the upstream, proxy credentials may bring their own
+    headers.pop("x-amz-security-token", None)
+    signed_headers = {k: v for k, v in headers.items() if k.lower() in signed_headers_names}
+    # every attempt is signed at its own time, so a retried request is not stale or a replay
+    headers["x-amz-date"] = signed_headers["x-amz-date"] = format_amz_date()
+    timer.credentials_started = time.perf_counter()
+    credentials = await backend.aws_provider.get_access_credentials()
+    timer.signing_started = time.perf_counter()
+    timer.credentials = timer.signing_started - timer.credentials_started
+    if credentials.session_token is not None:
+        headers["x-amz-security-token"] = signed_headers["x-amz-security-token"] = credentials.session_token
+    new_signature = backend.signer.sign(
+        credentials.access_key,
+        credentials.secret_key,
+        incoming_req.method,
+        incoming_req.url.path,
+        signed_headers,
+        params=incoming_req.query_params,
+        body_hash=headers.get("x-amz-content-sha256"),
+    )
+    headers["authorization"] = new_signature
+    if headers.get("x-amz-content-sha256") == STREAMING_PAYLOAD:
+        chunk_signer = get_chunk_signer(backend.signer, credentials, signed_headers["x-amz-date"], new_signature)
+    timer.signing = time.perf_counter() - timer.signing_started
+    return chunk_signer
+
+
+async def get_proxied_response(backend: Backend, incoming_req, extra_headers=None, body=None):
+    state = incoming_req.state
+    timer = metrics.UpstreamTimer(
+        incoming_req.method,
+        trace=getattr(state, "trace", None),
+        backend=backend.name,
+        access=getattr(state, "access", None),
+    )
     # Extract the target URL from the request
     # target_host = "s3.us-east-1.amazonaws.com"
-    target_url = URL(settings.AWS_S3_ENDPOINT_URL)
+    target_url = backend.endpoint_url
     target_url = incoming_req.url.replace(hostname=target_url.hostname, scheme=target_url.scheme, port=target_url.port)
-    root_logger.debug("Forwarding to: " + str(target_url))
+    root_logger.debug("Forwarding to: %s", target_url)
     # Create a new request to the target server
     headers = {k: v for k, v in incoming_req.headers.items()}
     endpoint = target_url.hostname
     headers["host"] = endpoint
+    if extra_headers:
+        # added by the proxy on its own e.g. to revalidate cached object, they're signed only if client signed them
+        headers.update(extra_headers)
     signed_headers_names = get_signed_headers(headers)
+    chunk_signer = None
     if len(signed_headers_names):
-        signed_headers = {k: v for k, v in headers.items() if k.lower() in signed_headers_names}
-        access_key, secret_key = await aws_provider.get_access_secret_key()
-        new_signature = get_v4_signature(
-            access_key,
-            secret_key,
-            endpoint,
-            "us-east-1",
-            "s3",
-            incoming_req.method,
-            incoming_req.url.path,
-            signed_headers,
-            params=incoming_req.query_params,
-            body_hash=headers.get("x-amz-content-sha256"),
-        )
-        headers["authorization"] = new_signature
-        # otherwise this is unsigned request or presigned url, and so we don't need to do anything
-        # presigned urls need to be created for specific host which is going to be used for download
-        # boto3 will use endpoint url for presigned url host therefore presigned url will be invalid if used with proxy
-        # such request could be rewritten to use endpoint host instead of proxy host just as authorization header does
+        chunk_signer = await sign_headers(backend, incoming_req, headers, signed_headers_names, timer)
+    elif "X-Amz-Signature" in incoming_req.query_params:
+        # presigned url is bound to the proxy host, its query is presigned again for the endpoint host
+        target_url = target_url.replace(query=await get_upstream_query(backend, incoming_req, endpoint))
+    # otherwise this is unsigned request, and so we don't need to do anything
     has_content = int(headers.get("content-length", 0)) > 0
-    data = incoming_req.stream() if has_content else None
+    data = None
+    if has_content:
+        # body replayed by the retry policy, or the one of the client
+        data = body if body is not None else incoming_req.stream()
+    if data is not None and chunk_signer is not None:
+        # chunk signatures of the client are chained from its seed signature, they're replaced as the body streams,
+        # every attempt verifies them from the seed
+        verifier = copy.copy(getattr(incoming_req.state, "chunk_verifier", None))
+        data = chunk_signer.resign(data, verifier=verifier)
     # If there is something broken it may be beneficial to read the body here and check the hash but production code
     # should always stream body to the target server
     # body = b''
     # async for chunk in incoming_req.stream():
     #     body += chunk
     # print('Body SHA256: %s' % hashlib.sha256(body).hexdigest())
-    proxy_request = client.build_request(incoming_req.method, str(target_url), headers=headers, data=data)
-    response = await client.send(proxy_request)
+    client = backend.http_client
+    proxy_request = await client.build_request(incoming_req.method, str(target_url), headers=headers, data=data)
+    timer.sent = time.perf_counter()
+    # response is streamed so the connection goes back to the pool only after the response is closed
+    try:
+        response = await client.send(proxy_request, stream=True)
+    except ChunkedPayloadError as e:
+        timer.observe("error")
+        if isinstance(e, ChunkSignatureError):
+            raise S3Error(403, "SignatureDoesNotMatch", str(e)) from e
+        raise S3Error(400, "IncompleteBody", str(e)) from e
+    except Exception:
+        timer.observe("error")
+        raise
+    timer.observe(response.status_code)
     return response
 
 
+def observe_request(request):
+    """
+    Returns trace of the request if it's sampled and its access log entry if enabled, both are kept in the state
+    of the request for the upstream timers.
+    """
+    global tracer
+
+    trace = tracer.start(request) if tracer is not None else None
+    if trace is not None:
+        request.state.trace = trace
+    access = AccessEntry(request) if settings.ACCESS_LOG else None
+    if access is not None:
+        request.state.access = access
+    return trace, access
+
+
 async def handle(request):
-    global aws_access_provider
-
-    # Perform the request to the target server
-    async with httpx.AsyncClient(follow_redirects=True) as client:
-        response = await get_proxied_response(aws_access_provider, client, request)
-        # Create a streaming response to send back to the client
-        proxy_response = StreamingResponse(
-            response.aiter_bytes(), status_code=response.status_code, headers=response.headers
-        )
-        return proxy_response
+    global admission
+    global verifier
+
+    metrics.IN_FLIGHT.inc()
+    if "content-length" in request.headers or "transfer-encoding" in request.headers:
+        request = Request(request.scope, metrics.ReceivedBody(request.receive, request.method))
+    trace, access = observe_request(request)
+    try:
+        if verifier is not None:
+            request = verifier.verify(request)
+        if admission is not None:
+            response = await admission.handle(request, get_response)
+        else:
+            response = await get_response(request)
+    except S3Error as e:
+        response = Response(e.body, status_code=e.status_code, media_type="application/xml")
+    except BaseException:
+        metrics.IN_FLIGHT.dec()
+        if trace is not None:
+            trace.finish("error")
+        if access is not None:
+            access.finish("error", 0)
+        raise
+    return metrics.InstrumentedResponse(response, request.method, trace, access)
+
+
+async def send_upstream(backend, request, extra_headers=None, body=None):
+    global hedger
+    global multipart_uploader
+    global compressor
+
+    if compressor is not None and compressor.accepts(request):
+        return await compressor.upload(backend, request, body)
+    if multipart_uploader is not None and multipart_uploader.accepts(request):
+        return await multipart_uploader.upload(backend, request, body)
+    if hedger is None:
+        return await get_proxied_response(backend, request, extra_headers=extra_headers, body=body)
+    # duplicate is signed anew, so it's not rejected as a replay
+    return await hedger.send(
+        request, lambda: get_proxied_response(backend, request, extra_headers=extra_headers, body=body), backend.name
+    )
+
+
+async def fetch_upstream(replica_set, request, extra_headers=None):
+    global retry_policy
+
+    if retry_policy is None:
+        return await replica_set.fetch(request, lambda backend: send_upstream(backend, request, extra_headers))
+    # every retry is balanced again, so it may go to another replica
+    return await retry_policy.send(
+        request,
+        lambda body: replica_set.fetch(request, lambda backend: send_upstream(backend, request, extra_headers, body)),
+    )
+
+
+def get_caches():
+    global object_cache
+    global metadata_cache
+
+    return [cache for cache in (object_cache, metadata_cache) if cache is not None]
+
+
+def wrap_fetch(request, fetch):
+    """
+    Wraps `fetch(extra_headers)` of the request with the enabled read optimizations.
+    """
+    global request_coalescer
+    global range_fetcher
+    global read_ahead
+    global compressor
+
+    if range_fetcher is not None:
+        fetch = range_fetcher.wrap(request, fetch)
+    if read_ahead is not None:
+        fetch = read_ahead.wrap(request, fetch)
+    if request_coalescer is not None:
+        fetch = request_coalescer.wrap(request, fetch)
+    if compressor is not None:
+        # upstream requests of the wrappers above are for the stored (compressed) bytes
+        fetch = compressor.wrap(request, fetch)
+    return fetch
+
+
+async def get_response(request):
+    global router
+
+    replica_set = router.get_replica_set(request.url.path)
+    if replica_set is None:
+        return Response("No backend for the bucket", status_code=404)
+
+    async def fetch(extra_headers=None):
+        return await fetch_upstream(replica_set, request, extra_headers)
+
+    fetch = wrap_fetch(request, fetch)
+    caches = get_caches()
+    for cache in caches:
+        await cache.invalidate(request)
+        cached_response = await cache.get_response(request, fetch)
+        if cached_response is not None:
+            return cached_response
+
+    # Perform the request to the target server using shared connection pool
+    response = await fetch()
+    if response.status_code < 300:
+        for cache in caches:
+            # invalidate once again, concurrent read could be cached before upstream applied the change
+            await cache.invalidate(request)
+    # body is passed as it is (not decoded) since content-encoding and content-length headers describe the raw body
+    return PassthroughResponse(response)
 
 
 async def healthcheck(request):
     return Response(f"OK {time.time()}", status_code=200)
 
 
+async def metrics_endpoint(request):
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
+
+
+async def presign(request):
+    global verifier
+    global url_presigner
+
+    if url_presigner is None:
+        return Response("Presigning requires VERIFY_CLIENT_SIGNATURES", status_code=404)
+    try:
+        urls = await url_presigner.presign(verifier.verify(request))
+    except S3Error as e:
+        return Response(e.body, status_code=e.status_code, media_type="application/xml")
+    return JSONResponse({"urls": urls})
+
+
+async def capture_profile(mode, duration):
+    global profiler
+
+    try:
+        if mode == "cpu":
+            return Response(await profiler.run(profiler.profile_cpu, duration), media_type="text/plain")
+        return JSONResponse(await profiler.run(profiler.trace_lag, duration))
+    except ProfilerBusy:
+        return Response("Another profile is being captured", status_code=409)
+
+
+async def profile(request):
+    global profiler
+    global verifier
+
+    if profiler is None:
+        return Response("Profiling requires PROFILING", status_code=404)
+    if verifier is not None:
+        # profiles expose code and timings of the worker, they're captured for clients with credentials only
+        try:
+            verifier.verify(request)
+        except S3Error as e:
+            return Response(e.body, status_code=e.status_code, media_type="application/xml")
+    mode = request.query_params.get("mode", "cpu")
+    try:
+        duration = float(request.query_params.get("seconds", 10))
+    except ValueError:
+        return Response("Invalid seconds", status_code=400)
+    if mode not in ("cpu", "lag") or duration <= 0:
+        return Response("Mode is cpu or lag, seconds are positive", status_code=400)
+    return await capture_profile(mode, duration)
+
+
+async def stats(request):
+    global router
+    global admission
+    global verifier
+    global url_presigner
+    global object_cache
+    global metadata_cache
+    global request_coalescer
+    global range_fetcher
+    global read_ahead
+    global hedger
+    global retry_policy
+    global multipart_uploader
+    global compressor
+    global tracer
+    global profiler
+
+    return JSONResponse(
+        {
+            "upstream": get_upstream_stats(router.backends) if router else {},
+            "backends": router.stats() if router else {},
+            "admission": admission.stats() if admission else None,
+            "auth": verifier.stats() if verifier else None,
+            "presigned_urls": url_presigner.minted if url_presigner else None,
+            "object_cache": object_cache.stats() if object_cache else None,
+            "metadata_cache": metadata_cache.stats() if metadata_cache else None,
+            "coalescing": request_coalescer.stats() if request_coalescer else None,
+            "parallel_get": range_fetcher.stats() if range_fetcher else None,
+            "readahead": read_ahead.stats() if read_ahead else None,
+            "hedging": hedger.stats() if hedger else None,
+            "retries": retry_policy.stats() if retry_policy else None,
+            "multipart_uploads": multipart_uploader.stats() if multipart_uploader else None,
+            "compression": compressor.stats() if compressor else None,
+            "tracing": tracer.stats() if tracer else None,
+            "profiling": profiler.stats() if profiler else None,
+            "logging": logqueue.stats(),
+        }
+    )
+
+
+def get_upstream_stats(backends):
+    return metrics.sum_pool_stats([backend.http_client for backend in backends])
+
+
+def is_brokered(access_key_id, role_arn):
+    """
+    Credentials refreshed from instance metadata or STS are brokered to `s3proxy serve` workers, static keys are not.
+    """
+    return access_key_id is None or role_arn is not None
+
+
+def create_aws_provider(name, access_key_id=None, secret_access_key=None, role_arn=None):
+    if settings.CREDENTIAL_BROKER_SOCKET and is_brokered(access_key_id, role_arn):
+        # worker of `s3proxy serve`, credentials are refreshed once for all workers
+        return BrokeredAccessProvider(
+            settings.CREDENTIAL_BROKER_SOCKET, name, refresh_margin=settings.AWS_CREDENTIALS_REFRESH_MARGIN // 2
+        )
+    return AwsAccessProvider(
+        access_key_id,
+        secret_access_key,
+        role_arn=role_arn,
+        sts_endpoint_url=settings.AWS_STS_ENDPOINT_URL,
+        sts_region=settings.AWS_STS_REGION,
+        refresh_margin=settings.AWS_CREDENTIALS_REFRESH_MARGIN,
+    )
+
+
+def create_backend(name, endpoint_url, region, access_key_id=None, secret_access_key=None, role_arn=None):
+    http_client = AsyncHttpClient(
+        max_keepalive_connections=settings.UPSTREAM_MAX_KEEPALIVE_CONNECTIONS,
+        max_connections=settings.UPSTREAM_MAX_CONNECTIONS,
+        keepalive_expiry=settings.UPSTREAM_KEEPALIVE_EXPIRY,
+        http2=settings.UPSTREAM_HTTP2,
+        follow_redirects=True,
+    )
+    aws_provider = create_aws_provider(name, access_key_id, secret_access_key, role_arn)
+    return Backend(name, endpoint_url, region, aws_provider, http_client)
+
+
+def get_backend_settings():
+    """
+    Returns settings of all backends, the default one (AWS_S3_ENDPOINT_URL) included.
+    """
+    backends = list(settings.BACKENDS)
+    if settings.AWS_S3_ENDPOINT_URL:
+        backends.append(
+            BackendSettings(
+                name="default",
+                endpoint_url=settings.AWS_S3_ENDPOINT_URL,
+                region=settings.AWS_S3_REGION,
+                access_key_id=settings.AWS_ACCESS_KEY_ID,
+                secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+                role_arn=settings.AWS_ROLE_ARN,
+            )
+        )
+    return backends
+
+
+def create_router():
+    eject = {"eject_after": settings.BACKEND_EJECT_AFTER, "eject_duration": settings.BACKEND_EJECT_DURATION}
+    backends = {backend.name: create_backend(**backend.model_dump()) for backend in get_backend_settings()}
+    default = None
+    if settings.AWS_S3_ENDPOINT_URL:
+        default = ReplicaSet([backends["default"]], **eject)
+    routes = [
+        BucketRoute(
+            route.bucket,
+            route.prefix,
+            ReplicaSet([backends[name] for name in route.backends], balancing=route.balancing, **eject),
+        )
+        for route in settings.ROUTES
+    ]
+    return Router(routes, default)
+
+
+def setup_upstream_requests():
+    """
+    Creates policies of sending requests upstream: hedging, retries, multipart uploads and compression.
+    """
+    global hedger
+    global retry_policy
+    global multipart_uploader
+    global compressor
+
+    if settings.HEDGING:
+        hedger = Hedger(
+            percentile=settings.HEDGING_PERCENTILE,
+            budget=settings.HEDGING_BUDGET,
+            min_delay=settings.HEDGING_MIN_DELAY,
+        )
+    if settings.UPSTREAM_RETRIES > 0:
+        retry_policy = RetryPolicy(
+            max_retries=settings.UPSTREAM_RETRIES,
+            base_delay=settings.UPSTREAM_RETRY_BASE_DELAY,
+            max_delay=settings.UPSTREAM_RETRY_MAX_DELAY,
+            budget=settings.UPSTREAM_RETRY_BUDGET,
+            max_body_size=settings.UPSTREAM_RETRY_MAX_BODY_SIZE,
+            memory_size=settings.UPSTREAM_RETRY_MEMORY_SIZE,
+            retry_writes=settings.UPSTREAM_RETRY_WRITES,
+        )
+    if settings.MULTIPART_UPLOAD_THRESHOLD is not None:
+        multipart_uploader = MultipartUploader(
+            settings.MULTIPART_UPLOAD_THRESHOLD,
+            part_size=settings.MULTIPART_UPLOAD_PART_SIZE,
+            concurrency=settings.MULTIPART_UPLOAD_CONCURRENCY,
+        )
+    if settings.COMPRESSED_PREFIXES:
+        compressor = ObjectCompressor(
+            settings.COMPRESSED_PREFIXES,
+            level=settings.COMPRESSION_LEVEL,
+            frame_size=settings.COMPRESSION_FRAME_SIZE,
+            memory_size=settings.COMPRESSION_MEMORY_SIZE,
+        )
+
+
+def setup_diagnostics():
+    """
+    Creates tracer of sampled requests and profiler of the worker.
+    """
+    global tracer
+    global profiler
+
+    if settings.TRACES_SAMPLE_RATE > 0:
+        if settings.TRACING_EXPORTER == "opentelemetry":
+            tracer = Tracer(OpenTelemetryExporter(settings.APP_NAME), settings.TRACES_SAMPLE_RATE)
+        elif settings.SENTRY_DSN:
+            tracer = Tracer(SentryExporter(), settings.TRACES_SAMPLE_RATE)
+        else:
+            root_logger.warning("Tracing to Sentry requires SENTRY_DSN, tracing disabled")
+    if settings.PROFILING:
+        profiler = Profiler(max_duration=settings.PROFILING_MAX_DURATION)
+
+
 async def app_startup():
-    global http_client
-    global aws_access_provider
+    global router
+    global admission
+    global verifier
+    global url_presigner
+    global object_cache
+    global metadata_cache
+    global request_coalescer
+    global range_fetcher
+    global read_ahead
 
     root_logger.info("Starting up version: %s", settings.APP_VERSION)
-    http_client = AsyncHttpClient()
-    aws_access_provider = AwsAccessProvider(settings.AWS_ACCESS_KEY_ID, settings.AWS_SECRET_ACCESS_KEY)
+    router = create_router()
+    metrics.upstream_pool.clients = [backend.http_client for backend in router.backends]
+    metrics.UPSTREAM_MAX_CONNECTIONS.set(settings.UPSTREAM_MAX_CONNECTIONS)
+    if settings.VERIFY_CLIENT_SIGNATURES:
+        key_store = KeyStore(settings.CLIENT_CREDENTIALS)
+        verifier = SignatureVerifier(key_store, max_skew=settings.CLIENT_SIGNATURE_MAX_SKEW)
+        url_presigner = UrlPresigner(key_store, settings.AWS_S3_REGION)
+    if settings.ADMISSION_CONTROL:
+        admission = AdmissionController(
+            settings.ADMISSION_MAX_REQUESTS,
+            settings.ADMISSION_TENANT_MAX_REQUESTS,
+            max_queue=settings.ADMISSION_MAX_QUEUE,
+            queue_timeout=settings.ADMISSION_QUEUE_TIMEOUT,
+            tenant_bandwidth=settings.ADMISSION_TENANT_BANDWIDTH,
+            by_bucket=settings.ADMISSION_BY_BUCKET,
+            send_timeout=settings.ADMISSION_SEND_TIMEOUT,
+            retry_after=settings.ADMISSION_RETRY_AFTER,
+        )
+    if settings.OBJECT_CACHE_DIR:
+        object_cache = ObjectCache(
+            settings.OBJECT_CACHE_DIR,
+            max_size=settings.OBJECT_CACHE_MAX_SIZE,
+            max_object_size=settings.OBJECT_CACHE_MAX_OBJECT_SIZE,
+            ttl=settings.OBJECT_CACHE_TTL,
+        )
+        await object_cache.load()
+    if settings.METADATA_CACHE:
+        metadata_cache = MetadataCache(
+            ttl=settings.METADATA_CACHE_TTL,
+            max_size=settings.METADATA_CACHE_MAX_SIZE,
+            max_entry_size=settings.METADATA_CACHE_MAX_ENTRY_SIZE,
+        )
+    if settings.REQUEST_COALESCING:
+        request_coalescer = RequestCoalescer(window=settings.REQUEST_COALESCING_BUFFER_SIZE)
+    if settings.PARALLEL_GET_THRESHOLD is not None:
+        range_fetcher = ParallelRangeFetcher(
+            settings.PARALLEL_GET_THRESHOLD,
+            part_size=settings.PARALLEL_GET_PART_SIZE,
+            concurrency=settings.PARALLEL_GET_CONCURRENCY,
+        )
+    if settings.READAHEAD:
+        read_ahead = ReadAhead(
+            min_window=settings.READAHEAD_MIN_WINDOW,
+            max_window=settings.READAHEAD_MAX_WINDOW,
+            buffer_size=settings.READAHEAD_BUFFER_SIZE,
+            trigger=settings.READAHEAD_TRIGGER,
+        )
+    setup_upstream_requests()
+    setup_diagnostics()
 
 
 async def app_shutdown():
-    global http_client
-    global aws_access_provider
+    global router
 
     root_logger.info("Shutting down..")
 
-    if http_client:
-        await http_client.close_session()
-    if aws_access_provider:
-        await aws_access_provider.close()
+    if router:
+        await router.close()
 
 
 def app_factory():
     allowed_methods = ["GET", "POST", "PUT", "DELETE", "HEAD", "OPTIONS", "PATCH"]
+    # bucket names can't start with underscore, so /_presign and /_profile never shadow a bucket
+    admin_paths = ["/healthcheck", "/stats", "/metrics", "/_presign", "/_profile"]
 
     app = Starlette(
         debug=settings.DEBUG,
         routes=[
             Route("/", handle, methods=allowed_methods),
             Route("/healthcheck", healthcheck, methods=["GET"]),
+            Route("/stats", stats, methods=["GET"]),
+            Route("/metrics", metrics_endpoint, methods=["GET"]),
+            Route("/_presign", presign, methods=["POST"]),
+            Route("/_profile", profile, methods=["GET"]),
             Route("/{path:path}", handle, methods=allowed_methods),
         ],
         on_startup=[app_startup],
         on_shutdown=[app_shutdown],
     )
-    return app
+    # proxied requests skip Starlette, its routes are left for admin endpoints and lifespan
+    return PassthroughApplication(app, handle, admin_paths, allowed_methods)
+
+
+def serve(args):
+    # backends without static keys or assuming a role get credentials from the supervisor
+    providers = {
+        backend.name: create_aws_provider(
+            backend.name, backend.access_key_id, backend.secret_access_key, backend.role_arn
+        )
+        for backend in get_backend_settings()
+        if is_brokered(backend.access_key_id, backend.role_arn)
+    }
+    supervisor = Supervisor(
+        args.host,
+        args.port,
+        args.workers,
+        worker_timeout=args.worker_timeout,
+        graceful_timeout=args.graceful_timeout,
+        providers=providers,
+    )
+    asyncio.run(supervisor.run())
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(prog="s3proxy")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="serve with worker processes sharing the port")
+    serve_parser.add_argument("--host", default="0.0.0.0")
+    serve_parser.add_argument("--port", type=int, default=5000)
+    serve_parser.add_argument("--workers", type=int, default=settings.WORKERS or os.cpu_count())
+    serve_parser.add_argument("--worker-timeout", type=float, default=settings.WORKER_TIMEOUT)
+    serve_parser.add_argument("--graceful-timeout", type=int, default=settings.WORKER_GRACEFUL_TIMEOUT)
+    serve_parser.set_defaults(handler=serve)
+    args = parser.parse_args(argv)
+    args.handler(args)
@@ -0,0 +1,250 @@
+import time
+from collections import OrderedDict
+
+from . import metrics
+from .coalescing import IGNORED_AMZ_HEADERS
+from .logging import root_logger
+from .object_cache import BYPASS_HEADERS, WRITE_METHODS
+from .passthrough import PassthroughResponse
+from .s3 import PRESIGNED_PARAMS, get_bucket_key, get_resource_params, is_signed
+
+logger = root_logger.getChild(__name__)
+
+# query parameters of ListObjects and ListObjectsV2, bucket GETs with any other parameter are not listings
+LIST_PARAMS = {
+    "list-type",
+    "prefix",
+    "delimiter",
+    "marker",
+    "continuation-token",
+    "start-after",
+    "max-keys",
+    "encoding-type",
+    "fetch-owner",
+}
+SKIPPED_HEADERS = {b"connection", b"keep-alive", b"transfer-encoding", b"date"}
+# 404 of HEAD is cached too, probing for missing objects (e.g. `_SUCCESS` markers) is common
+CACHED_STATUSES = {"HEAD": {200, 404}, "GET": {200}}
+# estimated memory taken by an entry besides its headers and body
+ENTRY_OVERHEAD = 512
+
+
+class MetadataEntry:
+    def __init__(self, cache_key, bucket, key, prefix, status_code, headers, body, expires_at):
+        self.cache_key = cache_key
+        self.bucket = bucket
+        # HEAD entries have the object key, list entries have the listed prefix
+        self.key = key
+        self.prefix = prefix
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+        self.expires_at = expires_at
+        self.size = ENTRY_OVERHEAD + len(body) + sum(len(name) + len(value) for name, value in headers)
+
+
+class CachedMetadataResponse:
+    """
+    ASGI response of cached HEAD response or list page.
+    """
+
+    def __init__(self, entry):
+        self.entry = entry
+        self.status_code = entry.status_code
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.entry.headers})
+        body = b"" if scope["method"] == "HEAD" else self.entry.body
+        await send({"type": "http.response.body", "body": body, "more_body": False})
+
+
+class MetadataCache:
+    """
+    In-memory cache of HEAD Object responses and ListObjects(V2) pages with TTL and LRU eviction.
+
+    Entries are keyed by the canonical request: method, path, query and x-amz-* headers changing the response. Their
+    estimated size is bounded by `max_size`, list pages larger than `max_entry_size` are not cached. Writes passing
+    through the proxy invalidate HEADs of the written key and listings of prefixes containing it, multi-object
+    deletes and bucket level writes invalidate the whole bucket. Only requests signed by the client (see `is_signed`)
+    are served from the cache, the other ones are left to upstream to authorize.
+    """
+
+    def __init__(self, ttl, max_size, max_entry_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.max_entry_size = max_entry_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        # cache key -> entry, least recently used first
+        self._entries = OrderedDict()
+        # bucket -> {object key -> cache keys of its HEADs}
+        self._heads = {}
+        # bucket -> cache keys of its listings
+        self._listings = {}
+        # bucket -> number of invalidations, responses fetched before an invalidation are not stored
+        self._generations = {}
+
+    def get_request_key(self, request):
+        """
+        Returns (cache key, bucket, key, prefix) of HEAD Object or ListObjects request or None.
+        """
+        if request.method not in CACHED_STATUSES or int(request.headers.get("content-length", 0)) > 0:
+            return None
+        if "range" in request.headers or any(header in request.headers for header in BYPASS_HEADERS):
+            return None
+        if not is_signed(request):
+            return None
+        bucket, key = get_bucket_key(request.url.path)
+        if bucket is None:
+            return None
+        prefix = None
+        if request.method == "GET":
+            if key is not None or set(request.query_params) - LIST_PARAMS - PRESIGNED_PARAMS:
+                return None
+            prefix = request.query_params.get("prefix", "")
+        elif key is None:
+            return None
+        cache_key = (
+            request.method,
+            request.url.path,
+            tuple(sorted(get_resource_params(request.query_params))),
+            request.headers.get("accept-encoding"),
+            tuple(
+                sorted(
+                    (name, value)
+                    for name, value in request.headers.items()
+                    if name.startswith("x-amz-") and name not in IGNORED_AMZ_HEADERS
+                )
+            ),
+        )
+        return cache_key, bucket, key, prefix
+
+    def get(self, cache_key):
+        entry = self._entries.get(cache_key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            self.remove(cache_key)
+            return None
+        self._entries.move_to_end(cache_key)
+        return entry
+
+    def store(self, entry):
+        if entry.cache_key in self._entries:
+            self.remove(entry.cache_key)
+        self._entries[entry.cache_key] = entry
+        if entry.prefix is None:
+            self._heads.setdefault(entry.bucket, {}).setdefault(entry.key, set()).add(entry.cache_key)
+        else:
+            self._listings.setdefault(entry.bucket, set()).add(entry.cache_key)
+        self.size += entry.size
+        while self.size > self.max_size and self._entries:
+            self.evictions += 1
+            self.remove(next(iter(self._entries)))
+        metrics.METADATA_CACHE_SIZE.set(self.size)
+
+    def remove(self, cache_key):
+        entry = self._entries.pop(cache_key, None)
+        if entry is None:
+            return
+        self.size -= entry.size
+        if entry.prefix is None:
+            heads = self._heads[entry.bucket]
+            heads[entry.key].discard(cache_key)
+            if not heads[entry.key]:
+                del heads[entry.key]
+        else:
+            self._listings[entry.bucket].discard(cache_key)
+        metrics.METADATA_CACHE_SIZE.set(self.size)
+
+    def invalidate_key(self, bucket, key):
+        self._generations[bucket] = self._generations.get(bucket, 0) + 1
+        cache_keys = set(self._heads.get(bucket, {}).get(key, ()))
+        cache_keys.update(
+            cache_key for cache_key in self._listings.get(bucket, ()) if key.startswith(self._entries[cache_key].prefix)
+        )
+        for cache_key in cache_keys:
+            self.invalidations += 1
+            self.remove(cache_key)
+
+    def invalidate_bucket(self, bucket):
+        self._generations[bucket] = self._generations.get(bucket, 0) + 1
+        cache_keys = [cache_key for keys in self._heads.get(bucket, {}).values() for cache_key in keys]
+        cache_keys.extend(self._listings.get(bucket, ()))
+        for cache_key in cache_keys:
+            self.invalidations += 1
+            self.remove(cache_key)
+
+    async def invalidate(self, request):
+        """
+        Invalidates entries affected by given request. PutObject, CopyObject, CompleteMultipartUpload and
+        DeleteObject invalidate the object and listings of its prefixes, DeleteObjects (POST ?delete) and bucket
+        level writes the whole bucket. Creating, uploading parts of and aborting multipart upload don't change
+        anything visible.
+        """
+        if request.method not in WRITE_METHODS:
+            return
+        bucket, key = get_bucket_key(request.url.path)
+        if bucket is None:
+            return
+        if key is None:
+            self.invalidate_bucket(bucket)
+            return
+        query = request.query_params
+        if "uploads" in query or ("uploadId" in query and request.method in ("PUT", "DELETE")):
+            return
+        self.invalidate_key(bucket, key)
+
+    def _create_entry(self, request_key, response, body):
+        cache_key, bucket, key, prefix = request_key
+        headers = [(name, value) for name, value in response.headers.raw if name.lower() not in SKIPPED_HEADERS]
+        return MetadataEntry(
+            cache_key, bucket, key, prefix, response.status_code, headers, body, time.monotonic() + self.ttl
+        )
+
+    async def _fill(self, request_key, generation, response):
+        chunks = []
+        size = 0
+        async for chunk in response.aiter_raw():
+            size += len(chunk)
+            if chunks is not None:
+                chunks.append(chunk)
+                if size > self.max_entry_size:
+                    chunks = None
+            yield chunk
+        bucket = request_key[1]
+        if chunks is not None and self._generations.get(bucket, 0) == generation:
+            self.store(self._create_entry(request_key, response, b"".join(chunks)))
+
+    async def get_response(self, request, fetch):
+        """
+        Returns response for HEAD Object or ListObjects request served from the cache or from upstream response
+        returned by `fetch` coroutine. Returns None when request can't be cached.
+        """
+        request_key = self.get_request_key(request)
+        if request_key is None:
+            return None
+        entry = self.get(request_key[0])
+        if entry is not None:
+            self.hits += 1
+            return CachedMetadataResponse(entry)
+        self.misses += 1
+        generation = self._generations.get(request_key[1], 0)
+        response = await fetch()
+        if response.status_code not in CACHED_STATUSES[request.method]:
+            return PassthroughResponse(response)
+        return PassthroughResponse(response, self._fill(request_key, generation, response))
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "max_size": self.max_size,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,197 @@
+"""
+Prometheus metrics of the proxy exposed at /metrics.
+"""
+import time
+
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# phases of proxied request take from tens of microseconds (signing) to minutes (streaming of large objects)
+PHASE_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    300.0,
+)
+
+PHASE_DURATION = Histogram(
+    "s3proxy_phase_duration_seconds",
+    "Duration of the phases of proxied requests: headers, credentials, signing, upstream_ttfb and body",
+    ["phase", "method", "status"],
+    buckets=PHASE_BUCKETS,
+)
+RECEIVED_BYTES = Counter("s3proxy_received_bytes", "Bytes of request bodies received from clients", ["method"])
+SENT_BYTES = Counter("s3proxy_sent_bytes", "Bytes of response bodies sent to clients", ["method", "status"])
+IN_FLIGHT = Gauge("s3proxy_requests_in_flight", "Requests being handled including those streaming response body")
+UPSTREAM_MAX_CONNECTIONS = Gauge("s3proxy_upstream_max_connections", "Limit of connections to the upstream")
+HEDGED_REQUESTS = Counter("s3proxy_hedged_requests", "Duplicate upstream requests sent for slow reads")
+HEDGE_WINS = Counter("s3proxy_hedge_wins", "Duplicate upstream requests which responded first")
+UPSTREAM_RETRIES = Counter("s3proxy_upstream_retries", "Upstream requests retried after connection error or 5xx")
+ADMISSION_REJECTED = Counter("s3proxy_admission_rejected", "Requests rejected with 503 SlowDown over the limits")
+METADATA_CACHE_SIZE = Gauge("s3proxy_metadata_cache_bytes", "Estimated memory taken by cached HEADs and listings")
+CREDENTIALS_REFRESHES = Counter(
+    "s3proxy_credentials_refreshes", "Refreshes of the upstream credentials by result", ["result"]
+)
+CREDENTIALS_REFRESH_DURATION = Histogram(
+    "s3proxy_credentials_refresh_duration_seconds", "Duration of the refreshes of the upstream credentials"
+)
+
+
+def sum_pool_stats(clients):
+    """
+    Returns per host statistics of the connection pools of `AsyncHttpClient`s, summed for backends sharing a host.
+    """
+    stats = {}
+    for client in clients:
+        for host, host_stats in client.stats().items():
+            summed = stats.setdefault(host, dict.fromkeys(host_stats, 0))
+            for name, value in host_stats.items():
+                summed[name] += value
+    return stats
+
+
+class UpstreamPoolCollector:
+    """
+    Collects utilization of the upstream connection pool at scrape time from `AsyncHttpClient.stats()`.
+    """
+
+    def __init__(self):
+        self.clients = []
+
+    def collect(self):
+        connections = GaugeMetricFamily(
+            "s3proxy_upstream_connections", "Connections to the upstream kept in the pool", labels=["host", "state"]
+        )
+        in_flight = GaugeMetricFamily(
+            "s3proxy_upstream_requests_in_flight", "Upstream requests waiting for response headers", labels=["host"]
+        )
+        requests = CounterMetricFamily("s3proxy_upstream_requests", "Requests sent to the upstream", labels=["host"])
+        for host, stats in sum_pool_stats(self.clients).items():
+            connections.add_metric([host, "active"], stats["connections"] - stats["idle"])
+            connections.add_metric([host, "idle"], stats["idle"])
+            in_flight.add_metric([host], stats["in_flight"])
+            requests.add_metric([host], stats["requests"])
+        yield connections
+        yield in_flight
+        yield requests
+
+
+upstream_pool = UpstreamPoolCollector()
+REGISTRY.register(upstream_pool)
+
+
+class UpstreamTimer:
+    """
+    Measures the phases of single upstream request made by `get_proxied_response`. Phases are observed once
+    the upstream status is known, and recorded as spans when the request is traced.
+    """
+
+    def __init__(self, method, trace=None, backend=None, access=None):
+        self.method = method
+        self.trace = trace
+        self.access = access
+        self.backend = backend
+        self.started = time.perf_counter()
+        self.credentials_started = None
+        self.credentials = 0.0
+        self.signing_started = None
+        self.signing = 0.0
+        self.sent = None
+
+    def observe(self, status):
+        done = time.perf_counter()
+        status = str(status)
+        headers = self.sent - self.started - self.credentials - self.signing
+        PHASE_DURATION.labels("headers", self.method, status).observe(headers)
+        PHASE_DURATION.labels("upstream_ttfb", self.method, status).observe(done - self.sent)
+        if self.credentials:
+            PHASE_DURATION.labels("credentials", self.method, status).observe(self.credentials)
+        if self.signing:
+            PHASE_DURATION.labels("signing", self.method, status).observe(self.signing)
+        if self.trace is not None:
+            self.add_spans(status, done)
+        if self.access is not None:
+            self.access.attempts += 1
+            self.access.upstream_ttfb = done - self.sent
+
+    def add_spans(self, status, done):
+        if self.credentials_started is not None:
+            end = self.credentials_started + self.credentials
+            self.trace.add_span("upstream.credentials", self.credentials_started, end, backend=self.backend)
+        if self.signing_started is not None:
+            end = self.signing_started + self.signing
+            self.trace.add_span("upstream.signing", self.signing_started, end, backend=self.backend)
+        self.trace.add_span("upstream.send", self.sent, done, backend=self.backend, status=status)
+
+
+class ReceivedBody:
+    """
+    Wraps ASGI `receive` of request and counts bytes of its body as they're streamed by the client.
+    """
+
+    def __init__(self, receive, method):
+        self.receive = receive
+        self.received = RECEIVED_BYTES.labels(method)
+
+    async def __call__(self):
+        message = await self.receive()
+        if message["type"] == "http.request":
+            self.received.inc(len(message.get("body", b"")))
+        return message
+
+
+class InstrumentedResponse:
+    """
+    Wraps ASGI response of proxied request, counts bytes sent to the client and measures streaming of the body.
+    The request stops being in flight once the response is sent, its trace and access log entry are finished then.
+    """
+
+    def __init__(self, response, method, trace=None, access=None):
+        self.response = response
+        self.method = method
+        self.trace = trace
+        self.access = access
+
+    async def __call__(self, scope, receive, send):
+        status = "error"
+        started = time.perf_counter()
+        sent = 0
+
+        async def instrumented_send(message):
+            nonlocal status, started, sent
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+                started = time.perf_counter()
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            elif message["type"] == "http.response.zerocopysend":
+                sent += message.get("count", 0)
+            await send(message)
+
+        try:
+            await self.response(scope, receive, instrumented_send)
+        finally:
+            IN_FLIGHT.dec()
+            SENT_BYTES.labels(self.method, status).inc(sent)
+            done = time.perf_counter()
+            PHASE_DURATION.labels("body", self.method, status).observe(done - started)
+            if self.trace is not None:
+                self.trace.add_span("response.body", started, done, bytes=sent)
+                self.trace.finish(status)
+            if self.access is not None:
+                self.access.finish(status, sent)
@@ -0,0 +1,232 @@
+"""
+Upload acceleration: large PutObject is sent upstream as multipart upload, its parts are cut from the incoming stream
+and uploaded in parallel.
+"""
+import asyncio
+import hashlib
+import math
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+import httpx
+
+from .logging import root_logger
+from .s3 import BodyDigests, get_object_headers
+
+logger = root_logger.getChild(__name__)
+
+# headers needed by every part
+PART_HEADERS = ("x-amz-server-side-encryption-customer-", "x-amz-request-payer", "x-amz-expected-bucket-owner")
+# PutObject with these is passed as it is: copies, conditional writes and checksums of the whole object can't be split,
+# clients sending Content-MD5 may compare it with the ETag, which is not the MD5 of the body for multipart uploads
+BYPASS_HEADERS = ("x-amz-copy-source", "if-match", "if-none-match", "x-amz-sdk-checksum-algorithm", "content-md5")
+# headers of CompleteMultipartUpload response which PutObject response has as well
+RESPONSE_HEADERS = (
+    "x-amz-version-id",
+    "x-amz-expiration",
+    "x-amz-server-side-encryption",
+    "x-amz-server-side-encryption-aws-kms-key-id",
+    "x-amz-server-side-encryption-bucket-key-enabled",
+    "x-amz-request-id",
+    "x-amz-id-2",
+)
+MAX_PARTS = 10000
+S3_NAMESPACE = "{http://s3.amazonaws.com/doc/2006-03-01/}"
+
+
+class UploadFailed(Exception):
+    """
+    Upstream responded with an error, the response is passed to the client.
+    """
+
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+
+class UploadResponse:
+    """
+    Quacks like streamed `httpx.Response` with the body read already.
+    """
+
+    def __init__(self, status_code, headers, content=b""):
+        self.status_code = status_code
+        self.headers = httpx.Headers(headers)
+        self.headers["content-length"] = str(len(content))
+        self.content = content
+
+    async def aiter_raw(self):
+        yield self.content
+
+    async def aclose(self):
+        pass
+
+
+def find_text(element, name):
+    found = element.find(S3_NAMESPACE + name)
+    if found is None:
+        found = element.find(name)
+    return found.text if found is not None else None
+
+
+def get_sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class MultipartUpload:
+    """
+    Single PutObject uploaded as multipart upload to the `backend`. At most `concurrency` parts of `part_size`
+    bytes are uploaded or buffered at a time while the next one is read.
+    """
+
+    def __init__(self, backend, request, part_size, concurrency):
+        self.backend = backend
+        self.request = request
+        self.part_size = part_size
+        self.buffers = asyncio.Semaphore(concurrency)
+        self.upload_id = None
+        self.tasks = []
+        self.error = None
+        # digests declared by the client are checked against the whole body before the upload is completed
+        self.digests = BodyDigests(request.headers)
+
+    async def send(self, method, params, headers=None, content=b"", body_hash=None):
+        """
+        Sends request for the object signed by the proxy, raises `UploadFailed` with error response.
+        """
+        response = await self.backend.send(method, self.request.url, params, headers or {}, content, body_hash)
+        if response.status_code >= 300:
+            raise UploadFailed(response.status_code, response.content)
+        return response
+
+    async def create(self):
+        response = await self.send("POST", {"uploads": ""}, get_object_headers(self.request.headers))
+        self.upload_id = find_text(ElementTree.fromstring(response.content.strip()), "UploadId")
+
+    async def upload_part(self, number, data):
+        try:
+            headers = {name: value for name, value in self.request.headers.items() if name.startswith(PART_HEADERS)}
+            # hashing of the part doesn't block the event loop
+            body_hash = await asyncio.to_thread(get_sha256, data)
+            response = await self.send(
+                "PUT", {"partNumber": str(number), "uploadId": self.upload_id}, headers, bytes(data), body_hash
+            )
+            return response.headers["etag"]
+        except BaseException as e:
+            self.error = self.error or e
+            raise
+        finally:
+            self.buffers.release()
+
+    async def start_part(self, data):
+        await self.buffers.acquire()
+        if self.error is not None:
+            self.buffers.release()
+            # rest of the body is not read in vain once a part failed
+            raise self.error
+        self.tasks.append(asyncio.ensure_future(self.upload_part(len(self.tasks) + 1, data)))
+
+    async def read(self, body):
+        buffer = bytearray()
+        async for chunk in body:
+            self.digests.update(chunk)
+            buffer += chunk
+            while len(buffer) >= self.part_size:
+                await self.start_part(buffer[: self.part_size])
+                del buffer[: self.part_size]
+        if buffer or not self.tasks:
+            await self.start_part(buffer)
+
+    async def complete(self, etags):
+        parts = "".join(
+            f"<Part><PartNumber>{number}</PartNumber><ETag>{escape(etag)}</ETag></Part>"
+            for number, etag in enumerate(etags, 1)
+        )
+        content = f"<CompleteMultipartUpload>{parts}</CompleteMultipartUpload>".encode()
+        response = await self.send("POST", {"uploadId": self.upload_id}, {"content-type": "application/xml"}, content)
+        result = ElementTree.fromstring(response.content.strip())
+        if result.tag.endswith("Error"):
+            # the upload can fail after 200 OK was sent, the error is in the body
+            raise UploadFailed(500, response.content.strip())
+        headers = [("etag", find_text(result, "ETag"))]
+        headers.extend((name, response.headers[name]) for name in RESPONSE_HEADERS if name in response.headers)
+        return UploadResponse(200, headers)
+
+    async def abort(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        if self.upload_id is None:
+            return
+        try:
+            await self.send("DELETE", {"uploadId": self.upload_id})
+        except Exception as e:
+            logger.warning("Multipart upload %s of %s not aborted: %r", self.upload_id, self.request.url.path, e)
+
+    async def run(self, body):
+        """
+        Returns response of the upload compatible with PutObject response, or error response of the upstream.
+        """
+        try:
+            await self.create()
+            await self.read(body)
+            self.digests.check()
+            return await self.complete(await asyncio.gather(*self.tasks))
+        except UploadFailed as e:
+            await asyncio.shield(self.abort())
+            return UploadResponse(e.status_code, {"content-type": "application/xml"}, e.content)
+        except BaseException:
+            # parts of the upload are not left behind when the client goes away
+            await asyncio.shield(self.abort())
+            raise
+
+
+class MultipartUploader:
+    """
+    Uploads PutObject larger than `threshold` bytes as multipart upload: CreateMultipartUpload, UploadPart requests
+    of `part_size` bytes (or larger to fit 10000 parts) with at most `concurrency` of them at a time, and
+    CompleteMultipartUpload. The upload is aborted on error. Only requests signed by the client are converted,
+    they're signed by the proxy anyway.
+    """
+
+    def __init__(self, threshold, part_size=16 * 1024**2, concurrency=4):
+        self.threshold = threshold
+        self.part_size = part_size
+        self.concurrency = concurrency
+        self.uploads = 0
+        self.parts = 0
+        self.failed = 0
+
+    def accepts(self, request):
+        headers = request.headers
+        if request.method != "PUT" or request.query_params or "authorization" not in headers:
+            return False
+        if int(headers.get("content-length", 0)) < self.threshold:
+            return False
+        if headers.get("x-amz-content-sha256", "").startswith("STREAMING-"):
+            return False
+        return not any(name in headers for name in BYPASS_HEADERS) and not any(
+            name.startswith("x-amz-checksum-") for name in headers
+        )
+
+    async def upload(self, backend, request, body=None):
+        """
+        Returns response of the upload of the request body, or of `body` replaying it.
+        """
+        size = int(request.headers["content-length"])
+        part_size = max(self.part_size, math.ceil(size / MAX_PARTS))
+        upload = MultipartUpload(backend, request, part_size, self.concurrency)
+        self.uploads += 1
+        try:
+            response = await upload.run(body if body is not None else request.stream())
+        except BaseException:
+            self.failed += 1
+            raise
+        finally:
+            self.parts += len(upload.tasks)
+        if response.status_code >= 300:
+            self.failed += 1
+        return response
+
+    def stats(self):
+        return {"uploads": self.uploads, "parts": self.parts, "failed": self.failed}
@@ -0,0 +1,406 @@
+import asyncio
+import fcntl
+import json
+import mmap
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from hashlib import sha256
+
+from starlette.responses import Response
+
+from .logging import root_logger
+from .passthrough import PassthroughResponse
+from .s3 import PRESIGNED_PARAMS, get_bucket_key, is_signed, parse_range, resolve_range
+
+logger = root_logger.getChild(__name__)
+
+# headers which describe the connection rather than the object
+SKIPPED_HEADERS = {"connection", "keep-alive", "transfer-encoding", "date", "content-length", "content-range"}
+# conditional and SSE-C requests are passed upstream, the proxy is not going to evaluate them on its own
+BYPASS_HEADERS = {
+    "if-match",
+    "if-none-match",
+    "if-modified-since",
+    "if-unmodified-since",
+    "x-amz-server-side-encryption-customer-key",
+}
+WRITE_METHODS = {"PUT", "POST", "DELETE"}
+# temporary files not modified for that many seconds were left behind by a crashed worker
+STALE_TMP_AGE = 3600
+# held by the worker which stores or evicts entries
+LOCK_NAME = ".lock"
+
+
+class CacheEntry:
+    def __init__(self, cache_key, bucket, key, version_id, etag, size, headers, validated_at):
+        self.cache_key = cache_key
+        self.bucket = bucket
+        self.key = key
+        self.version_id = version_id
+        self.etag = etag
+        self.size = size
+        self.headers = headers
+        self.validated_at = validated_at
+
+    def to_json(self):
+        return json.dumps(
+            {
+                "bucket": self.bucket,
+                "key": self.key,
+                "version_id": self.version_id,
+                "etag": self.etag,
+                "size": self.size,
+                "headers": self.headers,
+                "validated_at": self.validated_at,
+            }
+        )
+
+    @classmethod
+    def from_json(cls, cache_key, value):
+        return cls(cache_key, **json.loads(value))
+
+
+class CachedObjectResponse(Response):
+    """
+    Serves cached object body without copying it through Python: with `http.response.zerocopysend` (sendfile)
+    when ASGI server supports it, otherwise as slices of memory mapped file. The body file is opened already, so
+    the entry can be evicted meanwhile.
+    """
+
+    chunk_size = 1024 * 1024
+
+    def __init__(self, body, start, end, status_code, headers):
+        self.body = body
+        self.start = start
+        self.length = end - start + 1
+        self.status_code = status_code
+        self.background = None
+        self.init_headers(headers)
+
+    async def __call__(self, scope, receive, send):
+        with self.body as body:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if self.length <= 0 or scope["method"] == "HEAD":
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+                return
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send(
+                    {"type": "http.response.zerocopysend", "file": body, "offset": self.start, "count": self.length}
+                )
+                return
+            # mmap is not closed explicitly, memoryviews may still be referenced by transport's write buffer
+            view = memoryview(mmap.mmap(body.fileno(), 0, access=mmap.ACCESS_READ))
+        end = self.start + self.length
+        for offset in range(self.start, end, self.chunk_size):
+            chunk_end = min(offset + self.chunk_size, end)
+            await send({"type": "http.response.body", "body": view[offset:chunk_end], "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+class CacheWriter:
+    """
+    Writes body of the entry to temporary file, disk writes don't block the event loop.
+    """
+
+    def __init__(self, cache, entry):
+        self._cache = cache
+        self._entry = entry
+        self._written = 0
+        self._file = None
+
+    async def open(self):
+        self._file = await asyncio.to_thread(
+            tempfile.NamedTemporaryFile, dir=self._cache.directory, prefix=".tmp-", delete=False
+        )
+
+    async def write(self, chunk):
+        await asyncio.to_thread(self._file.write, chunk)
+        self._written += len(chunk)
+
+    async def commit(self):
+        await asyncio.to_thread(self._file.close)
+        if self._written != self._entry.size:
+            logger.debug("Incomplete body of %s/%s, not caching it", self._entry.bucket, self._entry.key)
+            await asyncio.to_thread(os.unlink, self._file.name)
+            return
+        await self._cache.store(self._entry, self._file.name)
+
+    def abort(self):
+        if self._file is not None:
+            self._file.close()
+            os.unlink(self._file.name)
+
+
+class ObjectCache:
+    """
+    Disk-backed cache of GET object bodies with size-bounded LRU eviction. Only requests signed by the client (see
+    `is_signed`) are served from the cache, the other ones are left to upstream to authorize.
+
+    Every object is stored as `<cache key>.body` and `<cache key>.meta` files, where cache key is derived from
+    bucket, key and version id and starts with digest of the bucket. Entries are served without contacting upstream
+    for `ttl` seconds, after that they're revalidated with `If-None-Match: <etag>`. Writes (PUT, POST, DELETE)
+    passing through the proxy invalidate the object, DeleteObjects removes all entries of the bucket.
+
+    The directory is the index, so many workers can share it: files are replaced atomically, modification time of
+    the body is the last use of the entry, and every store scans the directory and evicts least recently used
+    entries under a lock file, so the size is bounded for all of them together.
+    """
+
+    def __init__(self, directory, max_size, max_object_size, ttl):
+        self.directory = directory
+        self.max_size = max_size
+        self.max_object_size = max_object_size
+        self.ttl = ttl
+        # size and number of objects in the directory as of the last scan
+        self.size = 0
+        self.objects = 0
+        self.hits = 0
+        self.misses = 0
+
+    async def load(self):
+        """
+        Creates the directory and evicts entries over the size, e.g. stored by previous run of the proxy.
+        """
+        await asyncio.to_thread(os.makedirs, self.directory, exist_ok=True)
+        await asyncio.to_thread(self._evict)
+
+    @contextmanager
+    def _locked(self):
+        with open(os.path.join(self.directory, LOCK_NAME), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _scan(self):
+        """
+        Returns (last use, cache key, size) of entries in the directory.
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(".tmp-"):
+                self._remove_stale(entry.path)
+            elif entry.name.endswith(".body"):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, entry.name.removesuffix(".body"), stat.st_size))
+        return entries
+
+    def _remove_stale(self, path):
+        # files being written by other workers are left alone, those left behind by crashed ones are removed
+        try:
+            if time.time() - os.stat(path).st_mtime > STALE_TMP_AGE:
+                os.unlink(path)
+        except OSError:
+            pass
+
+    def _evict(self):
+        with self._locked():
+            entries = sorted(self._scan())
+            size = sum(entry_size for _, _, entry_size in entries)
+            evicted = []
+            for _, cache_key, entry_size in entries:
+                if size <= self.max_size:
+                    break
+                evicted.append(cache_key)
+                size -= entry_size
+            self._remove_files(evicted)
+        self.size = size
+        self.objects = len(entries) - len(evicted)
+
+    def get_bucket_prefix(self, bucket):
+        return sha256(bucket.encode("utf-8")).hexdigest()[:16] + "-"
+
+    def get_cache_key(self, bucket, key, version_id):
+        digest = sha256(f"{bucket}/{key}?versionId={version_id or ''}".encode("utf-8")).hexdigest()
+        return self.get_bucket_prefix(bucket) + digest
+
+    def get_body_path(self, cache_key):
+        return os.path.join(self.directory, cache_key + ".body")
+
+    def get_meta_path(self, cache_key):
+        return os.path.join(self.directory, cache_key + ".meta")
+
+    def get_request_key(self, request):
+        """
+        Returns (bucket, key, version id) of GET Object request which may be served from the cache or None.
+        """
+        if request.method != "GET" or set(request.query_params) - PRESIGNED_PARAMS - {"versionId"}:
+            return None
+        if not is_signed(request):
+            # anonymous requests are passed, upstream decides whether the object is public
+            return None
+        if any(header in request.headers for header in BYPASS_HEADERS):
+            return None
+        bucket, key = get_bucket_key(request.url.path)
+        if bucket is None or key is None:
+            return None
+        return bucket, key, request.query_params.get("versionId")
+
+    def _read_meta(self, cache_key):
+        with open(self.get_meta_path(cache_key)) as meta:
+            return CacheEntry.from_json(cache_key, meta.read())
+
+    async def get(self, cache_key):
+        try:
+            return await asyncio.to_thread(self._read_meta, cache_key)
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def is_fresh(self, entry):
+        return time.time() - entry.validated_at < self.ttl
+
+    async def revalidated(self, entry):
+        entry.validated_at = time.time()
+        await asyncio.to_thread(self._write_meta, entry)
+
+    def _write_meta(self, entry):
+        with tempfile.NamedTemporaryFile("w", dir=self.directory, prefix=".tmp-", delete=False) as meta:
+            meta.write(entry.to_json())
+        os.replace(meta.name, self.get_meta_path(entry.cache_key))
+
+    def _store_files(self, entry, body_path):
+        os.replace(body_path, self.get_body_path(entry.cache_key))
+        self._write_meta(entry)
+
+    async def store(self, entry, body_path):
+        await asyncio.to_thread(self._store_files, entry, body_path)
+        await asyncio.to_thread(self._evict)
+
+    def _remove_files(self, cache_keys):
+        for cache_key in cache_keys:
+            for path in (self.get_meta_path(cache_key), self.get_body_path(cache_key)):
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+
+    def _remove_bucket(self, bucket):
+        prefix = self.get_bucket_prefix(bucket)
+        names = [name for name in os.listdir(self.directory) if name.startswith(prefix)]
+        self._remove_files({name.rsplit(".", 1)[0] for name in names})
+
+    async def remove(self, cache_key):
+        await asyncio.to_thread(self._remove_files, [cache_key])
+
+    async def invalidate(self, request):
+        """
+        Invalidates objects modified by given request: PutObject, CopyObject, CompleteMultipartUpload, DeleteObject
+        invalidate the object itself, DeleteObjects (POST ?delete) invalidates all objects of the bucket.
+        """
+        if request.method not in WRITE_METHODS:
+            return
+        bucket, key = get_bucket_key(request.url.path)
+        if bucket is None:
+            return
+        if key is None:
+            if request.method == "POST" and "delete" in request.query_params:
+                await asyncio.to_thread(self._remove_bucket, bucket)
+            return
+        await self.remove(self.get_cache_key(bucket, key, request.query_params.get("versionId")))
+
+    def _open_body(self, cache_key):
+        body = open(self.get_body_path(cache_key), "rb")
+        try:
+            # last use of the entry, least recently used ones are evicted first
+            os.utime(body.fileno())
+        except OSError:
+            body.close()
+            raise
+        return body
+
+    async def get_cached_response(self, entry, request):
+        """
+        Returns response serving the entry to the request, or None when its body is gone (evicted by another request
+        or worker).
+        """
+        headers = dict(entry.headers)
+        headers["accept-ranges"] = "bytes"
+        start, end, status_code = 0, entry.size - 1, 200
+        byte_range = parse_range(request.headers.get("range"))
+        if byte_range is not None:
+            resolved = resolve_range(byte_range, entry.size)
+            if resolved is None:
+                return Response(status_code=416, headers={"content-range": f"bytes */{entry.size}"})
+            start, end = resolved
+            status_code = 206
+            headers["content-range"] = f"bytes {start}-{end}/{entry.size}"
+        headers["content-length"] = str(end - start + 1)
+        try:
+            body = await asyncio.to_thread(self._open_body, entry.cache_key)
+        except OSError:
+            return None
+        return CachedObjectResponse(body, start, end, status_code, headers)
+
+    def get_entry_for_response(self, request_key, response):
+        content_length = response.headers.get("content-length")
+        etag = response.headers.get("etag")
+        if response.status_code != 200 or etag is None or content_length is None:
+            return None
+        if int(content_length) > self.max_object_size:
+            return None
+        if "content-encoding" in response.headers and "accept-encoding" in response.headers.get("vary", ""):
+            # encoding negotiated with the client, other clients may not accept it
+            return None
+        bucket, key, version_id = request_key
+        return CacheEntry(
+            self.get_cache_key(bucket, key, version_id),
+            bucket,
+            key,
+            version_id,
+            etag,
+            int(content_length),
+            [(k, v) for k, v in response.headers.items() if k not in SKIPPED_HEADERS],
+            time.time(),
+        )
+
+    async def _fill(self, response, entry):
+        writer = CacheWriter(self, entry)
+        try:
+            await writer.open()
+            async for chunk in response.aiter_raw():
+                await writer.write(chunk)
+                yield chunk
+        except BaseException:
+            writer.abort()
+            raise
+        await writer.commit()
+
+    async def get_response(self, request, fetch):
+        """
+        Returns response for GET Object request served from the cache or from upstream response returned by `fetch`
+        coroutine, which accepts extra headers of upstream request. Returns None when request can't be cached.
+        """
+        request_key = self.get_request_key(request)
+        if request_key is None:
+            return None
+        entry = await self.get(self.get_cache_key(*request_key))
+        if entry is not None and self.is_fresh(entry):
+            cached_response = await self.get_cached_response(entry, request)
+            if cached_response is not None:
+                self.hits += 1
+                return cached_response
+            entry = None
+        response = await fetch({"if-none-match": entry.etag} if entry is not None else {})
+        if entry is not None and response.status_code == 304:
+            await response.aclose()
+            cached_response = await self.get_cached_response(entry, request)
+            if cached_response is not None:
+                self.hits += 1
+                await self.revalidated(entry)
+                return cached_response
+            # evicted while it was revalidated
+            entry = None
+            response = await fetch()
+        self.misses += 1
+        if entry is not None:
+            await self.remove(entry.cache_key)
+        # partial responses are not cached, whole object is cached only when it's requested as a whole
+        new_entry = self.get_entry_for_response(request_key, response) if "range" not in request.headers else None
+        body = response.aiter_raw() if new_entry is None else self._fill(response, new_entry)
+        return PassthroughResponse(response, body)
+
+    def stats(self):
+        return {"size": self.size, "objects": self.objects, "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,82 @@
+"""
+Lean ASGI path of proxied requests, bypassing Starlette routing, middleware and `StreamingResponse`.
+"""
+import asyncio
+
+from starlette.requests import Request
+
+from . import sentry
+from .logging import root_logger
+
+logger = root_logger.getChild(__name__)
+
+# bodies announced larger than that (or of unknown size) are streamed while watching for client disconnect, so the
+# upstream is not read in vain; smaller bodies are sent before the disconnect could be noticed anyway
+WATCHED_BODY_SIZE = 1024**2
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+class PassthroughResponse:
+    """
+    ASGI response sending streamed upstream response to the client as it is: raw header list of the upstream response
+    and raw (not decoded) body chunks are passed straight to `send`. `body` replaces `response.aiter_raw()` when the
+    chunks need to be observed on their way (e.g. written to the cache).
+    """
+
+    def __init__(self, response, body=None):
+        self.response = response
+        self.status_code = response.status_code
+        self.body = body if body is not None else response.aiter_raw()
+
+    def watches_disconnect(self, scope):
+        content_length = self.response.headers.get("content-length")
+        return scope["method"] != "HEAD" and (content_length is None or int(content_length) > WATCHED_BODY_SIZE)
+
+    async def __call__(self, scope, receive, send):
+        watcher = None
+        try:
+            await send(
+                {"type": "http.response.start", "status": self.status_code, "headers": self.response.headers.raw}
+            )
+            if self.watches_disconnect(scope):
+                watcher = asyncio.ensure_future(wait_for_disconnect(receive))
+            async for chunk in self.body:
+                if watcher is not None and watcher.done():
+                    logger.debug("Client disconnected, stopped streaming of %s", scope["path"])
+                    return
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            await self.body.aclose()
+            await self.response.aclose()
+
+
+class PassthroughApplication:
+    """
+    Sends proxied requests straight to `handler(request)` returning ASGI response. Admin endpoints, lifespan and
+    requests with methods which are not proxied are left to the Starlette `app`.
+    """
+
+    def __init__(self, app, handler, admin_paths, methods):
+        self.app = app
+        self.handler = handler
+        self.admin_paths = frozenset(admin_paths)
+        self.methods = frozenset(methods)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.admin_paths or scope["method"] not in self.methods:
+            await self.app(scope, receive, send)
+            return
+        try:
+            response = await self.handler(Request(scope, receive))
+            await response(scope, receive, send)
+        except Exception as e:
+            # Sentry integration hooks into Starlette, which these requests don't pass through
+            sentry.capture_exception(e)
+            raise
@@ -0,0 +1,103 @@
+"""
+Presigned URLs: query authentication of presigned requests is re-presigned for the upstream host, and URLs presigned
+for the proxy host are minted in bulk.
+"""
+import json
+import time
+import urllib.parse
+
+from .auth import MAX_EXPIRES, parse_amz_date
+from .awssigv4 import SigV4Signer
+from .logging import root_logger
+from .s3 import S3Error, get_access_key_id, get_resource_params
+
+logger = root_logger.getChild(__name__)
+
+DEFAULT_EXPIRES = 3600
+# URLs minted by single request
+MAX_PRESIGNED_URLS = 1000
+
+
+def encode_query(params):
+    return urllib.parse.urlencode(params, quote_via=urllib.parse.quote, safe="~")
+
+
+async def get_upstream_query(backend, request, host):
+    """
+    Returns query string of presigned request presigned once again for the `host` of the backend with credentials
+    of the proxy. The new URL expires at the same time as the original one.
+    """
+    params = request.query_params
+    try:
+        expires_at = parse_amz_date(params.get("X-Amz-Date")) + int(params.get("X-Amz-Expires", ""))
+    except ValueError:
+        raise S3Error(400, "AuthorizationQueryParametersError", "X-Amz-Expires must be a number") from None
+    expires = int(expires_at - time.time())
+    if expires <= 0:
+        raise S3Error(403, "AccessDenied", "Request has expired")
+    credentials = await backend.aws_provider.get_access_credentials()
+    query = backend.signer.presign(
+        credentials.access_key,
+        credentials.secret_key,
+        request.method,
+        request.url.path,
+        host,
+        get_resource_params(params),
+        min(expires, MAX_EXPIRES),
+        session_token=credentials.session_token,
+    )
+    return encode_query(query)
+
+
+def parse_presign_request(item, default_expires):
+    try:
+        method = str(item.get("method", "GET")).upper()
+        path = "/" + str(item["path"]).lstrip("/")
+        params = {str(name): str(value) for name, value in item.get("params", {}).items()}
+        expires = int(item.get("expires", default_expires))
+    except (AttributeError, KeyError, TypeError, ValueError):
+        raise S3Error(
+            400, "InvalidArgument", "Every request needs `path`, optionally `method`, `params`, `expires`"
+        ) from None
+    if not 0 < expires <= MAX_EXPIRES:
+        raise S3Error(400, "InvalidArgument", "Expiry must be positive and at most a week")
+    return method, path, params, expires
+
+
+class UrlPresigner:
+    """
+    Mints URLs presigned for the proxy host with the credentials of the caller from the `key_store`, for the caller
+    whose request was verified. Signing keys are derived once per day, so minting a URL takes single HMAC.
+    """
+
+    def __init__(self, key_store, region):
+        self.key_store = key_store
+        self.signer = SigV4Signer(region, "s3")
+        self.minted = 0
+
+    async def presign(self, request):
+        """
+        Returns presigned URLs for JSON body `{"expires": 3600, "requests": [{"method": "GET", "path": "/bucket/key",
+        "params": {"versionId": "..."}, "expires": 60}]}`, in the order of requests.
+        """
+        try:
+            body = json.loads(await request.body())
+            default_expires = body.get("expires", DEFAULT_EXPIRES)
+            items = list(body["requests"])
+        except (AttributeError, KeyError, TypeError, ValueError):
+            raise S3Error(400, "MalformedJSON", "Body must be JSON object with list of `requests`") from None
+        if len(items) > MAX_PRESIGNED_URLS:
+            raise S3Error(400, "InvalidArgument", f"At most {MAX_PRESIGNED_URLS} URLs can be presigned at once")
+        access_key = get_access_key_id(request.headers)
+        if access_key is None:
+            raise S3Error(403, "AccessDenied", "Presigning requires request signed with authorization header")
+        secret_key = self.key_store.secrets[access_key]
+        host = request.headers["host"]
+        base_url = f"{request.url.scheme}://{host}"
+        urls = []
+        for item in items:
+            method, path, params, expires = parse_presign_request(item, default_expires)
+            query = self.signer.presign(access_key, secret_key, method, path, host, params, expires)
+            urls.append(base_url + urllib.parse.quote(path, safe="/~") + "?" + encode_query(query))
+        self.minted += len(urls)
+        return urls
@@ -0,0 +1,101 @@
+"""
+On-demand profiling of a running worker: CPU profile of the event loop thread, or trace of the event loop lag with
+stacks of the code blocking the loop.
+"""
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+
+# frames of blocking stacks reported, the innermost ones
+STACK_LIMIT = 20
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+class Profiler:
+    """
+    Captures one profile at a time, at most `max_duration` seconds long.
+    """
+
+    def __init__(self, max_duration=60.0):
+        self.max_duration = max_duration
+        self.running = False
+        self.profiles = 0
+
+    async def run(self, profile, duration, **kwargs):
+        if self.running:
+            raise ProfilerBusy()
+        self.running = True
+        self.profiles += 1
+        try:
+            return await profile(min(duration, self.max_duration), **kwargs)
+        finally:
+            self.running = False
+
+    async def profile_cpu(self, duration, limit=50):
+        """
+        Returns pstats report of the calls made by the event loop thread within `duration` seconds, `limit` entries
+        with the highest cumulative time.
+        """
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            await asyncio.sleep(duration)
+        finally:
+            profile.disable()
+        output = io.StringIO()
+        output.write(f"pid {os.getpid()}, {duration}s\n")
+        pstats.Stats(profile, stream=output).sort_stats("cumulative").print_stats(limit)
+        return output.getvalue()
+
+    async def trace_lag(self, duration, interval=0.01, threshold=0.05):
+        """
+        Measures how late the event loop wakes up from `interval` sleeps within `duration` seconds. A watchdog thread
+        samples the stack of the loop thread whenever the loop didn't wake up for `threshold` seconds.
+        """
+        loop_thread = threading.get_ident()
+        beat = time.monotonic()
+        blocking = Counter()
+        stopped = threading.Event()
+
+        def watch():
+            while not stopped.wait(interval):
+                frame = sys._current_frames().get(loop_thread)
+                if frame is not None and time.monotonic() - beat > threshold:
+                    blocking["".join(traceback.format_stack(frame)[-STACK_LIMIT:])] += 1
+
+        watchdog = threading.Thread(target=watch, name="lag-watchdog", daemon=True)
+        watchdog.start()
+        lags = []
+        deadline = time.monotonic() + duration
+        try:
+            while beat < deadline:
+                await asyncio.sleep(interval)
+                now = time.monotonic()
+                lags.append(max(now - beat - interval, 0.0))
+                beat = now
+        finally:
+            stopped.set()
+            await asyncio.to_thread(watchdog.join)
+        lags.sort()
+        return {
+            "pid": os.getpid(),
+            "duration": duration,
+            "samples": len(lags),
+            "p50_ms": lags[len(lags) // 2] * 1000 if lags else None,
+            "p99_ms": lags[int(len(lags) * 0.99)] * 1000 if lags else None,
+            "max_ms": lags[-1] * 1000 if lags else None,
+            "blocking": [{"samples": count, "stack": stack} for stack, count in blocking.most_common(10)],
+        }
+
+    def stats(self):
+        return {"running": self.running, "profiles": self.profiles}
@@ -0,0 +1,176 @@
+import asyncio
+from collections import deque
+
+import httpx
+
+from .logging import root_logger
+from .s3 import PRESIGNED_PARAMS, get_bucket_key, parse_content_range, parse_range
+
+logger = root_logger.getChild(__name__)
+
+# requests with these headers are passed upstream as they are
+BYPASS_HEADERS = ("if-match", "if-none-match", "if-modified-since", "if-unmodified-since")
+
+
+class RangedResponse:
+    """
+    Quacks like streamed `httpx.Response`, body is the first part response followed by the rest of the parts.
+
+    With `concurrency` above 1 the parts are fetched in parallel, buffered and reassembled in order, at most
+    `concurrency` parts are fetched or buffered at a time. Otherwise parts are streamed one after another.
+    """
+
+    def __init__(self, status_code, headers, first_response, parts=(), fetch_part=None, concurrency=1):
+        self.status_code = status_code
+        self.headers = headers
+        self._first_response = first_response
+        self._parts = parts
+        self._fetch_part = fetch_part
+        self._concurrency = concurrency
+        self._tasks = deque()
+
+    async def _read_part(self, start, end):
+        part = await self._fetch_part(start, end)
+        try:
+            return await part.aread()
+        finally:
+            await part.aclose()
+
+    def _schedule(self, parts, count):
+        loop = asyncio.get_running_loop()
+        for start, end in parts:
+            self._tasks.append(loop.create_task(self._read_part(start, end)))
+            count -= 1
+            if count <= 0:
+                break
+
+    async def aiter_raw(self):
+        parts = iter(self._parts)
+        if self._concurrency > 1:
+            # the first part is streamed, remaining slots are used to fetch following parts meanwhile
+            self._schedule(parts, self._concurrency - 1)
+        async for chunk in self._first_response.aiter_raw():
+            yield chunk
+        await self._first_response.aclose()
+        if self._concurrency > 1:
+            while self._tasks:
+                body = await self._tasks.popleft()
+                self._schedule(parts, 1)
+                yield body
+            return
+        for start, end in parts:
+            part = await self._fetch_part(start, end)
+            try:
+                async for chunk in part.aiter_raw():
+                    yield chunk
+            finally:
+                await part.aclose()
+
+    async def aclose(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks.clear()
+        await self._first_response.aclose()
+
+
+class ParallelRangeFetcher:
+    """
+    Splits GET Object of large objects into parallel upstream Range requests.
+
+    The first part is requested as a Range request, its Content-Range tells the size of the object. Objects with
+    requested span smaller than `threshold` are fetched with a single request for the rest of the span, larger ones
+    with parallel `part_size` Range requests pinned to the ETag of the first part with If-Match.
+    """
+
+    def __init__(self, threshold, part_size=8 * 1024**2, concurrency=4):
+        self.threshold = threshold
+        self.part_size = part_size
+        self.concurrency = concurrency
+        self.split_requests = 0
+        self.parts = 0
+
+    def get_span(self, request, extra_headers):
+        """
+        Returns (start, end) requested by the client, end is None when the client requests the object till its end.
+        Returns None when the request should be passed upstream as it is.
+        """
+        headers = {**request.headers, **extra_headers}
+        if request.method != "GET" or set(request.query_params) - PRESIGNED_PARAMS - {"versionId"}:
+            return None
+        if any(header in headers for header in BYPASS_HEADERS):
+            return None
+        bucket, key = get_bucket_key(request.url.path)
+        if bucket is None or key is None:
+            return None
+        if "range" not in headers:
+            return 0, None
+        byte_range = parse_range(headers["range"])
+        if byte_range is None or byte_range[0] is None:
+            # multiple and suffix ranges are passed as they are
+            return None
+        return byte_range
+
+    def wrap(self, request, fetch):
+        """
+        Wraps `fetch(extra_headers)` coroutine returning upstream response, so that GETs of large objects are
+        fetched as parallel Range requests.
+        """
+
+        async def ranged_fetch(extra_headers=None):
+            extra_headers = extra_headers or {}
+            span = self.get_span(request, extra_headers)
+            if span is None:
+                return await fetch(extra_headers)
+            client_range = "range" in request.headers or "range" in extra_headers
+            return await self._fetch(fetch, extra_headers, span, client_range)
+
+        return ranged_fetch
+
+    async def _fetch(self, fetch, extra_headers, span, client_range):
+        start, end = span
+        first_end = start + self.part_size - 1 if end is None else min(start + self.part_size - 1, end)
+        response = await fetch({**extra_headers, "range": f"bytes={start}-{first_end}"})
+        if response.status_code == 416 and not client_range:
+            # the Range was added by the proxy, empty objects have no byte to satisfy it
+            await response.aclose()
+            return await fetch(extra_headers)
+        content_range = parse_content_range(response.headers.get("content-range"))
+        if response.status_code != 206 or content_range is None:
+            # error or upstream ignoring Range header
+            return response
+        _, first_end, total = content_range
+        end = total - 1 if end is None else min(end, total - 1)
+        headers = httpx.Headers(response.headers)
+        headers["content-length"] = str(end - start + 1)
+        if client_range:
+            status_code = 206
+            headers["content-range"] = f"bytes {start}-{end}/{total}"
+        else:
+            status_code = 200
+            del headers["content-range"]
+        if first_end >= end:
+            return RangedResponse(status_code, headers, response)
+        etag = response.headers.get("etag")
+
+        async def fetch_part(part_start, part_end):
+            part_headers = {**extra_headers, "range": f"bytes={part_start}-{part_end}"}
+            if etag is not None:
+                # all parts must come from the same version of the object
+                part_headers["if-match"] = etag
+            part = await fetch(part_headers)
+            if part.status_code != 206:
+                await part.aclose()
+                raise Exception(f"Unexpected status {part.status_code} of part {part_start}-{part_end}")
+            return part
+
+        if end - start + 1 <= self.threshold:
+            return RangedResponse(status_code, headers, response, [(first_end + 1, end)], fetch_part)
+        parts = []
+        for part_start in range(first_end + 1, end + 1, self.part_size):
+            parts.append((part_start, min(part_start + self.part_size - 1, end)))
+        self.split_requests += 1
+        self.parts += len(parts) + 1
+        return RangedResponse(status_code, headers, response, parts, fetch_part, self.concurrency)
+
+    def stats(self):
+        return {"split_requests": self.split_requests, "parts": self.parts}
@@ -0,0 +1,273 @@
+import asyncio
+from collections import OrderedDict
+
+import httpx
+
+from .logging import root_logger
+from .s3 import (
+    PRESIGNED_PARAMS,
+    get_access_key_id,
+    get_bucket_key,
+    parse_content_range,
+    parse_range,
+)
+
+logger = root_logger.getChild(__name__)
+
+# headers of the upstream response which describe the object and are repeated in responses served from the buffer
+SKIPPED_HEADERS = {"content-length", "content-range", "date", "connection", "keep-alive", "transfer-encoding"}
+BYPASS_HEADERS = ("if-match", "if-none-match", "if-modified-since", "if-unmodified-since")
+
+
+class BufferedResponse:
+    """
+    Quacks like streamed `httpx.Response` for a range served from read-ahead buffer.
+    """
+
+    def __init__(self, status_code, headers, body):
+        self.status_code = status_code
+        self.headers = headers
+        self._body = body
+
+    async def aiter_raw(self):
+        yield self._body
+
+    async def aread(self):
+        return self._body
+
+    async def aclose(self):
+        pass
+
+
+class Segment:
+    def __init__(self, start, end, task):
+        self.start = start
+        self.end = end
+        self.task = task
+
+    @property
+    def size(self):
+        return self.end - self.start + 1
+
+
+class ReadAheadStream:
+    """
+    Sequential access state of single object read by single client.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.next_offset = None
+        self.sequential = 0
+        self.etag = None
+        self.total = None
+        self.headers = None
+        # prefetched segments ordered by offset
+        self.segments = []
+
+    @property
+    def prefetched_end(self):
+        return self.segments[-1].end if self.segments else None
+
+
+class ReadAhead:
+    """
+    Detects sequential Range GETs of the same object by the same client and prefetches following windows
+    in the background, so the next Range requests are answered from memory instead of making a round trip.
+
+    Stream prefetches once it made `trigger` adjacent requests. The window starts at `min_window` and doubles with
+    every hit up to `max_window`, random access resets it. All streams share `buffer_size` bytes, least recently used
+    streams are dropped when it runs out.
+    """
+
+    def __init__(
+        self, min_window=1024**2, max_window=16 * 1024**2, buffer_size=256 * 1024**2, trigger=2, max_streams=10000
+    ):
+        self.min_window = min_window
+        self.max_window = max_window
+        self.buffer_size = buffer_size
+        self.trigger = trigger
+        self.max_streams = max_streams
+        self.buffered = 0
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self.wasted = 0
+        self._streams = OrderedDict()
+
+    def get_stream_key(self, request, extra_headers):
+        """
+        Returns (stream key, (start, end)) of closed Range GET or None when it's not subject to read-ahead.
+        """
+        headers = {**request.headers, **extra_headers}
+        if request.method != "GET" or set(request.query_params) - PRESIGNED_PARAMS - {"versionId"}:
+            return None
+        if any(header in headers for header in BYPASS_HEADERS):
+            return None
+        byte_range = parse_range(headers.get("range"))
+        if byte_range is None or byte_range[0] is None or byte_range[1] is None:
+            return None
+        bucket, key = get_bucket_key(request.url.path)
+        if bucket is None or key is None:
+            return None
+        client = request.client.host if request.client else None
+        stream_key = (get_access_key_id(headers), client, bucket, key, request.query_params.get("versionId"))
+        return stream_key, byte_range
+
+    def wrap(self, request, fetch):
+        """
+        Wraps `fetch(extra_headers)` coroutine returning upstream response, so that sequential Range GETs
+        are answered from read-ahead buffer.
+        """
+
+        async def readahead_fetch(extra_headers=None):
+            extra_headers = extra_headers or {}
+            stream_key = self.get_stream_key(request, extra_headers)
+            if stream_key is None:
+                return await fetch(extra_headers)
+            return await self._fetch(fetch, extra_headers, *stream_key)
+
+        return readahead_fetch
+
+    def _get_stream(self, stream_key):
+        stream = self._streams.get(stream_key)
+        if stream is None:
+            stream = self._streams[stream_key] = ReadAheadStream(self.min_window)
+            if len(self._streams) > self.max_streams:
+                _, oldest = self._streams.popitem(last=False)
+                self._drop_segments(oldest, wasted=True)
+        self._streams.move_to_end(stream_key)
+        return stream
+
+    async def _fetch(self, fetch, extra_headers, stream_key, byte_range):
+        start, end = byte_range
+        stream = self._get_stream(stream_key)
+        if stream.next_offset != start:
+            # random access, whatever was prefetched is not going to be read
+            self._drop_segments(stream, wasted=True)
+            stream.sequential = 0
+            stream.window = self.min_window
+        stream.sequential += 1
+        stream.next_offset = end + 1
+        body = await self._read_buffered(stream, start, end)
+        if body is not None:
+            self.hits += 1
+            stream.window = min(stream.window * 2, self.max_window)
+            self._prefetch(fetch, extra_headers, stream_key, stream)
+            headers = httpx.Headers(stream.headers)
+            headers["content-length"] = str(len(body))
+            headers["content-range"] = f"bytes {start}-{start + len(body) - 1}/{stream.total}"
+            return BufferedResponse(206, headers, body)
+        self.misses += 1
+        self._drop_segments(stream, wasted=True)
+        response = await fetch(extra_headers)
+        content_range = parse_content_range(response.headers.get("content-range"))
+        if response.status_code == 206 and content_range is not None:
+            stream.total = content_range[2]
+            stream.etag = response.headers.get("etag")
+            stream.headers = [(k, v) for k, v in response.headers.items() if k not in SKIPPED_HEADERS]
+            if stream.sequential >= self.trigger:
+                self._prefetch(fetch, extra_headers, stream_key, stream)
+        return response
+
+    def _get_covering_segments(self, stream, start, end):
+        covering = []
+        position = start
+        for segment in stream.segments:
+            if segment.start <= position <= segment.end:
+                covering.append(segment)
+                position = segment.end + 1
+                if position > end:
+                    return covering
+        return None
+
+    async def _read_buffered(self, stream, start, end):
+        """
+        Returns body of the range from prefetched segments or None when they don't cover it.
+        """
+        covering = self._get_covering_segments(stream, start, end)
+        if covering is None or stream.total is None:
+            return None
+        chunks = []
+        for segment in covering:
+            try:
+                body = await asyncio.shield(segment.task)
+            except asyncio.CancelledError:
+                if not segment.task.cancelled():
+                    raise
+                # dropped meanwhile by concurrent request of the same stream
+                return None
+            if body is None or len(body) != segment.size:
+                return None
+            chunk_start = max(start - segment.start, 0)
+            chunk_end = min(end, segment.end) - segment.start + 1
+            chunks.append(body[chunk_start:chunk_end])
+        # segments read till their end are not needed anymore, reads are sequential
+        for segment in [segment for segment in stream.segments if segment.end <= end]:
+            self._remove_segment(stream, segment)
+        return b"".join(chunks)
+
+    def _remove_segment(self, stream, segment, wasted=False):
+        stream.segments.remove(segment)
+        self.buffered -= segment.size
+        if wasted:
+            segment.task.cancel()
+            self.wasted += segment.size
+
+    def _drop_segments(self, stream, wasted=False):
+        for segment in list(stream.segments):
+            self._remove_segment(stream, segment, wasted)
+
+    def _reserve(self, size, stream_key):
+        while self.buffered + size > self.buffer_size:
+            victim = next((key for key, stream in self._streams.items() if key != stream_key and stream.segments), None)
+            if victim is None:
+                return False
+            self._drop_segments(self._streams.pop(victim), wasted=True)
+        self.buffered += size
+        return True
+
+    def _prefetch(self, fetch, extra_headers, stream_key, stream):
+        if stream.total is None:
+            return
+        prefetched_end = stream.prefetched_end if stream.prefetched_end is not None else stream.next_offset - 1
+        if prefetched_end - stream.next_offset + 1 >= stream.window // 2:
+            # still far enough ahead of the reader
+            return
+        prefetch_from = prefetched_end + 1
+        prefetch_to = min(prefetch_from + stream.window - 1, stream.total - 1)
+        if prefetch_to < prefetch_from or not self._reserve(prefetch_to - prefetch_from + 1, stream_key):
+            return
+        task = asyncio.get_running_loop().create_task(
+            self._fetch_segment(fetch, extra_headers, stream.etag, prefetch_from, prefetch_to)
+        )
+        stream.segments.append(Segment(prefetch_from, prefetch_to, task))
+        self.prefetched += prefetch_to - prefetch_from + 1
+
+    async def _fetch_segment(self, fetch, extra_headers, etag, start, end):
+        headers = {**extra_headers, "range": f"bytes={start}-{end}"}
+        if etag is not None:
+            headers["if-match"] = etag
+        try:
+            response = await fetch(headers)
+            try:
+                if response.status_code != 206:
+                    return None
+                return await response.aread()
+            finally:
+                await response.aclose()
+        except Exception as e:
+            logger.debug("Read-ahead of bytes %d-%d failed", start, end, exc_info=e)
+            return None
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / requests if requests else 0.0,
+            "buffered": self.buffered,
+            "prefetched": self.prefetched,
+            "wasted": self.wasted,
+            "streams": len(self._streams),
+        }
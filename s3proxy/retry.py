@@ -0,0 +1,148 @@
+import asyncio
+import random
+import tempfile
+
+import httpx
+
+from . import metrics
+from .logging import root_logger
+
+logger = root_logger.getChild(__name__)
+
+# 500 InternalError, 502, 503 SlowDown and ServiceUnavailable, 504
+RETRIED_STATUSES = {500, 502, 503, 504}
+# requests which can be sent again safely, POSTs (CreateMultipartUpload, CompleteMultipartUpload, DeleteObjects) can't
+RETRIED_METHODS = {"GET", "HEAD"}
+# retried only when enabled, their bodies have to be spooled to be replayed
+RETRIED_WRITE_METHODS = {"PUT", "DELETE"}
+SPOOL_CHUNK_SIZE = 64 * 1024
+
+
+class SpooledBody:
+    """
+    Request body which can be sent more than once. Chunks read from the `stream` are spooled (in memory up to
+    `memory_size` bytes, then in a temporary file) while they're sent, every next `iterate()` replays the spooled
+    part before reading on. Once the body exceeds `max_size` spooling stops and the body can't be replayed.
+    """
+
+    def __init__(self, stream, max_size, memory_size):
+        self.stream = stream.__aiter__()
+        self.max_size = max_size
+        self.size = 0
+        self.replayable = True
+        self._spool = tempfile.SpooledTemporaryFile(max_size=memory_size)
+
+    async def iterate(self):
+        offset = 0
+        while offset < self.size:
+            self._spool.seek(offset)
+            chunk = self._spool.read(min(SPOOL_CHUNK_SIZE, self.size - offset))
+            offset += len(chunk)
+            yield chunk
+        async for chunk in self.stream:
+            self.size += len(chunk)
+            if self.replayable and self.size > self.max_size:
+                self.replayable = False
+                self._spool.close()
+            if self.replayable:
+                self._spool.seek(0, 2)
+                self._spool.write(chunk)
+            yield chunk
+
+    def close(self):
+        self._spool.close()
+
+
+class RetryPolicy:
+    """
+    Retries GETs and HEADs failing with connection errors or 5xx responses (including 503 SlowDown) up to
+    `max_retries` times, with exponential backoff with full jitter between `base_delay` and `max_delay` seconds.
+    With `retry_writes` PUTs and DELETEs are retried too.
+
+    Retries are limited by a budget: every request earns `budget` tokens (up to `max_tokens`) and every retry spends
+    one, so an upstream outage can't multiply the load. Bodies of retried writes up to `max_body_size` are spooled
+    (in memory up to `memory_size`) to be replayed, requests with larger bodies are sent once.
+    """
+
+    def __init__(
+        self,
+        max_retries=2,
+        base_delay=0.05,
+        max_delay=1.0,
+        budget=0.1,
+        max_body_size=16 * 1024**2,
+        memory_size=1024**2,
+        max_tokens=10,
+        retry_writes=False,
+    ):
+        self.max_retries = max_retries
+        self.methods = RETRIED_METHODS | RETRIED_WRITE_METHODS if retry_writes else RETRIED_METHODS
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.max_body_size = max_body_size
+        self.memory_size = memory_size
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.requests = 0
+        self.retries = 0
+        self.exhausted = 0
+
+    def get_delay(self, retry):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**retry))
+
+    def can_retry(self, retry, body):
+        if retry > self.max_retries or (body is not None and not body.replayable):
+            return False
+        if self.tokens < 1:
+            self.exhausted += 1
+            return False
+        self.tokens -= 1
+        return True
+
+    def is_retried(self, request):
+        if request.method not in self.methods:
+            return False
+        # bodies of reads are not spooled
+        return request.method not in RETRIED_METHODS or int(request.headers.get("content-length", 0)) == 0
+
+    async def send(self, request, send):
+        """
+        Returns upstream response of `send(body)` coroutine, where `body` is async iterator of the request body or
+        None, retrying it when it fails. Every attempt is signed anew by `send`.
+        """
+        if not self.is_retried(request):
+            return await send(None)
+        self.requests += 1
+        self.tokens = min(self.tokens + self.budget, self.max_tokens)
+        content_length = int(request.headers.get("content-length", 0))
+        if content_length > self.max_body_size:
+            # too large to be spooled, it's sent once
+            return await send(None)
+        spooled = None
+        if content_length > 0:
+            spooled = SpooledBody(request.stream(), self.max_body_size, self.memory_size)
+        try:
+            retry = 0
+            while True:
+                retry += 1
+                try:
+                    response = await send(spooled.iterate() if spooled is not None else None)
+                except httpx.TransportError as e:
+                    if not self.can_retry(retry, spooled):
+                        raise
+                    logger.warning("Retrying %s %s after %r", request.method, request.url.path, e)
+                else:
+                    if response.status_code not in RETRIED_STATUSES or not self.can_retry(retry, spooled):
+                        return response
+                    logger.warning("Retrying %s %s after %d", request.method, request.url.path, response.status_code)
+                    await response.aclose()
+                self.retries += 1
+                metrics.UPSTREAM_RETRIES.inc()
+                await asyncio.sleep(self.get_delay(retry))
+        finally:
+            if spooled is not None:
+                spooled.close()
+
+    def stats(self):
+        return {"requests": self.requests, "retries": self.retries, "budget_exhausted": self.exhausted}
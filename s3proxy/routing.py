@@ -0,0 +1,209 @@
+import random
+import time
+from hashlib import sha256
+
+from starlette.datastructures import URL
+
+from .awssigv4 import SigV4Signer
+from .logging import root_logger
+from .presign import encode_query
+from .s3 import S3Error, get_bucket_key
+
+logger = root_logger.getChild(__name__)
+
+READ_METHODS = {"GET", "HEAD"}
+# weight of the latest response in exponentially weighted moving average of backend latency
+EWMA_WEIGHT = 0.3
+
+
+class Backend:
+    """
+    Upstream S3 endpoint with its own region, credentials provider, connection pool and signer, plus the state used
+    for balancing: requests waiting for response headers, EWMA of time to response headers and consecutive failures.
+    """
+
+    def __init__(self, name, endpoint_url, region, aws_provider, http_client):
+        self.name = name
+        self.endpoint_url = URL(endpoint_url)
+        self.region = region
+        self.aws_provider = aws_provider
+        self.http_client = http_client
+        self.signer = SigV4Signer(region, "s3")
+        self.outstanding = 0
+        self.ewma = None
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+
+    async def send(self, method, url, params, headers, content=b"", body_hash=None, stream=False):
+        """
+        Sends request made by the proxy on its own (e.g. part of multipart upload) for the object at `url` of incoming
+        request, signed with the credentials of the backend. All `headers` are signed, `body_hash` is sha256 of
+        `content` unless it's given.
+        """
+        url = url.replace(
+            hostname=self.endpoint_url.hostname,
+            scheme=self.endpoint_url.scheme,
+            port=self.endpoint_url.port,
+            query=encode_query(params),
+        )
+        headers = dict(headers)
+        headers["host"] = self.endpoint_url.hostname
+        headers["x-amz-content-sha256"] = body_hash or sha256(content).hexdigest()
+        credentials = await self.aws_provider.get_access_credentials()
+        if credentials.session_token is not None:
+            headers["x-amz-security-token"] = credentials.session_token
+        headers["authorization"] = self.signer.sign(
+            credentials.access_key,
+            credentials.secret_key,
+            method,
+            url.path,
+            headers,
+            params=params,
+            body_hash=headers["x-amz-content-sha256"],
+        )
+        request = await self.http_client.build_request(method, str(url), headers=headers, content=content)
+        return await self.http_client.send(request, stream=stream)
+
+    def is_ejected(self, now):
+        return self.ejected_until > now
+
+    def record_success(self, latency):
+        self.consecutive_failures = 0
+        self.ewma = latency if self.ewma is None else EWMA_WEIGHT * latency + (1 - EWMA_WEIGHT) * self.ewma
+
+    def record_failure(self, eject_after, eject_duration):
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= eject_after:
+            if not self.is_ejected(time.monotonic()):
+                logger.warning("Ejecting backend %s after %d failures", self.name, self.consecutive_failures)
+            self.ejected_until = time.monotonic() + eject_duration
+
+    async def close(self):
+        await self.http_client.close_session()
+        await self.aws_provider.close()
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "outstanding": self.outstanding,
+            "ewma_ms": self.ewma * 1000 if self.ewma is not None else None,
+            "failures": self.failures,
+            "ejected": self.is_ejected(time.monotonic()),
+        }
+
+
+class ReplicaSet:
+    """
+    Backends serving the same data. Reads are balanced between healthy replicas and fail over to the next best one
+    on connection errors and 5xx responses, writes always go to the first (primary) replica.
+
+    With `ewma` balancing replicas are ranked by EWMA latency weighted by outstanding requests, so slow replicas get
+    fewer requests, with `least_outstanding` just by outstanding requests. Replicas without any measurement yet
+    are tried first. Replica failing `eject_after` times in a row is ejected for `eject_duration` seconds, ejected
+    replicas are used only when none other is left.
+    """
+
+    def __init__(self, backends, balancing="ewma", eject_after=3, eject_duration=30.0):
+        self.backends = backends
+        self.balancing = balancing
+        self.eject_after = eject_after
+        self.eject_duration = eject_duration
+
+    def get_score(self, backend):
+        if self.balancing == "least_outstanding":
+            return backend.outstanding
+        if backend.ewma is None:
+            return 0.0
+        return backend.ewma * (backend.outstanding + 1)
+
+    def get_candidates(self, method):
+        """
+        Returns backends to try in order.
+        """
+        if method not in READ_METHODS or len(self.backends) == 1:
+            return self.backends[:1]
+        now = time.monotonic()
+        # random tie breaking, so replicas with equal scores share the load
+        ranked = sorted(self.backends, key=lambda backend: (self.get_score(backend), random.random()))
+        return [backend for backend in ranked if not backend.is_ejected(now)] + [
+            backend for backend in ranked if backend.is_ejected(now)
+        ]
+
+    async def fetch(self, request, send):
+        """
+        Sends the request with `send(backend)` coroutine returning upstream response to the best backend, reads
+        without body are retried with the other replicas.
+        """
+        candidates = self.get_candidates(request.method)
+        if int(request.headers.get("content-length", 0)) > 0:
+            # body stream can be consumed only once
+            candidates = candidates[:1]
+        for attempt, backend in enumerate(candidates, 1):
+            last = attempt == len(candidates)
+            backend.requests += 1
+            backend.outstanding += 1
+            started = time.monotonic()
+            try:
+                response = await send(backend)
+            except S3Error:
+                # fault of the client's request, e.g. its body, not of the backend
+                raise
+            except Exception as e:
+                backend.record_failure(self.eject_after, self.eject_duration)
+                if last:
+                    raise
+                logger.warning("Backend %s failed, failing over", backend.name, exc_info=e)
+                continue
+            finally:
+                backend.outstanding -= 1
+            if response.status_code < 500:
+                backend.record_success(time.monotonic() - started)
+                return response
+            backend.record_failure(self.eject_after, self.eject_duration)
+            if last:
+                return response
+            logger.warning("Backend %s responded with %d, failing over", backend.name, response.status_code)
+            await response.aclose()
+
+
+class BucketRoute:
+    def __init__(self, bucket, prefix, replica_set):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.replica_set = replica_set
+
+
+class Router:
+    """
+    Maps buckets and key prefixes to replica sets, requests which don't match any route go to the `default` one.
+    """
+
+    def __init__(self, routes=(), default=None):
+        # longest prefixes are matched first
+        self.routes = sorted(routes, key=lambda route: len(route.prefix), reverse=True)
+        self.default = default
+
+    def get_replica_set(self, path):
+        bucket, key = get_bucket_key(path)
+        for route in self.routes:
+            if route.bucket == bucket and (key or "").startswith(route.prefix):
+                return route.replica_set
+        return self.default
+
+    @property
+    def backends(self):
+        backends = {}
+        for replica_set in [route.replica_set for route in self.routes] + [self.default]:
+            if replica_set is not None:
+                backends.update((backend.name, backend) for backend in replica_set.backends)
+        return list(backends.values())
+
+    async def close(self):
+        for backend in self.backends:
+            await backend.close()
+
+    def stats(self):
+        return {backend.name: backend.stats() for backend in self.backends}
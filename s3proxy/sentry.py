@@ -1,6 +1,3 @@
-import sentry_sdk
-from sentry_sdk.integrations.starlette import StarletteIntegration
-
 from .config import settings
 from .logging import root_logger
 
@@ -8,11 +5,25 @@ logger = root_logger.getChild(__name__)
 
 
 if settings.SENTRY_DSN:
+    # sentry_sdk is imported only when it's going to be used, it's heavy and slows down cold start otherwise
+    import sentry_sdk
+    from sentry_sdk.integrations.starlette import StarletteIntegration
+
     sentry_sdk.init(
         dsn=settings.SENTRY_DSN,
         integrations=[
             StarletteIntegration(transaction_style="url"),
         ],
+        # transactions of proxied requests are sampled by the tracer, see `tracing`
+        traces_sample_rate=settings.TRACES_SAMPLE_RATE if settings.TRACING_EXPORTER == "sentry" else None,
     )
 else:
     logger.warning("No SENTRY_DSN set, Sentry integration disabled")
+
+
+def capture_exception(error):
+    """
+    Reports errors of requests which are not handled by Starlette and so are not seen by its integration.
+    """
+    if settings.SENTRY_DSN:
+        sentry_sdk.capture_exception(error)
@@ -0,0 +1,136 @@
+"""
+Sampled tracing of proxied requests. Phases measured for the metrics anyway (credentials, signing, upstream send and
+body streaming) are recorded as spans of sampled requests and exported once the request is done, as Sentry
+transactions or OpenTelemetry traces. Requests which are not sampled cost a random number, none when disabled.
+"""
+import random
+import time
+from datetime import datetime, timezone
+
+from .logging import root_logger
+from .s3 import get_bucket_key
+
+logger = root_logger.getChild(__name__)
+
+
+class RequestTrace:
+    """
+    Spans of single request measured with `time.perf_counter()`, exported with wall clock time.
+    """
+
+    def __init__(self, exporter, method, path):
+        self.exporter = exporter
+        bucket, _ = get_bucket_key(path)
+        # named by method and bucket, keys would make too many distinct transactions
+        self.name = f"{method} {bucket or '/'}"
+        self.attributes = {"http.method": method, "s3.bucket": bucket or ""}
+        self.started = time.perf_counter()
+        self.offset = time.time() - self.started
+        self.spans = []
+
+    def get_timestamp(self, counter):
+        return self.offset + counter
+
+    def add_span(self, name, start, end, **attributes):
+        self.spans.append((name, start, end, attributes))
+
+    def finish(self, status):
+        self.attributes["http.status_code"] = str(status)
+        try:
+            self.exporter.export(self, time.perf_counter())
+        except Exception as e:
+            logger.warning("Failed to export trace of %s", self.name, exc_info=e)
+
+
+class SentryExporter:
+    def __init__(self):
+        import sentry_sdk
+
+        self.sentry_sdk = sentry_sdk
+
+    def get_datetime(self, trace, counter):
+        return datetime.fromtimestamp(trace.get_timestamp(counter), timezone.utc)
+
+    def export(self, trace, ended):
+        transaction = self.sentry_sdk.start_transaction(
+            op="http.server",
+            name=trace.name,
+            source="route",
+            sampled=True,
+            start_timestamp=self.get_datetime(trace, trace.started),
+        )
+        for name, value in trace.attributes.items():
+            transaction.set_data(name, value)
+        for name, start, end, attributes in trace.spans:
+            span = transaction.start_child(op=name, start_timestamp=self.get_datetime(trace, start))
+            for attribute, value in attributes.items():
+                span.set_data(attribute, value)
+            span.finish(end_timestamp=self.get_datetime(trace, end))
+        if trace.attributes["http.status_code"].isdigit():
+            transaction.set_http_status(int(trace.attributes["http.status_code"]))
+        transaction.finish(end_timestamp=self.get_datetime(trace, ended))
+
+
+class OpenTelemetryExporter:
+    """
+    Exports spans with the tracer provider of the process. Unless one is set up already, OTLP exporter configured
+    by OTEL_EXPORTER_OTLP_* environment variables is set up.
+    """
+
+    def __init__(self, service_name):
+        from opentelemetry import trace
+
+        if isinstance(trace.get_tracer_provider(), trace.ProxyTracerProvider):
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+                OTLPSpanExporter,
+            )
+            from opentelemetry.sdk.resources import Resource
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+            provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+            provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+            trace.set_tracer_provider(provider)
+        self.trace = trace
+        self.tracer = trace.get_tracer("s3proxy")
+
+    def get_nanoseconds(self, trace, counter):
+        return int(trace.get_timestamp(counter) * 1e9)
+
+    def export(self, trace, ended):
+        root = self.tracer.start_span(
+            trace.name,
+            kind=self.trace.SpanKind.SERVER,
+            attributes=trace.attributes,
+            start_time=self.get_nanoseconds(trace, trace.started),
+        )
+        context = self.trace.set_span_in_context(root)
+        for name, start, end, attributes in trace.spans:
+            span = self.tracer.start_span(
+                name, context=context, attributes=attributes, start_time=self.get_nanoseconds(trace, start)
+            )
+            span.end(end_time=self.get_nanoseconds(trace, end))
+        root.end(end_time=self.get_nanoseconds(trace, ended))
+
+
+class Tracer:
+    """
+    Traces `sample_rate` fraction of requests with the `exporter`.
+    """
+
+    def __init__(self, exporter, sample_rate):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.sampled = 0
+
+    def start(self, request):
+        """
+        Returns trace of the request if it's sampled, otherwise None.
+        """
+        if random.random() >= self.sample_rate:
+            return None
+        self.sampled += 1
+        return RequestTrace(self.exporter, request.method, request.url.path)
+
+    def stats(self):
+        return {"sample_rate": self.sample_rate, "sampled": self.sampled}
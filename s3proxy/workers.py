@@ -0,0 +1,202 @@
+"""
+Multi-process serving: worker processes bind their own SO_REUSEPORT sockets to the same port, so the kernel spreads
+connections among them. The supervisor restarts workers which died or stopped beating, replaces them one by one
+on SIGHUP and drains them on SIGTERM or SIGINT.
+"""
+import asyncio
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import time
+
+from .broker import CredentialBroker
+from .logging import root_logger
+
+logger = root_logger.getChild(__name__)
+
+HEARTBEAT_INTERVAL = 1.0
+CHECK_INTERVAL = 1.0
+APP = "s3proxy.main:app_factory"
+
+
+def create_socket(host, port, backlog=2048):
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+async def beat(server, heartbeat):
+    while True:
+        # a worker is healthy once it started serving and as long as its event loop is not blocked
+        if server.started:
+            heartbeat.value = time.time()
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+
+async def serve(server, sock, heartbeat):
+    beating = asyncio.ensure_future(beat(server, heartbeat))
+    try:
+        await server.serve(sockets=[sock])
+    finally:
+        beating.cancel()
+
+
+def run_worker(host, port, heartbeat, graceful_timeout):
+    """
+    Entry point of worker process. Uvicorn stops accepting connections on SIGTERM and waits for the open ones
+    at most `graceful_timeout` seconds.
+    """
+    import uvicorn
+
+    config = uvicorn.Config(APP, factory=True, log_config=None, timeout_graceful_shutdown=graceful_timeout)
+    asyncio.run(serve(uvicorn.Server(config), create_socket(host, port), heartbeat))
+
+
+class Worker:
+    def __init__(self, process, heartbeat):
+        self.process = process
+        self.heartbeat = heartbeat
+        self.started = time.time()
+
+    @property
+    def ready(self):
+        return self.heartbeat.value > 0
+
+    def is_stalled(self, timeout, now):
+        return now - max(self.heartbeat.value, self.started) > timeout
+
+
+class Supervisor:
+    """
+    Runs `workers` worker processes serving on `host`:`port`. Worker which doesn't beat for `worker_timeout`
+    seconds (including its startup) is killed and replaced, a stopped one is given `graceful_timeout` seconds
+    to finish its requests. Credentials of `providers` are refreshed by the supervisor and brokered to the workers.
+    """
+
+    def __init__(self, host, port, workers, worker_timeout=30.0, graceful_timeout=30, providers=None):
+        self.host = host
+        self.port = port
+        self.count = workers
+        self.worker_timeout = worker_timeout
+        self.graceful_timeout = graceful_timeout
+        self.providers = providers or {}
+        self.workers = []
+        self.restarts = 0
+        self._context = multiprocessing.get_context("spawn")
+        self._stopping = asyncio.Event()
+        self._restart_requested = False
+        self._draining = set()
+
+    def spawn(self):
+        heartbeat = self._context.Value("d", 0.0, lock=False)
+        process = self._context.Process(
+            target=run_worker, args=(self.host, self.port, heartbeat, self.graceful_timeout), daemon=False
+        )
+        process.start()
+        logger.info("Started worker %d", process.pid)
+        return Worker(process, heartbeat)
+
+    async def drain(self, worker):
+        """
+        Stops the worker gracefully, kills it when it doesn't exit in time.
+        """
+        process = worker.process
+        if process.is_alive():
+            os.kill(process.pid, signal.SIGTERM)
+        deadline = time.time() + self.graceful_timeout + self.worker_timeout
+        while process.is_alive() and time.time() < deadline:
+            await asyncio.sleep(0.1)
+        if process.is_alive():
+            logger.warning("Worker %d didn't stop in time, killed", process.pid)
+            process.kill()
+        process.join()
+
+    def start_draining(self, worker):
+        task = asyncio.ensure_future(self.drain(worker))
+        self._draining.add(task)
+        task.add_done_callback(self._draining.discard)
+
+    def check(self):
+        now = time.time()
+        for index, worker in enumerate(self.workers):
+            if not worker.process.is_alive():
+                logger.warning("Worker %d exited with %s, restarting", worker.process.pid, worker.process.exitcode)
+            elif worker.is_stalled(self.worker_timeout, now):
+                logger.warning("Worker %d stalled for %ss, restarting", worker.process.pid, self.worker_timeout)
+                worker.process.kill()
+            else:
+                continue
+            worker.process.join()
+            self.workers[index] = self.spawn()
+            self.restarts += 1
+
+    async def restart(self):
+        """
+        Replaces workers one by one, each one is drained once its replacement serves. The restart is aborted when a
+        replacement doesn't get ready, the remaining workers are kept.
+        """
+        logger.info("Restarting workers")
+        for index, worker in enumerate(list(self.workers)):
+            replacement = self.spawn()
+            while not replacement.ready and replacement.process.is_alive():
+                if replacement.is_stalled(self.worker_timeout, time.time()) or self._stopping.is_set():
+                    break
+                await asyncio.sleep(0.1)
+            if not replacement.ready:
+                logger.error("Worker %d didn't get ready, restart aborted", replacement.process.pid)
+                replacement.process.kill()
+                replacement.process.join()
+                return
+            self.workers[index] = replacement
+            self.start_draining(worker)
+
+    async def supervise(self):
+        self.workers = [self.spawn() for _ in range(self.count)]
+        restarting = None
+        while not self._stopping.is_set():
+            if self._restart_requested and (restarting is None or restarting.done()):
+                self._restart_requested = False
+                restarting = asyncio.ensure_future(self.restart())
+            if restarting is None or restarting.done():
+                # workers are not checked while they're being replaced
+                self.check()
+            try:
+                await asyncio.wait_for(self._stopping.wait(), CHECK_INTERVAL)
+            except TimeoutError:
+                pass
+        if restarting is not None:
+            await restarting
+        for worker in self.workers:
+            self.start_draining(worker)
+        await asyncio.gather(*self._draining)
+
+    def request_restart(self):
+        self._restart_requested = True
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGTERM, self._stopping.set)
+        loop.add_signal_handler(signal.SIGINT, self._stopping.set)
+        loop.add_signal_handler(signal.SIGHUP, self.request_restart)
+        broker = None
+        directory = None
+        if self.providers:
+            # only the user running the proxy can connect to the broker
+            directory = tempfile.mkdtemp(prefix="s3proxy-")
+            broker = CredentialBroker(self.providers, os.path.join(directory, "credentials.sock"))
+            await broker.start()
+            # workers read their settings from the environment
+            os.environ["CREDENTIAL_BROKER_SOCKET"] = broker.path
+        try:
+            await self.supervise()
+        finally:
+            if broker is not None:
+                await broker.close()
+                shutil.rmtree(directory, ignore_errors=True)
+        logger.info("Stopped")
@@ -4,6 +4,7 @@ import tempfile
 from os import environ, urandom
 from unittest import TestCase
 
+import httpx
 from boto3.s3.transfer import TransferConfig
 
 from .s3client import get_boto_client
@@ -67,7 +68,8 @@ class TestBasicAPICalls(TestCase):
             fp.write(data)
             fp.seek(0)
             self.s3.upload_fileobj(fp, self.bucket_name, md5)
-        self.s3.generate_presigned_url(ClientMethod="get_object", Params={"Bucket": self.bucket_name, "Key": md5})
-        # presigning url will work but please note that the url will contain host from endpoint_url which will not
-        # work since host points proxy and then proxy will forward request to s3 server which will reject the request
-        # with 403 forbidden error
+        url = self.s3.generate_presigned_url(ClientMethod="get_object", Params={"Bucket": self.bucket_name, "Key": md5})
+        # url contains host of the proxy, the proxy presigns it once again for the s3 server
+        response = httpx.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, data)
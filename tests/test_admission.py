@@ -0,0 +1,107 @@
+import asyncio
+import time
+from unittest import IsolatedAsyncioTestCase, mock
+
+from starlette.responses import Response
+
+from s3proxy import main
+from s3proxy.admission import (
+    AdmissionController,
+    ConcurrencyLimit,
+    Rejected,
+    TokenBucket,
+)
+
+from .test_proxy import ProxyTestCase, get_client_headers
+
+
+class FakeHandler:
+    def __init__(self):
+        self.release = asyncio.Event()
+
+    async def handle(self, request):
+        await self.release.wait()
+        return Response(b"body")
+
+
+def create_request(access_key_id="clientKey", path="/bucket/key"):
+    headers = get_client_headers("GET", path)
+    headers["authorization"] = headers["authorization"].replace("clientKey", access_key_id)
+    return mock.Mock(headers=headers, url=mock.Mock(path=path), scope={"type": "http"}, receive=None)
+
+
+async def discard(message):
+    pass
+
+
+class TestConcurrencyLimit(IsolatedAsyncioTestCase):
+    async def test_full_queue_rejects(self):
+        limit = ConcurrencyLimit(1, max_queue=1, timeout=10)
+        await limit.acquire()
+        waiter = asyncio.ensure_future(limit.acquire())
+        await asyncio.sleep(0)
+        with self.assertRaises(Rejected):
+            await limit.acquire()
+        limit.release()
+        await waiter
+        self.assertEqual((limit.active, limit.queued), (1, 0))
+
+    async def test_queue_timeout_rejects(self):
+        limit = ConcurrencyLimit(1, max_queue=1, timeout=0.01)
+        await limit.acquire()
+        with self.assertRaises(Rejected):
+            await limit.acquire()
+        self.assertEqual((limit.active, limit.queued), (1, 0))
+
+
+class TestTokenBucket(IsolatedAsyncioTestCase):
+    async def test_rate_is_limited(self):
+        bucket = TokenBucket(rate=10000, burst=1000)
+        started = time.monotonic()
+        await bucket.consume(1000)
+        await bucket.consume(1000)
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+
+
+class TestAdmissionController(IsolatedAsyncioTestCase):
+    async def test_tenant_over_limit_gets_slow_down(self):
+        controller = AdmissionController(10, 1, max_queue=0, retry_after=2)
+        handler = FakeHandler()
+        first = asyncio.ensure_future(controller.handle(create_request(), handler.handle))
+        await asyncio.sleep(0)
+        rejected = await controller.handle(create_request(), handler.handle)
+        self.assertEqual(rejected.status_code, 503)
+        self.assertIn((b"retry-after", b"2"), rejected.headers)
+        # other tenants are not affected
+        other = asyncio.ensure_future(controller.handle(create_request("otherKey"), handler.handle))
+        await asyncio.sleep(0)
+        self.assertEqual(controller.stats()["active"], 2)
+        handler.release.set()
+        for response in (await first, await other):
+            self.assertEqual(response.status_code, 200)
+            await response({"type": "http", "path": "/bucket/key"}, None, discard)
+        self.assertEqual(controller.stats()["active"], 0)
+        self.assertEqual(controller.tenants, {})
+
+    async def test_stalled_client_is_aborted(self):
+        controller = AdmissionController(10, 1, send_timeout=0.01)
+        handler = FakeHandler()
+        handler.release.set()
+        response = await controller.handle(create_request(), handler.handle)
+
+        async def stalled_send(message):
+            await asyncio.Event().wait()
+
+        await response({"type": "http", "path": "/bucket/key"}, None, stalled_send)
+        self.assertEqual(controller.stats()["active"], 0)
+
+
+class TestAdmissionProxy(ProxyTestCase):
+    async def test_rejection_is_s3_error(self):
+        controller = AdmissionController(0, 0, max_queue=0)
+        with mock.patch.object(main, "admission", controller):
+            response = await self.client.get("/bucket/key", headers=get_client_headers("GET", "/bucket/key"))
+        self.assertEqual(response.status_code, 503)
+        self.assertIn(b"<Code>SlowDown</Code>", response.content)
+        self.assertEqual(response.headers["retry-after"], "1")
+        self.assertEqual(self.received, [])
@@ -0,0 +1,126 @@
+from datetime import datetime, timedelta, timezone
+from hashlib import sha256
+from unittest import TestCase, mock
+
+import boto3
+from botocore.config import Config
+
+from s3proxy import main
+from s3proxy.auth import KeyStore, SignatureVerifier
+from s3proxy.awssigv4 import STREAMING_PAYLOAD, SigV4Signer, get_v4_signature
+
+from .test_chunked import encode_chunks, get_chunk_signer
+from .test_proxy import ProxyTestCase, get_client_headers
+
+
+def get_signed_headers(method, path, body=b"", secret="clientSecret", amz_date=None):
+    headers = {"host": "proxy.test", "x-amz-content-sha256": sha256(body).hexdigest()}
+    if amz_date is not None:
+        headers["x-amz-date"] = amz_date
+    headers["authorization"] = get_v4_signature(
+        "clientKey", secret, "proxy.test", "us-east-1", "s3", method, path, headers, body=body
+    )
+    return headers
+
+
+class TestKeyStore(TestCase):
+    def test_signing_keys_are_cached(self):
+        key_store = KeyStore({"clientKey": "clientSecret"})
+        signing_key = key_store.get_signing_key("clientKey", "20230604/us-east-1/s3/aws4_request")
+        self.assertIs(key_store.get_signing_key("clientKey", "20230604/us-east-1/s3/aws4_request"), signing_key)
+        self.assertEqual(
+            signing_key, SigV4Signer("us-east-1", "s3").get_signing_key("clientKey", "clientSecret", "20230604")
+        )
+        key_store.get_signing_key("clientKey", "20230605/us-east-1/s3/aws4_request")
+        self.assertEqual(len(key_store), 2)
+
+
+class TestSignatureVerification(ProxyTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.verifier = SignatureVerifier(KeyStore({"clientKey": "clientSecret"}))
+        patch = mock.patch.object(main, "verifier", self.verifier)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    async def test_valid_signature(self):
+        response = await self.client.get("/bucket/key", headers=get_client_headers("GET", "/bucket/key"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.verifier.stats()["verified"], 1)
+
+    async def test_invalid_signatures_are_rejected(self):
+        old_date = (datetime.now(timezone.utc) - timedelta(hours=1)).strftime("%Y%m%dT%H%M%SZ")
+        for headers, code in [
+            (get_signed_headers("GET", "/bucket/key", secret="wrong"), "SignatureDoesNotMatch"),
+            (get_signed_headers("GET", "/bucket/other"), "SignatureDoesNotMatch"),
+            (get_signed_headers("GET", "/bucket/key", amz_date=old_date), "RequestTimeTooSkewed"),
+            (
+                {
+                    **get_client_headers("GET", "/bucket/key"),
+                    "authorization": get_client_headers("GET", "/bucket/key")["authorization"].replace("client", "x"),
+                },
+                "InvalidAccessKeyId",
+            ),
+            ({}, "AccessDenied"),
+        ]:
+            response = await self.client.get("/bucket/key", headers=headers)
+            self.assertEqual(response.status_code, 403)
+            self.assertIn(f"<Code>{code}</Code>".encode(), response.content)
+        self.assertEqual(self.received, [])
+
+    async def test_body_hash_is_checked_while_streaming(self):
+        headers = get_signed_headers("PUT", "/bucket/key", body=b"new body")
+        response = await self.client.put("/bucket/key", content=b"new body", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        response = await self.client.put("/bucket/key", content=b"bad body", headers=headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(b"<Code>XAmzContentSHA256Mismatch</Code>", response.content)
+        self.assertEqual(self.upstream.objects["/bucket/key"], b"new body")
+
+    async def test_chunk_signatures_are_verified(self):
+        chunks = [b"x" * 8192, b"y" * 100]
+        headers = {
+            "host": "proxy.test",
+            "x-amz-content-sha256": STREAMING_PAYLOAD,
+            "x-amz-decoded-content-length": str(8292),
+            "content-encoding": "aws-chunked",
+        }
+        headers["authorization"] = get_v4_signature(
+            "clientKey",
+            "clientSecret",
+            "proxy.test",
+            "us-east-1",
+            "s3",
+            "PUT",
+            "/bucket/chunked",
+            headers,
+            body_hash=STREAMING_PAYLOAD,
+        )
+        seed_signature = headers["authorization"].rpartition("Signature=")[2]
+        signer = get_chunk_signer("clientKey", "clientSecret", headers["x-amz-date"], seed_signature)
+        signatures = [signer.sign_chunk(sha256(chunk).hexdigest()) for chunk in chunks + [b""]]
+        response = await self.client.put("/bucket/chunked", content=encode_chunks(chunks, signatures), headers=headers)
+        self.assertEqual(response.status_code, 200)
+        stored = self.upstream.objects["/bucket/chunked"]
+        response = await self.client.put(
+            "/bucket/chunked", content=encode_chunks([b"z" * 8192, b"y" * 100], signatures), headers=headers
+        )
+        self.assertEqual(response.status_code, 403)
+        self.assertIn(b"<Code>SignatureDoesNotMatch</Code>", response.content)
+        self.assertEqual(self.upstream.objects["/bucket/chunked"], stored)
+
+    async def test_presigned_url(self):
+        s3 = boto3.client(
+            "s3",
+            endpoint_url="http://proxy.test",
+            aws_access_key_id="clientKey",
+            aws_secret_access_key="clientSecret",
+            region_name="us-east-1",
+            config=Config(signature_version="s3v4", s3={"addressing_style": "path"}),
+        )
+        url = s3.generate_presigned_url("get_object", Params={"Bucket": "bucket", "Key": "key"}, ExpiresIn=60)
+        response = await self.client.get(url)
+        self.assertNotIn(b"<Error>", response.content)
+        self.assertEqual(len(self.received), 1)
+        response = await self.client.get(url.replace("/key?", "/other?"))
+        self.assertEqual(response.status_code, 403)
@@ -0,0 +1,118 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+from unittest import IsolatedAsyncioTestCase
+
+import httpx
+
+from s3proxy.aws import AwsAccessProvider, Credentials
+from s3proxy.http_client import AsyncHttpClient
+
+ROLE_ARN = "arn:aws:iam::123456789012:role/s3proxy"
+
+
+def format_expiration(expires_in):
+    expiration = datetime.fromtimestamp(time.time() + expires_in, tz=timezone.utc)
+    return expiration.isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def get_assume_role_response(access_key, expires_in):
+    return f"""<AssumeRoleResponse xmlns="https://sts.amazonaws.com/doc/2011-06-15/">
+  <AssumeRoleResult>
+    <Credentials>
+      <AccessKeyId>{access_key}</AccessKeyId>
+      <SecretAccessKey>secret-{access_key}</SecretAccessKey>
+      <SessionToken>token-{access_key}</SessionToken>
+      <Expiration>{format_expiration(expires_in)}</Expiration>
+    </Credentials>
+  </AssumeRoleResult>
+</AssumeRoleResponse>"""
+
+
+class FakeMetadataAndSts:
+    def __init__(self, expires_in=3600):
+        self.expires_in = expires_in
+        self.sts_requests = []
+        self.sts_failure = False
+        self.metadata_failure = False
+
+    async def __call__(self, request):
+        if request.url.host == "sts.amazonaws.com":
+            self.sts_requests.append(request)
+            # give concurrent waiters a chance to pile up
+            await asyncio.sleep(0.01)
+            if self.sts_failure:
+                return httpx.Response(503)
+            return httpx.Response(200, text=get_assume_role_response(f"ASIA{len(self.sts_requests)}", self.expires_in))
+        if self.metadata_failure:
+            return httpx.Response(500)
+        return httpx.Response(
+            200,
+            json={
+                "AccessKeyId": "instanceKey",
+                "SecretAccessKey": "instanceSecret",
+                "Token": "instanceToken",
+                "Expiration": format_expiration(3600),
+            },
+        )
+
+
+class TestAwsAccessProvider(IsolatedAsyncioTestCase):
+    def get_provider(self, backend, **kwargs):
+        http_client = AsyncHttpClient(transport=httpx.MockTransport(backend))
+        provider = AwsAccessProvider(role_arn=ROLE_ARN, http_client=http_client, **kwargs)
+        self.addAsyncCleanup(provider.close)
+        return provider
+
+    async def test_static_credentials(self):
+        provider = AwsAccessProvider("key", "secret")
+        self.addAsyncCleanup(provider.close)
+        self.assertEqual(await provider.get_access_secret_key(), ("key", "secret"))
+
+    async def test_assume_role_is_signed_with_instance_credentials(self):
+        backend = FakeMetadataAndSts()
+        provider = self.get_provider(backend)
+        credentials = await provider.get_access_credentials()
+        self.assertEqual(credentials.access_key, "ASIA1")
+        self.assertEqual(credentials.session_token, "token-ASIA1")
+        self.assertAlmostEqual(credentials.expires_in(), 3600, delta=5)
+        request = backend.sts_requests[0]
+        self.assertIn("Credential=instanceKey/", request.headers["authorization"])
+        self.assertIn("/us-east-1/sts/aws4_request", request.headers["authorization"])
+        self.assertEqual(request.headers["x-amz-security-token"], "instanceToken")
+        self.assertIn(b"RoleArn=arn%3Aaws%3Aiam%3A%3A123456789012%3Arole%2Fs3proxy", request.content)
+
+    async def test_concurrent_requests_share_single_refresh(self):
+        backend = FakeMetadataAndSts()
+        provider = self.get_provider(backend)
+        results = await asyncio.gather(*[provider.get_access_credentials() for _ in range(20)])
+        self.assertEqual(len(backend.sts_requests), 1)
+        self.assertEqual({credentials.access_key for credentials in results}, {"ASIA1"})
+
+    async def test_credentials_are_renewed_before_expiry(self):
+        backend = FakeMetadataAndSts(expires_in=0.4)
+        provider = self.get_provider(backend, refresh_margin=300)
+        self.assertEqual((await provider.get_access_credentials()).access_key, "ASIA1")
+        await asyncio.sleep(0.3)
+        self.assertEqual(len(backend.sts_requests), 2)
+        self.assertEqual((await provider.get_access_credentials()).access_key, "ASIA2")
+
+    async def test_last_good_credentials_served_after_failed_refresh(self):
+        backend = FakeMetadataAndSts()
+        provider = self.get_provider(backend)
+        await provider.get_access_credentials()
+        backend.sts_failure = backend.metadata_failure = True
+        # the last good credentials are about to expire but still valid
+        provider._credentials = Credentials("ASIA1", "secret", "token", time.time() + 10)
+        credentials = await provider.refresh_access_key()
+        self.assertEqual(credentials.access_key, "ASIA1")
+        # once they expire failed refresh is raised to the waiters
+        provider._credentials = Credentials("ASIA1", "secret", "token", time.time() - 1)
+        with self.assertRaises(httpx.HTTPStatusError):
+            await provider.get_access_credentials()
+
+    async def test_falls_back_to_instance_credentials_when_assume_role_fails(self):
+        backend = FakeMetadataAndSts()
+        backend.sts_failure = True
+        provider = self.get_provider(backend)
+        self.assertEqual((await provider.get_access_credentials()).access_key, "instanceKey")
@@ -0,0 +1,129 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase, mock
+
+import httpx
+from starlette.datastructures import URL, Headers, QueryParams, State
+
+from s3proxy import main
+from s3proxy.coalescing import RequestCoalescer
+
+from .test_proxy import ProxyTestCase, get_client_headers
+
+BODY = b"".join(bytes([i]) * 10 for i in range(10))
+
+
+class FakeRequest:
+    def __init__(self, method="GET", path="/bucket/key", headers=None):
+        self.method = method
+        self.url = URL(path)
+        self.headers = Headers(headers or {})
+        self.query_params = QueryParams("")
+        self.state = State()
+
+
+class FakeUpstream:
+    def __init__(self):
+        self.requests = []
+        self.release = asyncio.Event()
+
+    async def fetch(self, extra_headers=None):
+        self.requests.append(extra_headers or {})
+        await self.release.wait()
+        byte_range = (extra_headers or {}).get("range")
+        if byte_range is None:
+            return httpx.Response(200, content=self.stream(BODY))
+        start = int(byte_range.removeprefix("bytes=").rstrip("-"))
+        headers = {"content-range": f"bytes {start}-{len(BODY) - 1}/{len(BODY)}"}
+        return httpx.Response(206, headers=headers, content=self.stream(BODY[start:]))
+
+    async def stream(self, body):
+        for i in range(0, len(body), 10):
+            yield body[slice(i, i + 10)]
+
+
+async def read_all(response):
+    body = b""
+    async for chunk in response.aiter_raw():
+        body += chunk
+    await response.aclose()
+    return body
+
+
+class TestRequestCoalescer(IsolatedAsyncioTestCase):
+    async def test_identical_requests_share_upstream_request(self):
+        coalescer = RequestCoalescer(window=1024)
+        upstream = FakeUpstream()
+        fetches = [coalescer.wrap(FakeRequest(), upstream.fetch)() for _ in range(5)]
+        tasks = [asyncio.create_task(fetch) for fetch in fetches]
+        await asyncio.sleep(0)
+        upstream.release.set()
+        responses = await asyncio.gather(*tasks)
+        bodies = await asyncio.gather(*[read_all(response) for response in responses])
+        self.assertEqual(bodies, [BODY] * 5)
+        self.assertEqual(len(upstream.requests), 1)
+        self.assertEqual(coalescer.stats(), {"flights": 1, "coalesced": 4, "in_flight": 0})
+
+    async def test_different_ranges_are_not_coalesced(self):
+        coalescer = RequestCoalescer(window=1024)
+        upstream = FakeUpstream()
+        upstream.release.set()
+        first = await coalescer.wrap(FakeRequest(headers={"range": "bytes=0-9"}), upstream.fetch)()
+        second = await coalescer.wrap(FakeRequest(headers={"range": "bytes=10-19"}), upstream.fetch)()
+        await asyncio.gather(read_all(first), read_all(second))
+        self.assertEqual(len(upstream.requests), 2)
+
+    async def test_unsigned_request_is_not_coalesced_with_signed(self):
+        coalescer = RequestCoalescer(window=1024)
+        upstream = FakeUpstream()
+        signed = asyncio.create_task(
+            coalescer.wrap(FakeRequest(headers={"authorization": "AWS4..."}), upstream.fetch)()
+        )
+        unsigned = asyncio.create_task(coalescer.wrap(FakeRequest(), upstream.fetch)())
+        await asyncio.sleep(0)
+        upstream.release.set()
+        await asyncio.gather(*[read_all(response) for response in await asyncio.gather(signed, unsigned)])
+        self.assertEqual(len(upstream.requests), 2)
+
+    async def test_request_after_all_readers_left_starts_new_flight(self):
+        coalescer = RequestCoalescer(window=1024)
+        upstream = FakeUpstream()
+        first = asyncio.create_task(coalescer.wrap(FakeRequest(), upstream.fetch)())
+        await asyncio.sleep(0)
+        first.cancel()
+        # joins before the cancelled upstream request finishes
+        second = asyncio.create_task(coalescer.wrap(FakeRequest(), upstream.fetch)())
+        with self.assertRaises(asyncio.CancelledError):
+            await first
+        upstream.release.set()
+        self.assertEqual(await read_all(await second), BODY)
+        self.assertEqual(coalescer.stats()["flights"], 2)
+
+    async def test_slow_reader_is_detached_and_resumes_on_its_own(self):
+        coalescer = RequestCoalescer(window=30)
+        upstream = FakeUpstream()
+        upstream.release.set()
+        fast, slow = [coalescer.wrap(FakeRequest(), upstream.fetch)() for _ in range(2)]
+        fast = asyncio.create_task(fast)
+        slow = asyncio.create_task(slow)
+        fast, slow = await asyncio.gather(fast, slow)
+        slow_body = b""
+        slow_iterator = slow.aiter_raw()
+        slow_body += await slow_iterator.__anext__()
+        # fast reader is not stalled by the slow one which holds only the first chunk
+        self.assertEqual(await asyncio.wait_for(read_all(fast), 1), BODY)
+        async for chunk in slow_iterator:
+            slow_body += chunk
+        await slow.aclose()
+        self.assertEqual(slow_body, BODY)
+        self.assertEqual(upstream.requests[1], {"range": "bytes=10-"})
+
+
+class TestProxyCoalescing(ProxyTestCase):
+    async def test_concurrent_gets_through_proxy(self):
+        patch = mock.patch.object(main, "request_coalescer", RequestCoalescer())
+        patch.start()
+        self.addCleanup(patch.stop)
+        headers = get_client_headers("GET", "/bucket/key")
+        responses = await asyncio.gather(*[self.client.get("/bucket/key", headers=headers) for _ in range(5)])
+        self.assertEqual({response.content for response in responses}, {b"upstream body"})
+        self.assertLess(len(self.received), 5)
@@ -0,0 +1,144 @@
+import hashlib
+from unittest import mock
+
+import zstandard
+from starlette.routing import Route
+
+from s3proxy import main
+from s3proxy.compression import ObjectCompressor, find_frames, parse_seek_table
+from s3proxy.ranged import ParallelRangeFetcher
+
+from .test_coalescing import FakeRequest
+from .test_proxy import ProxyTestCase, get_client_headers
+
+BODY = b"".join(b"line %d of compressible body\n" % i for i in range(400))
+
+
+class TestObjectCompressor(ProxyTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.compressor = ObjectCompressor(["bucket/logs/"], frame_size=1000)
+        patch = mock.patch.object(main, "compressor", self.compressor)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    async def put(self, path="/bucket/logs/app.log", headers=None):
+        headers = {
+            **get_client_headers("PUT", path),
+            "x-amz-content-sha256": hashlib.sha256(BODY).hexdigest(),
+            **(headers or {}),
+        }
+        return await self.client.put(path, headers=headers, content=BODY)
+
+    async def get(self, path="/bucket/logs/app.log", headers=None):
+        return await self.client.get(path, headers={**get_client_headers("GET", path), **(headers or {})})
+
+    def test_only_signed_put_under_prefix_is_accepted(self):
+        headers = {"authorization": "AWS4-HMAC-SHA256 ...", "content-length": "100"}
+        self.assertTrue(self.compressor.accepts(FakeRequest("PUT", "/bucket/logs/a", headers=headers)))
+        self.assertFalse(self.compressor.accepts(FakeRequest("PUT", "/bucket/other", headers=headers)))
+        self.assertFalse(self.compressor.accepts(FakeRequest("PUT", "/other/logs/a", headers=headers)))
+        self.assertFalse(
+            self.compressor.accepts(
+                FakeRequest("PUT", "/bucket/logs/a", headers={**headers, "content-encoding": "gzip"})
+            )
+        )
+
+    async def test_put_is_stored_compressed(self):
+        response = await self.put(headers={"content-type": "text/plain", "x-amz-meta-origin": "test"})
+        self.assertEqual(response.status_code, 200)
+        stored = self.upstream.objects["/bucket/logs/app.log"]
+        self.assertLess(len(stored), len(BODY))
+        self.assertEqual(len(parse_seek_table(stored)), len(BODY) // 1000 + 1)
+        _, _, headers, _ = self.received[-1]
+        self.assertEqual(headers["x-amz-meta-s3proxy-size"], str(len(BODY)))
+        self.assertEqual(headers["x-amz-meta-origin"], "test")
+        self.assertEqual(headers["x-amz-content-sha256"], hashlib.sha256(stored).hexdigest())
+        self.assertIn("Credential=proxyKey/", headers["authorization"])
+
+    async def test_put_with_wrong_digest_is_rejected(self):
+        response = await self.put(headers={"x-amz-content-sha256": "0" * 64})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(b"XAmzContentSHA256Mismatch", response.content)
+        self.assertNotIn("/bucket/logs/app.log", self.upstream.objects)
+
+    async def test_get_is_decompressed(self):
+        await self.put()
+        response = await self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, BODY)
+        self.assertEqual(response.headers["content-length"], str(len(BODY)))
+        self.assertNotIn("x-amz-meta-s3proxy-encoding", response.headers)
+
+    async def test_get_is_passed_compressed_to_client_accepting_zstd(self):
+        await self.put()
+        response = await self.get(headers={"accept-encoding": "gzip, zstd"})
+        self.assertEqual(response.headers["content-encoding"], "zstd")
+        self.assertEqual(response.headers["vary"], "accept-encoding")
+        decompressor = zstandard.ZstdDecompressor().decompressobj(read_across_frames=True)
+        self.assertEqual(decompressor.decompress(response.content), BODY)
+
+    async def test_range_get_fetches_covering_frames(self):
+        await self.put()
+        stored = self.upstream.objects["/bucket/logs/app.log"]
+        start, end = 2500, 4200
+        compressed_start, compressed_end, _ = find_frames(parse_seek_table(stored), start, end)
+        for tail_size in (len(stored), 20):
+            with self.subTest(tail_size=tail_size), mock.patch("s3proxy.compression.TAIL_SIZE", tail_size):
+                self.received.clear()
+                response = await self.get(headers={"range": f"bytes={start}-{end}"})
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(response.content, BODY[slice(start, end + 1)])
+                self.assertEqual(response.headers["content-range"], f"bytes {start}-{end}/{len(BODY)}")
+                ranges = [headers["range"] for _, _, headers, _ in self.received]
+                self.assertEqual(ranges[0], f"bytes=-{tail_size}")
+                if tail_size == 20:
+                    self.assertEqual(ranges[-1], f"bytes={compressed_start}-{compressed_end}")
+                else:
+                    # small object is read whole with the seek table
+                    self.assertEqual(len(ranges), 1)
+
+    async def test_unsatisfiable_range_is_rejected(self):
+        await self.put()
+        response = await self.get(headers={"range": f"bytes={len(BODY)}-"})
+        self.assertEqual(response.status_code, 416)
+        self.assertIn(b"InvalidRange", response.content)
+
+    async def test_object_replaced_while_range_is_read_is_slow_down(self):
+        await self.put()
+        handle = self.upstream.handle
+
+        async def replacing(request):
+            if request.headers.get("range", "").startswith("bytes=-"):
+                response = await handle(request)
+                self.upstream.put_object(request.url.path, b"replaced", self.upstream.metadata[request.url.path])
+                return response
+            return await handle(request)
+
+        self.upstream.app.router.routes[0] = Route("/{path:path}", replacing, methods=["GET"])
+        with mock.patch("s3proxy.compression.TAIL_SIZE", 20):
+            response = await self.get(headers={"range": "bytes=2500-4200"})
+        self.assertEqual(response.status_code, 503)
+        self.assertIn(b"SlowDown", response.content)
+
+    async def test_compressed_object_without_size_is_passed_as_it_is(self):
+        await self.put()
+        del self.upstream.metadata["/bucket/logs/app.log"]["x-amz-meta-s3proxy-size"]
+        response = await self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, self.upstream.objects["/bucket/logs/app.log"])
+
+    async def test_uncompressed_object_is_passed(self):
+        self.upstream.objects["/bucket/logs/old.log"] = BODY
+        response = await self.get("/bucket/logs/old.log", headers={"range": "bytes=10-19"})
+        self.assertEqual((response.status_code, response.content), (206, BODY[10:20]))
+        response = await self.get("/bucket/logs/old.log")
+        self.assertEqual(response.content, BODY)
+
+    async def test_stored_bytes_are_fetched_in_parallel_ranges(self):
+        await self.put()
+        with mock.patch.object(main, "range_fetcher", ParallelRangeFetcher(1000, part_size=1000, concurrency=2)):
+            response = await self.get()
+            self.assertEqual(response.content, BODY)
+            response = await self.get(headers={"range": "bytes=100-10099"})
+            self.assertEqual(response.content, BODY[100:10100])
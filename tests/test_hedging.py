@@ -0,0 +1,139 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase, mock
+
+import httpx
+from starlette.routing import Route
+
+from s3proxy import main
+from s3proxy.hedging import Hedger, LatencyWindow
+
+from .test_coalescing import FakeRequest
+from .test_proxy import ProxyTestCase, get_client_headers
+
+
+class FakeSends:
+    def __init__(self, delays):
+        self.delays = list(delays)
+        self.started = 0
+        self.cancelled = 0
+        self.responses = []
+
+    async def send(self):
+        attempt = self.started
+        self.started += 1
+        try:
+            await asyncio.sleep(self.delays[attempt])
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        response = httpx.Response(200, headers={"attempt": str(attempt)})
+        self.responses.append(response)
+        return response
+
+
+def create_hedger(delay=0.01, tokens=1.0, backend=None):
+    hedger = Hedger(budget=0.0)
+    for method in ("GET", "HEAD"):
+        hedger.get_window(backend, method).delay = delay
+    hedger.tokens = tokens
+    return hedger
+
+
+class TestHedger(IsolatedAsyncioTestCase):
+    async def test_slow_request_is_hedged_and_loser_cancelled(self):
+        hedger = create_hedger()
+        sends = FakeSends([1.0, 0])
+        response = await hedger.send(FakeRequest(), sends.send)
+        self.assertEqual(response.headers["attempt"], "1")
+        self.assertEqual(sends.cancelled, 1)
+        self.assertEqual(hedger.stats()["wins"], 1)
+        self.assertEqual(hedger.stats()["win_rate"], 1.0)
+
+    async def test_primary_winning_the_race_closes_hedge_response(self):
+        hedger = create_hedger()
+        sends = FakeSends([0.02, 0.02])
+        response = await hedger.send(FakeRequest(), sends.send)
+        self.assertEqual(response.headers["attempt"], "0")
+        self.assertEqual(hedger.stats()["hedged"], 1)
+        self.assertEqual(hedger.stats()["wins"], 0)
+        self.assertTrue(sends.cancelled or sends.responses[1].is_closed)
+
+    async def test_fast_request_is_not_hedged(self):
+        hedger = create_hedger(delay=0.05)
+        sends = FakeSends([0])
+        await hedger.send(FakeRequest(), sends.send)
+        self.assertEqual(sends.started, 1)
+
+    async def test_budget_caps_hedges(self):
+        hedger = create_hedger(tokens=0.0)
+        sends = FakeSends([0.02])
+        await hedger.send(FakeRequest("HEAD"), sends.send)
+        self.assertEqual(sends.started, 1)
+        self.assertEqual(hedger.stats()["hedge_rate"], 0.0)
+
+    async def test_writes_and_requests_with_body_are_not_hedged(self):
+        hedger = create_hedger()
+        for request in (FakeRequest("PUT"), FakeRequest("GET", headers={"content-length": "1"})):
+            sends = FakeSends([0.02])
+            await hedger.send(request, sends.send)
+            self.assertEqual(sends.started, 1)
+        self.assertEqual(hedger.requests, 0)
+
+    async def test_failed_request_is_covered_by_hedge(self):
+        hedger = create_hedger()
+
+        async def send():
+            if not hedger.hedged:
+                await asyncio.sleep(0.02)
+                raise httpx.ConnectError("unreachable")
+            return httpx.Response(200)
+
+        response = await hedger.send(FakeRequest(), send)
+        self.assertEqual(response.status_code, 200)
+
+    async def test_primary_losing_the_race_is_recorded_with_its_latency(self):
+        hedger = create_hedger(delay=0.01)
+        window = hedger.get_window(None, "GET")
+        sends = FakeSends([0.2, 0.05])
+        await hedger.send(FakeRequest(), sends.send)
+        primary, hedge = window._samples
+        self.assertGreaterEqual(primary, 0.05)
+        self.assertLess(hedge, primary)
+
+    async def test_samples_are_kept_per_backend_and_method(self):
+        hedger = Hedger(budget=0.0)
+        await hedger.send(FakeRequest("GET"), FakeSends([0]).send, "first")
+        await hedger.send(FakeRequest("HEAD"), FakeSends([0]).send, "first")
+        await hedger.send(FakeRequest("GET"), FakeSends([0]).send, "second")
+        for key in (("first", "GET"), ("first", "HEAD"), ("second", "GET")):
+            self.assertEqual(len(hedger.get_window(*key)._samples), 1)
+
+    def test_delay_follows_percentile_of_recent_samples(self):
+        window = LatencyWindow(percentile=0.9, min_delay=0.001, size=1000, min_samples=100)
+        for i in range(100):
+            window.record(i / 1000)
+        self.assertAlmostEqual(window.delay, 0.09)
+        window = LatencyWindow(percentile=0.95, min_delay=0.5, size=1000, min_samples=100)
+        for i in range(100):
+            window.record(i / 1000)
+        self.assertEqual(window.delay, 0.5)
+
+
+class TestHedgedProxy(ProxyTestCase):
+    async def test_slow_upstream_request_is_duplicated(self):
+        handle = self.upstream.handle
+
+        async def slow_first(request):
+            if len(self.received) == 0:
+                self.received.append(None)
+                await asyncio.sleep(1.0)
+            return await handle(request)
+
+        self.upstream.app.router.routes[0] = Route("/{path:path}", slow_first, methods=["GET"])
+        with mock.patch.object(main, "hedger", create_hedger(backend="default")):
+            response = await self.client.get("/bucket/key", headers=get_client_headers("GET", "/bucket/key"))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, b"upstream body")
+            self.assertEqual(main.hedger.stats()["wins"], 1)
+        _, _, headers, _ = self.received[1]
+        self.assertIn("Credential=proxyKey/", headers["authorization"])
@@ -0,0 +1,60 @@
+import io
+import json
+import logging
+import threading
+from unittest import TestCase, mock
+
+from s3proxy.config import settings
+from s3proxy.logqueue import LogWriter, QueueStreamHandler
+
+from .test_proxy import ProxyTestCase, get_client_headers
+
+
+class BlockingStream(io.StringIO):
+    def __init__(self):
+        super().__init__()
+        self.released = threading.Event()
+
+    def write(self, data):
+        self.released.wait(5)
+        return super().write(data)
+
+
+class TestLogWriter(TestCase):
+    def test_records_over_queue_size_are_dropped(self):
+        stream = BlockingStream()
+        writer = LogWriter(stream, queue_size=2, batch_size=10)
+        handler = QueueStreamHandler(io.StringIO())
+        records = [logging.makeLogRecord({"msg": f"record {i}"}) for i in range(10)]
+        for record in records:
+            writer.put(handler, record)
+        # the writer holds one batch while it's blocked, two records wait in the queue
+        self.assertGreaterEqual(writer.dropped, 7)
+        stream.released.set()
+        writer.flush()
+        self.assertEqual(writer.written + writer.dropped, 10)
+        self.assertTrue(stream.getvalue().startswith("record 0\n"))
+
+    def test_arguments_are_rendered_when_logged(self):
+        stream = io.StringIO()
+        handler = QueueStreamHandler(stream)
+        logger = logging.getLogger("test_logqueue")
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        parts = ["before"]
+        logger.warning("parts: %s", parts)
+        parts.append("after")
+        handler.flush()
+        self.assertEqual(stream.getvalue(), "parts: ['before']\n")
+
+
+class TestAccessLog(ProxyTestCase):
+    async def test_request_is_logged(self):
+        with mock.patch.object(settings, "ACCESS_LOG", True), self.assertLogs(f"{settings.APP_NAME}.access") as logs:
+            await self.client.get("/bucket/key", headers=get_client_headers("GET", "/bucket/key"))
+        (message,) = logs.records
+        entry = json.loads(message.getMessage())
+        self.assertEqual((entry["method"], entry["bucket"], entry["key"]), ("GET", "bucket", "key"))
+        self.assertEqual((entry["status"], entry["sent"], entry["attempts"]), (200, len(b"upstream body"), 1))
+        self.assertEqual(entry["access_key"], "clientKey")
+        self.assertLessEqual(entry["upstream_ttfb_ms"], entry["duration_ms"])
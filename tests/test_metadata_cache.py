@@ -0,0 +1,91 @@
+from unittest import mock
+
+from s3proxy import main
+from s3proxy.metadata_cache import MetadataCache
+
+from .test_proxy import ProxyTestCase, get_client_headers
+
+
+class TestMetadataCache(ProxyTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.cache = MetadataCache(ttl=60, max_size=64 * 1024, max_entry_size=1024)
+        patch = mock.patch.object(main, "metadata_cache", self.cache)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    async def head(self, path):
+        return await self.client.head(path, headers=get_client_headers("HEAD", path))
+
+    async def list(self, prefix=""):
+        query = f"list-type=2&prefix={prefix}"
+        headers = get_client_headers("GET", "/bucket")
+        return await self.client.get(f"/bucket?{query}", headers=headers)
+
+    async def put(self, path, body, **headers):
+        return await self.client.put(path, content=body, headers={**get_client_headers("PUT", path), **headers})
+
+    async def test_head_served_from_cache(self):
+        for _ in range(3):
+            response = await self.head("/bucket/key")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.headers["content-length"], "13")
+        self.assertEqual(len(self.received), 1)
+        self.assertEqual(self.cache.stats()["hits"], 2)
+
+    async def test_unsigned_request_is_not_served_from_cache(self):
+        await self.head("/bucket/key")
+        response = await self.client.head("/bucket/key")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.received), 2)
+        self.assertEqual(self.cache.stats()["hits"], 0)
+
+    async def test_missing_object_is_cached(self):
+        for _ in range(2):
+            response = await self.head("/bucket/missing")
+            self.assertEqual(response.status_code, 404)
+        self.assertEqual(len(self.received), 1)
+
+    async def test_list_page_served_from_cache(self):
+        first = await self.list()
+        second = await self.list()
+        self.assertEqual(second.content, first.content)
+        self.assertIn(b"<Key>key</Key>", second.content)
+        self.assertEqual(len(self.received), 1)
+        await self.list("other/")
+        self.assertEqual(len(self.received), 2)
+
+    async def test_put_invalidates_head_and_listings_of_its_prefixes(self):
+        await self.head("/bucket/dir/key")
+        await self.list("dir/")
+        await self.list("other/")
+        await self.put("/bucket/dir/key", b"new body")
+        response = await self.head("/bucket/dir/key")
+        self.assertEqual(response.status_code, 200)
+        response = await self.list("dir/")
+        self.assertIn(b"<Key>dir/key</Key>", response.content)
+        await self.list("other/")
+        self.assertEqual(len(self.received), 6)
+
+    async def test_multipart_parts_do_not_invalidate(self):
+        await self.head("/bucket/key")
+        await self.put("/bucket/key?partNumber=1&uploadId=1", b"part")
+        await self.head("/bucket/key")
+        self.assertEqual(self.cache.stats()["invalidations"], 0)
+
+    async def test_expired_entry_is_fetched_again(self):
+        self.cache.ttl = 0
+        for _ in range(3):
+            await self.head("/bucket/key")
+        self.assertEqual(len(self.received), 3)
+
+    async def test_memory_is_bounded(self):
+        self.cache.max_size = 2048
+        for i in range(10):
+            self.upstream.objects[f"/bucket/{i}"] = b"x"
+            await self.head(f"/bucket/{i}")
+        stats = self.cache.stats()
+        self.assertLessEqual(stats["size"], 2048)
+        self.assertGreater(stats["evictions"], 0)
+        response = await self.client.get("/stats")
+        self.assertEqual(response.json()["metadata_cache"]["size"], stats["size"])
@@ -0,0 +1,53 @@
+from unittest import mock
+
+from prometheus_client import REGISTRY
+
+from s3proxy import metrics
+
+from .test_proxy import ProxyTestCase, get_client_headers
+
+
+def get_value(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class TestMetrics(ProxyTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        patch = mock.patch.object(metrics.upstream_pool, "clients", [self.upstream_client])
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    async def test_phases_of_proxied_request_are_measured(self):
+        phases = ("headers", "credentials", "signing", "upstream_ttfb", "body")
+        before = {
+            phase: get_value("s3proxy_phase_duration_seconds_count", phase=phase, method="PUT", status="200")
+            for phase in phases
+        }
+        sent_before = get_value("s3proxy_sent_bytes_total", method="GET", status="200")
+        received_before = get_value("s3proxy_received_bytes_total", method="PUT")
+        headers = get_client_headers("PUT", "/bucket/key")
+        response = await self.client.put("/bucket/key", content=b"0123456789", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        response = await self.client.get("/bucket/key", headers=get_client_headers("GET", "/bucket/key"))
+        for phase in phases:
+            count = get_value("s3proxy_phase_duration_seconds_count", phase=phase, method="PUT", status="200")
+            self.assertEqual(count, before[phase] + 1, phase)
+        self.assertEqual(get_value("s3proxy_received_bytes_total", method="PUT"), received_before + 10)
+        self.assertEqual(get_value("s3proxy_sent_bytes_total", method="GET", status="200"), sent_before + 10)
+        self.assertEqual(get_value("s3proxy_requests_in_flight"), 0)
+
+    async def test_metrics_endpoint(self):
+        await self.client.head("/bucket/key", headers=get_client_headers("HEAD", "/bucket/key"))
+        response = await self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('s3proxy_upstream_requests_total{host="upstream.test:8000"} 1.0', response.text)
+        self.assertIn('s3proxy_phase_duration_seconds_bucket{le="0.0001",method="HEAD"', response.text)
+
+    def test_pool_stats_of_backends_sharing_host_are_summed(self):
+        clients = [mock.Mock(), mock.Mock()]
+        clients[0].stats.return_value = {"s3.test": {"requests": 2, "in_flight": 1, "connections": 2, "idle": 1}}
+        clients[1].stats.return_value = {"s3.test": {"requests": 3, "in_flight": 0, "connections": 1, "idle": 1}}
+        self.assertEqual(
+            metrics.sum_pool_stats(clients), {"s3.test": {"requests": 5, "in_flight": 1, "connections": 3, "idle": 2}}
+        )
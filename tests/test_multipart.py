@@ -0,0 +1,77 @@
+import base64
+import hashlib
+from unittest import mock
+
+from starlette.responses import Response
+from starlette.routing import Route
+
+from s3proxy import main
+from s3proxy.multipart import MultipartUploader
+
+from .test_coalescing import FakeRequest
+from .test_proxy import ProxyTestCase, get_client_headers
+
+BODY = b"".join(bytes([i]) * 10 for i in range(35))
+
+
+def create_uploader():
+    return MultipartUploader(100, part_size=100, concurrency=2)
+
+
+class TestMultipartUploader(ProxyTestCase):
+    def test_only_large_signed_put_object_is_accepted(self):
+        uploader = create_uploader()
+        headers = {"authorization": "AWS4-HMAC-SHA256 ...", "content-length": "100"}
+        self.assertTrue(uploader.accepts(FakeRequest("PUT", headers=headers)))
+        self.assertFalse(uploader.accepts(FakeRequest("PUT", headers={**headers, "content-length": "99"})))
+        self.assertFalse(uploader.accepts(FakeRequest("PUT", headers={"content-length": "100"})))
+        self.assertFalse(uploader.accepts(FakeRequest("PUT", headers={**headers, "x-amz-copy-source": "/b/k"})))
+        self.assertFalse(uploader.accepts(FakeRequest("PUT", headers={**headers, "x-amz-checksum-crc32": "AAAAAA=="})))
+
+    async def put(self, headers=None):
+        with mock.patch.object(main, "multipart_uploader", create_uploader()):
+            headers = {**get_client_headers("PUT", "/bucket/large"), **(headers or {})}
+            return await self.client.put("/bucket/large", headers=headers, content=BODY)
+
+    async def test_large_put_is_uploaded_in_parts(self):
+        response = await self.put({"content-type": "video/mp4", "x-amz-meta-origin": "test"})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["etag"].endswith('-4"'))
+        self.assertEqual(self.upstream.objects["/bucket/large"], BODY)
+        self.assertEqual(self.upstream.uploads, {})
+        method, url, headers, _ = self.received[0]
+        self.assertEqual((method, url.query), ("POST", "uploads="))
+        self.assertEqual(headers["content-type"], "video/mp4")
+        self.assertEqual(headers["x-amz-meta-origin"], "test")
+        parts = [body for method, _, _, body in self.received if method == "PUT"]
+        self.assertEqual(sorted(len(part) for part in parts), [50, 100, 100, 100])
+        for _, _, headers, _ in self.received:
+            self.assertIn("Credential=proxyKey/", headers["authorization"])
+
+    async def test_failed_part_aborts_upload(self):
+        handle = self.upstream.handle
+
+        async def failing_part(request):
+            if request.query_params.get("partNumber") == "2":
+                return Response(b"<Error><Code>InternalError</Code></Error>", status_code=500)
+            return await handle(request)
+
+        self.upstream.app.router.routes[0] = Route("/{path:path}", failing_part, methods=["PUT", "POST", "DELETE"])
+        response = await self.put()
+        self.assertEqual(response.status_code, 500)
+        self.assertIn(b"InternalError", response.content)
+        self.assertNotIn("/bucket/large", self.upstream.objects)
+        self.assertEqual(self.upstream.uploads, {})
+
+    async def test_put_with_content_md5_is_passed(self):
+        response = await self.put({"content-md5": base64.b64encode(hashlib.md5(BODY).digest()).decode()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["etag"], '"%s"' % hashlib.md5(BODY).hexdigest())
+        self.assertEqual([method for method, _, _, _ in self.received], ["PUT"])
+
+    async def test_content_sha256_is_checked_before_completion(self):
+        response = await self.put({"x-amz-content-sha256": hashlib.sha256(b"other").hexdigest()})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(b"XAmzContentSHA256Mismatch", response.content)
+        self.assertNotIn("/bucket/large", self.upstream.objects)
+        self.assertEqual(self.upstream.uploads, {})
@@ -0,0 +1,105 @@
+import os
+import tempfile
+from unittest import mock
+
+from s3proxy import main
+from s3proxy.object_cache import ObjectCache
+
+from .test_proxy import ProxyTestCase, get_client_headers
+
+
+class TestObjectCache(ProxyTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache = ObjectCache(directory.name, max_size=1024, max_object_size=512, ttl=60)
+        patch = mock.patch.object(main, "object_cache", self.cache)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    async def get(self, path, **headers):
+        return await self.client.get(path, headers={**get_client_headers("GET", path), **headers})
+
+    async def test_object_served_from_cache(self):
+        for _ in range(3):
+            response = await self.get("/bucket/key")
+            self.assertEqual(response.content, b"upstream body")
+        self.assertEqual(len(self.received), 1)
+        self.assertEqual(self.cache.stats()["hits"], 2)
+
+    async def test_range_served_from_cache(self):
+        await self.get("/bucket/key")
+        response = await self.get("/bucket/key", range="bytes=9-")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, b"body")
+        self.assertEqual(response.headers["content-range"], "bytes 9-12/13")
+        self.assertEqual(len(self.received), 1)
+
+    async def test_stale_object_revalidated(self):
+        await self.get("/bucket/key")
+        self.cache.ttl = 0
+        response = await self.get("/bucket/key")
+        self.assertEqual(response.content, b"upstream body")
+        self.assertEqual(self.received[1][2]["if-none-match"], response.headers["etag"])
+        self.upstream.objects["/bucket/key"] = b"changed"
+        response = await self.get("/bucket/key")
+        self.assertEqual(response.content, b"changed")
+        self.assertEqual(len(self.received), 3)
+
+    async def test_put_invalidates_object(self):
+        await self.get("/bucket/key")
+        headers = get_client_headers("PUT", "/bucket/key")
+        await self.client.put("/bucket/key", content=b"new body", headers=headers)
+        response = await self.get("/bucket/key")
+        self.assertEqual(response.content, b"new body")
+
+    async def test_lru_eviction(self):
+        for i in range(3):
+            self.upstream.objects[f"/bucket/{i}"] = b"x" * 400
+            await self.get(f"/bucket/{i}")
+        self.assertEqual(self.cache.stats()["objects"], 2)
+        self.assertLessEqual(self.cache.size, 1024)
+        await self.get("/bucket/0")
+        self.assertEqual(self.cache.stats()["hits"], 0)
+
+    async def test_workers_sharing_directory_are_bounded_together(self):
+        other = ObjectCache(self.cache.directory, max_size=1024, max_object_size=512, ttl=60)
+        for i, cache in enumerate([self.cache, self.cache, other]):
+            self.upstream.objects[f"/bucket/{i}"] = b"x" * 400
+            with mock.patch.object(main, "object_cache", cache):
+                await self.get(f"/bucket/{i}")
+        sizes = [entry.stat().st_size for entry in os.scandir(self.cache.directory) if entry.name.endswith(".body")]
+        self.assertEqual(sizes, [400, 400])
+        self.assertEqual(other.stats()["objects"], 2)
+
+    async def test_delete_objects_invalidates_entries_of_other_workers(self):
+        other = ObjectCache(self.cache.directory, max_size=1024, max_object_size=512, ttl=60)
+        with mock.patch.object(main, "object_cache", other):
+            await self.get("/bucket/key")
+        body_path = self.cache.get_body_path(self.cache.get_cache_key("bucket", "key", None))
+        self.assertTrue(os.path.exists(body_path))
+        await self.client.post("/bucket?delete", content=b"<Delete/>", headers=get_client_headers("POST", "/bucket"))
+        self.assertFalse(os.path.exists(body_path))
+
+    async def test_unsigned_request_is_not_served_from_cache(self):
+        await self.get("/bucket/key")
+        response = await self.client.get("/bucket/key")
+        self.assertEqual(response.content, b"upstream body")
+        self.assertEqual(len(self.received), 2)
+        self.assertEqual(self.cache.stats()["hits"], 0)
+
+    async def test_evicted_body_is_fetched_from_upstream(self):
+        await self.get("/bucket/key")
+        cache_key = self.cache.get_cache_key("bucket", "key", None)
+        os.unlink(self.cache.get_body_path(cache_key))
+        response = await self.get("/bucket/key")
+        self.assertEqual(response.content, b"upstream body")
+        self.assertEqual(len(self.received), 2)
+
+    async def test_stored_entries_are_loaded(self):
+        await self.get("/bucket/key")
+        cache = ObjectCache(self.cache.directory, max_size=1024, max_object_size=512, ttl=60)
+        await cache.load()
+        self.assertEqual(cache.stats()["objects"], 1)
+        self.assertEqual(cache.size, len(b"upstream body"))
@@ -0,0 +1,64 @@
+import asyncio
+import gzip
+from unittest import IsolatedAsyncioTestCase
+
+import httpx
+
+from s3proxy.passthrough import PassthroughResponse
+
+from .test_proxy import ProxyTestCase, get_client_headers
+
+
+async def stream(chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+class FakeASGI:
+    def __init__(self, disconnect=False):
+        self.sent = []
+        self.disconnect = disconnect
+
+    async def receive(self):
+        if self.disconnect:
+            return {"type": "http.disconnect"}
+        await asyncio.Event().wait()
+
+    async def send(self, message):
+        self.sent.append(message)
+        # lets the disconnect watcher run
+        await asyncio.sleep(0)
+
+
+class TestPassthroughResponse(IsolatedAsyncioTestCase):
+    async def test_raw_headers_and_body_are_passed_as_they_are(self):
+        body = gzip.compress(b"upstream body")
+        upstream = httpx.Response(
+            200, headers=[("Content-Encoding", "gzip"), ("x-amz-meta-a", "1")], content=stream([body])
+        )
+        asgi = FakeASGI()
+        await PassthroughResponse(upstream)({"method": "GET", "path": "/"}, asgi.receive, asgi.send)
+        start, *chunks = asgi.sent
+        self.assertEqual(start["status"], 200)
+        self.assertIn((b"Content-Encoding", b"gzip"), start["headers"])
+        self.assertEqual(b"".join(chunk["body"] for chunk in chunks), body)
+        self.assertFalse(chunks[-1]["more_body"])
+
+    async def test_streaming_stops_when_client_disconnects(self):
+        upstream = httpx.Response(200, content=stream([b"x" * 1024] * 100))
+        asgi = FakeASGI(disconnect=True)
+        await PassthroughResponse(upstream)({"method": "GET", "path": "/"}, asgi.receive, asgi.send)
+        self.assertLess(len(asgi.sent), 100)
+        self.assertTrue(upstream.is_closed)
+
+
+class TestPassthroughApplication(ProxyTestCase):
+    async def test_admin_endpoints_are_served_by_starlette(self):
+        response = await self.client.get("/healthcheck")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.received, [])
+
+    async def test_methods_which_are_not_proxied(self):
+        response = await self.client.request("TRACE", "/bucket/key", headers=get_client_headers("TRACE", "/bucket/key"))
+        self.assertEqual(response.status_code, 405)
+        self.assertEqual(self.received, [])
@@ -0,0 +1,88 @@
+import json
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+import boto3
+from botocore.config import Config
+from starlette.datastructures import Headers, QueryParams, State
+
+from s3proxy import main
+from s3proxy.auth import KeyStore, SignatureVerifier, parse_amz_date
+from s3proxy.presign import UrlPresigner
+
+from .test_proxy import ProxyTestCase, get_client_headers
+
+
+def presign_for_proxy(key="key", expires=60):
+    s3 = boto3.client(
+        "s3",
+        endpoint_url="http://proxy.test",
+        aws_access_key_id="clientKey",
+        aws_secret_access_key="clientSecret",
+        region_name="us-east-1",
+        config=Config(signature_version="s3v4", s3={"addressing_style": "path"}),
+    )
+    return s3.generate_presigned_url("get_object", Params={"Bucket": "bucket", "Key": key}, ExpiresIn=expires)
+
+
+def get_expires_at(params):
+    return parse_amz_date(params["X-Amz-Date"]) + int(params["X-Amz-Expires"])
+
+
+class TestPresignedRequests(ProxyTestCase):
+    async def test_query_is_presigned_for_upstream(self):
+        url = presign_for_proxy()
+        response = await self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"upstream body")
+        method, upstream_url, headers, _ = self.received[0]
+        params = QueryParams(upstream_url.query)
+        self.assertTrue(params["X-Amz-Credential"].startswith("proxyKey/"))
+        self.assertAlmostEqual(get_expires_at(params), get_expires_at(QueryParams(url.partition("?")[2])), delta=2)
+        # upstream would accept it
+        upstream_request = SimpleNamespace(
+            method=method, url=upstream_url, headers=Headers(headers), query_params=params, state=State()
+        )
+        SignatureVerifier(KeyStore({"proxyKey": "proxySecret"})).verify(upstream_request)
+
+    async def test_expired_url_is_rejected(self):
+        url = presign_for_proxy(expires=1)
+        with mock.patch("time.time", return_value=time.time() + 10):
+            response = await self.client.get(url)
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.received, [])
+
+
+class TestPresignEndpoint(ProxyTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        key_store = KeyStore({"clientKey": "clientSecret"})
+        patches = [
+            mock.patch.object(main, "verifier", SignatureVerifier(key_store)),
+            mock.patch.object(main, "url_presigner", UrlPresigner(key_store, "us-east-1")),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    async def presign(self, requests, headers=None):
+        headers = headers if headers is not None else get_client_headers("POST", "/_presign")
+        return await self.client.post("/_presign", content=json.dumps({"requests": requests}), headers=headers)
+
+    async def test_urls_are_minted_for_proxy_host(self):
+        self.upstream.objects["/bucket/a b"] = b"spaced"
+        response = await self.presign([{"path": "/bucket/key"}, {"path": "/bucket/a b", "expires": 60}])
+        self.assertEqual(response.status_code, 200)
+        urls = response.json()["urls"]
+        self.assertEqual(len(urls), 2)
+        self.assertTrue(urls[0].startswith("http://proxy.test/bucket/key?"))
+        for url, body in zip(urls, [b"upstream body", b"spaced"]):
+            response = await self.client.get(url)
+            self.assertEqual(response.content, body)
+
+    async def test_caller_must_be_authenticated(self):
+        response = await self.presign([{"path": "/bucket/key"}], headers={})
+        self.assertEqual(response.status_code, 403)
+        response = await self.presign([{"method": "GET"}])
+        self.assertEqual(response.status_code, 400)
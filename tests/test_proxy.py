@@ -0,0 +1,63 @@
+from unittest import IsolatedAsyncioTestCase, mock
+
+import httpx
+
+from benchmarks.fake_s3 import FakeS3
+from s3proxy import main
+from s3proxy.aws import AwsAccessProvider
+from s3proxy.awssigv4 import get_v4_signature
+from s3proxy.http_client import AsyncHttpClient
+from s3proxy.routing import Backend, ReplicaSet, Router
+
+UPSTREAM_URL = "http://upstream.test:8000"
+
+
+def get_client_headers(method, path, host="proxy.test"):
+    headers = {"host": host, "x-amz-content-sha256": "UNSIGNED-PAYLOAD"}
+    headers["authorization"] = get_v4_signature(
+        "clientKey", "clientSecret", host, "us-east-1", "s3", method, path, headers
+    )
+    return headers
+
+
+class ProxyTestCase(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.upstream = FakeS3({"/bucket/key": b"upstream body"}, record=True)
+        self.received = self.upstream.received
+        self.upstream_client = AsyncHttpClient(transport=httpx.ASGITransport(app=self.upstream.app))
+        self.aws_provider = AwsAccessProvider("proxyKey", "proxySecret")
+        self.backend = Backend("default", UPSTREAM_URL, "us-east-1", self.aws_provider, self.upstream_client)
+        patches = [mock.patch.object(main, "router", Router(default=ReplicaSet([self.backend])))]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.client = httpx.AsyncClient(app=main.app_factory(), base_url="http://proxy.test")
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+        await self.upstream_client.close_session()
+        await self.aws_provider.close()
+
+
+class TestProxy(ProxyTestCase):
+    async def test_request_is_resigned_for_upstream(self):
+        response = await self.client.get("/bucket/key", headers=get_client_headers("GET", "/bucket/key"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"upstream body")
+        method, url, headers, _ = self.received[0]
+        self.assertEqual(url.path, "/bucket/key")
+        self.assertEqual(headers["host"], "upstream.test")
+        self.assertIn("Credential=proxyKey/", headers["authorization"])
+
+    async def test_requests_share_upstream_client(self):
+        for _ in range(3):
+            response = await self.client.head("/bucket/key", headers=get_client_headers("HEAD", "/bucket/key"))
+            self.assertEqual(response.status_code, 200)
+        stats = self.upstream_client.stats()
+        self.assertEqual(stats["upstream.test:8000"]["requests"], 3)
+        self.assertEqual(stats["upstream.test:8000"]["in_flight"], 0)
+
+    async def test_stats_endpoint(self):
+        await self.client.get("/bucket/key", headers=get_client_headers("GET", "/bucket/key"))
+        response = await self.client.get("/stats")
+        self.assertEqual(response.json()["upstream"]["upstream.test:8000"]["requests"], 1)
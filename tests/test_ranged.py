@@ -0,0 +1,75 @@
+from unittest import mock
+
+from s3proxy import main
+from s3proxy.ranged import ParallelRangeFetcher
+
+from .test_proxy import ProxyTestCase, get_client_headers
+
+BODY = bytes(range(100))
+
+
+class TestParallelRangeFetcher(ProxyTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.fetcher = ParallelRangeFetcher(threshold=64, part_size=16, concurrency=3)
+        patch = mock.patch.object(main, "range_fetcher", self.fetcher)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.upstream.objects["/bucket/large"] = BODY
+        self.upstream.objects["/bucket/medium"] = BODY[:40]
+        self.upstream.objects["/bucket/empty"] = b""
+
+    async def get(self, path, **headers):
+        return await self.client.get(path, headers={**get_client_headers("GET", path), **headers})
+
+    def get_received_ranges(self):
+        return [headers.get("range") for _, _, headers, _ in self.received]
+
+    async def test_large_object_fetched_in_parts(self):
+        response = await self.get("/bucket/large")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, BODY)
+        self.assertEqual(response.headers["content-length"], "100")
+        self.assertNotIn("content-range", response.headers)
+        self.assertEqual(len(self.received), 7)
+        self.assertEqual(self.get_received_ranges()[0], "bytes=0-15")
+        self.assertEqual(sorted(self.get_received_ranges())[-1], "bytes=96-99")
+        # parts are pinned to the same version of the object
+        self.assertEqual(
+            {headers.get("if-match") for _, _, headers, _ in self.received[1:]}, {response.headers["etag"]}
+        )
+        self.assertEqual(self.fetcher.stats(), {"split_requests": 1, "parts": 7})
+
+    async def test_client_range_is_respected(self):
+        response = await self.get("/bucket/large", range="bytes=10-89")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, BODY[10:90])
+        self.assertEqual(response.headers["content-range"], "bytes 10-89/100")
+        self.assertEqual(self.get_received_ranges()[0], "bytes=10-25")
+
+    async def test_object_below_threshold_fetched_with_two_requests(self):
+        response = await self.get("/bucket/medium")
+        self.assertEqual(response.content, BODY[:40])
+        self.assertEqual(self.get_received_ranges(), ["bytes=0-15", "bytes=16-39"])
+
+    async def test_small_object_fetched_with_single_request(self):
+        response = await self.get("/bucket/key")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"upstream body")
+        self.assertEqual(len(self.received), 1)
+
+    async def test_suffix_range_passed_as_it_is(self):
+        response = await self.get("/bucket/large", range="bytes=-10")
+        self.assertEqual(response.content, BODY[-10:])
+        self.assertEqual(self.get_received_ranges(), ["bytes=-10"])
+
+    async def test_empty_object_fetched_without_range(self):
+        response = await self.get("/bucket/empty")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(self.get_received_ranges(), ["bytes=0-15", None])
+
+    async def test_unsatisfiable_client_range_is_passed(self):
+        response = await self.get("/bucket/empty", range="bytes=0-9")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(len(self.received), 1)
@@ -0,0 +1,57 @@
+from unittest import mock
+
+from s3proxy import main
+from s3proxy.readahead import ReadAhead
+
+from .test_proxy import ProxyTestCase, get_client_headers
+
+BODY = bytes(range(250)) * 4
+
+
+class TestReadAhead(ProxyTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.read_ahead = ReadAhead(min_window=200, max_window=400, buffer_size=1000, trigger=2)
+        patch = mock.patch.object(main, "read_ahead", self.read_ahead)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.upstream.objects["/bucket/data.parquet"] = BODY
+
+    async def get_range(self, start, end):
+        headers = {**get_client_headers("GET", "/bucket/data.parquet"), "range": f"bytes={start}-{end}"}
+        response = await self.client.get("/bucket/data.parquet", headers=headers)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, BODY[slice(start, end + 1)])
+        self.assertEqual(response.headers["content-range"], f"bytes {start}-{end}/{len(BODY)}")
+        return response
+
+    async def test_sequential_reads_served_from_prefetched_windows(self):
+        for start in range(0, 1000, 100):
+            await self.get_range(start, start + 99)
+        stats = self.read_ahead.stats()
+        self.assertEqual(stats["misses"], 2)
+        self.assertEqual(stats["hits"], 8)
+        self.assertEqual(stats["hit_ratio"], 0.8)
+        # two client requests and prefetched windows growing from 200 to 400 bytes
+        self.assertEqual(
+            [headers["range"] for _, _, headers, _ in self.received],
+            ["bytes=0-99", "bytes=100-199", "bytes=200-399", "bytes=400-799", "bytes=800-999"],
+        )
+
+    async def test_window_spanning_request(self):
+        await self.get_range(0, 99)
+        await self.get_range(100, 199)
+        await self.get_range(200, 299)
+        # served from two adjacent windows: 200-399 and 400-799
+        await self.get_range(300, 549)
+        self.assertEqual(self.read_ahead.stats()["hits"], 2)
+        self.assertEqual(len(self.received), 4)
+
+    async def test_random_access_drops_prefetched_windows(self):
+        await self.get_range(0, 99)
+        await self.get_range(100, 199)
+        await self.get_range(600, 699)
+        stats = self.read_ahead.stats()
+        self.assertEqual(stats["hits"], 0)
+        self.assertEqual(stats["buffered"], 0)
+        self.assertEqual(stats["wasted"], 200)
@@ -0,0 +1,132 @@
+from unittest import IsolatedAsyncioTestCase, mock
+
+import httpx
+from starlette.responses import Response
+from starlette.routing import Route
+
+from s3proxy import main
+from s3proxy.awssigv4 import get_v4_signature
+from s3proxy.retry import RetryPolicy, SpooledBody
+
+from .test_coalescing import FakeRequest
+from .test_proxy import ProxyTestCase
+
+
+async def stream(chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+async def consume(body, limit=None):
+    chunks = []
+    async for chunk in body:
+        chunks.append(chunk)
+        if len(chunks) == limit:
+            break
+    return b"".join(chunks)
+
+
+class FakeSends:
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.responses = []
+
+    async def send(self, body):
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        response = httpx.Response(outcome)
+        self.responses.append(response)
+        return response
+
+
+def create_policy(**kwargs):
+    return RetryPolicy(base_delay=0, max_delay=0, **kwargs)
+
+
+class TestSpooledBody(IsolatedAsyncioTestCase):
+    async def test_partially_sent_body_is_replayed(self):
+        body = SpooledBody(stream([b"a" * 10, b"b" * 10, b"c" * 10]), max_size=100, memory_size=15)
+        self.assertEqual(await consume(body.iterate(), limit=2), b"a" * 10 + b"b" * 10)
+        self.assertEqual(await consume(body.iterate()), b"a" * 10 + b"b" * 10 + b"c" * 10)
+        # spilled to disk
+        self.assertTrue(body._spool._rolled)
+        body.close()
+
+    async def test_body_over_max_size_is_not_replayable(self):
+        body = SpooledBody(stream([b"a" * 10, b"b" * 10]), max_size=15, memory_size=15)
+        self.assertEqual(await consume(body.iterate()), b"a" * 10 + b"b" * 10)
+        self.assertFalse(body.replayable)
+
+
+class TestRetryPolicy(IsolatedAsyncioTestCase):
+    async def test_errors_are_retried(self):
+        policy = create_policy()
+        sends = FakeSends([httpx.ConnectError("reset"), 503, 200])
+        response = await policy.send(FakeRequest(), sends.send)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(sends.responses[0].is_closed)
+        self.assertEqual(policy.stats()["retries"], 2)
+
+    async def test_retries_are_limited(self):
+        policy = create_policy(max_retries=1)
+        response = await policy.send(FakeRequest(), FakeSends([500, 500]).send)
+        self.assertEqual(response.status_code, 500)
+        sends = FakeSends([404])
+        self.assertEqual((await policy.send(FakeRequest(), sends.send)).status_code, 404)
+
+    async def test_budget_caps_retries(self):
+        policy = create_policy(budget=0.0)
+        policy.tokens = 0
+        with self.assertRaises(httpx.ConnectError):
+            await policy.send(FakeRequest(), FakeSends([httpx.ConnectError("reset"), 200]).send)
+        self.assertEqual(policy.stats()["budget_exhausted"], 1)
+
+    async def test_post_is_sent_once(self):
+        policy = create_policy()
+        request = FakeRequest("POST", headers={"content-length": "100"})
+        request.stream = mock.Mock()
+        response = await policy.send(request, FakeSends([503, 200]).send)
+        self.assertEqual(response.status_code, 503)
+        request.stream.assert_not_called()
+
+    async def test_writes_are_sent_once_by_default(self):
+        policy = create_policy()
+        request = FakeRequest("PUT", headers={"content-length": "100"})
+        request.stream = mock.Mock()
+        response = await policy.send(request, FakeSends([503, 200]).send)
+        self.assertEqual(response.status_code, 503)
+        request.stream.assert_not_called()
+        self.assertEqual(policy.stats()["requests"], 0)
+
+    async def test_body_over_spool_size_is_sent_once(self):
+        policy = create_policy(max_body_size=10, retry_writes=True)
+        request = FakeRequest("PUT", headers={"content-length": "11"})
+        request.stream = mock.Mock()
+        response = await policy.send(request, FakeSends([503, 200]).send)
+        self.assertEqual(response.status_code, 503)
+
+
+class TestRetriedProxy(ProxyTestCase):
+    async def test_upload_is_replayed_and_signed_anew(self):
+        handle = self.upstream.handle
+
+        async def failing_first(request):
+            if len(self.received) == 0:
+                self.received.append((request.method, request.url, dict(request.headers), await request.body()))
+                return Response(status_code=503)
+            return await handle(request)
+
+        self.upstream.app.router.routes[0] = Route("/{path:path}", failing_first, methods=["PUT"])
+        headers = {"host": "proxy.test", "x-amz-content-sha256": "UNSIGNED-PAYLOAD", "x-amz-date": "20200101T000000Z"}
+        headers["authorization"] = get_v4_signature(
+            "clientKey", "clientSecret", "proxy.test", "us-east-1", "s3", "PUT", "/bucket/new", headers
+        )
+        with mock.patch.object(main, "retry_policy", create_policy(retry_writes=True)):
+            response = await self.client.put("/bucket/new", headers=headers, content=b"x" * 100000)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.upstream.objects["/bucket/new"], b"x" * 100000)
+        self.assertEqual([body for _, _, _, body in self.received], [b"x" * 100000] * 2)
+        for _, _, upstream_headers, _ in self.received:
+            self.assertNotEqual(upstream_headers["x-amz-date"], "20200101T000000Z")
+            self.assertIn("Credential=proxyKey/", upstream_headers["authorization"])
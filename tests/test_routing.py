@@ -0,0 +1,84 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+
+import httpx
+
+from s3proxy.aws import AwsAccessProvider
+from s3proxy.http_client import AsyncHttpClient
+from s3proxy.routing import Backend, BucketRoute, ReplicaSet, Router
+
+from .test_coalescing import FakeRequest
+
+
+def create_backend(name):
+    return Backend(name, f"http://{name}.test", "us-east-1", AwsAccessProvider("key", "secret"), AsyncHttpClient())
+
+
+class FakeReplicas:
+    def __init__(self, statuses=None, delays=None):
+        self.statuses = statuses or {}
+        self.delays = delays or {}
+        self.sent = []
+
+    async def send(self, backend):
+        self.sent.append(backend.name)
+        await asyncio.sleep(self.delays.get(backend.name, 0))
+        status = self.statuses.get(backend.name, 200)
+        if status is None:
+            raise httpx.ConnectError("unreachable")
+        return httpx.Response(status)
+
+
+class TestReplicaSet(IsolatedAsyncioTestCase):
+    async def test_read_fails_over_to_next_replica(self):
+        for failure in (None, 503):
+            a, b = create_backend("a"), create_backend("b")
+            # a is ranked first, it has no latency measured yet
+            b.ewma = 1.0
+            replicas = FakeReplicas(statuses={"a": failure})
+            response = await ReplicaSet([a, b]).fetch(FakeRequest(), replicas.send)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(replicas.sent, ["a", "b"])
+            self.assertEqual(a.failures, 1)
+
+    async def test_writes_go_to_primary_only(self):
+        replica_set = ReplicaSet([create_backend("a"), create_backend("b")])
+        replicas = FakeReplicas(statuses={"a": 503})
+        response = await replica_set.fetch(FakeRequest("PUT"), replicas.send)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(replicas.sent, ["a"])
+
+    async def test_failing_replica_is_ejected(self):
+        a, b = create_backend("a"), create_backend("b")
+        replica_set = ReplicaSet([a, b], eject_after=2)
+        replicas = FakeReplicas(statuses={"a": None})
+        for _ in range(4):
+            await replica_set.fetch(FakeRequest(), replicas.send)
+        self.assertTrue(a.stats()["ejected"])
+        self.assertEqual(a.failures, 2)
+        self.assertEqual(replica_set.get_candidates("GET"), [b, a])
+
+    async def test_ewma_prefers_faster_replica(self):
+        slow, fast = create_backend("slow"), create_backend("fast")
+        replica_set = ReplicaSet([slow, fast])
+        replicas = FakeReplicas(delays={"slow": 0.05})
+        for _ in range(10):
+            await replica_set.fetch(FakeRequest(), replicas.send)
+        self.assertGreaterEqual(replicas.sent.count("fast"), 8)
+
+    async def test_least_outstanding(self):
+        a, b = create_backend("a"), create_backend("b")
+        replica_set = ReplicaSet([a, b], balancing="least_outstanding")
+        a.outstanding = 5
+        self.assertEqual(replica_set.get_candidates("GET"), [b, a])
+
+
+class TestRouter(IsolatedAsyncioTestCase):
+    async def test_longest_prefix_wins(self):
+        default, hot, logs = [ReplicaSet([create_backend(name)]) for name in ("default", "hot", "logs")]
+        router = Router([BucketRoute("data", "", hot), BucketRoute("data", "logs/", logs)], default)
+        self.assertIs(router.get_replica_set("/data/logs/2023/01"), logs)
+        self.assertIs(router.get_replica_set("/data/images/1.png"), hot)
+        self.assertIs(router.get_replica_set("/data"), hot)
+        self.assertIs(router.get_replica_set("/other/key"), default)
+        self.assertEqual([backend.name for backend in router.backends], ["logs", "hot", "default"])
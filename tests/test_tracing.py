@@ -0,0 +1,87 @@
+import asyncio
+import time
+from unittest import mock
+
+from s3proxy import main
+from s3proxy.auth import KeyStore, SignatureVerifier
+from s3proxy.awssigv4 import get_v4_signature
+from s3proxy.profiling import Profiler
+from s3proxy.tracing import Tracer
+
+from .test_proxy import ProxyTestCase, get_client_headers
+
+
+class RecordingExporter:
+    def __init__(self):
+        self.traces = []
+
+    def export(self, trace, ended):
+        self.traces.append(trace)
+
+
+def block():
+    time.sleep(0.2)
+
+
+class TestTracing(ProxyTestCase):
+    async def test_sampled_request_is_traced(self):
+        exporter = RecordingExporter()
+        with mock.patch.object(main, "tracer", Tracer(exporter, 1.0)):
+            await self.client.get("/bucket/key", headers=get_client_headers("GET", "/bucket/key"))
+        (trace,) = exporter.traces
+        self.assertEqual(trace.name, "GET bucket")
+        self.assertEqual(trace.attributes["http.status_code"], "200")
+        names = [name for name, _, _, _ in trace.spans]
+        self.assertEqual(names, ["upstream.credentials", "upstream.signing", "upstream.send", "response.body"])
+        for _, start, end, _ in trace.spans:
+            self.assertLessEqual(trace.started, start)
+            self.assertLessEqual(start, end)
+
+    async def test_request_is_not_traced_unless_sampled(self):
+        exporter = RecordingExporter()
+        with mock.patch.object(main, "tracer", Tracer(exporter, 0.0)):
+            await self.client.get("/bucket/key", headers=get_client_headers("GET", "/bucket/key"))
+        self.assertEqual(exporter.traces, [])
+
+
+class TestProfiling(ProxyTestCase):
+    async def test_profiling_is_disabled_by_default(self):
+        response = await self.client.get("/_profile")
+        self.assertEqual(response.status_code, 404)
+
+    async def test_cpu_profile(self):
+        with mock.patch.object(main, "profiler", Profiler()):
+            response = await self.client.get("/_profile", params={"mode": "cpu", "seconds": "0.05"})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("function calls", response.text)
+
+    async def test_lag_trace_reports_blocking_code(self):
+        profiler = Profiler()
+        with mock.patch.object(main, "profiler", profiler):
+            asyncio.get_running_loop().call_later(0.05, block)
+            response = await self.client.get("/_profile", params={"mode": "lag", "seconds": "0.3"})
+        result = response.json()
+        self.assertGreaterEqual(result["max_ms"], 100)
+        self.assertIn("time.sleep(0.2)", result["blocking"][0]["stack"])
+        self.assertFalse(profiler.running)
+
+    async def test_profile_requires_signature_when_clients_are_verified(self):
+        params = {"mode": "cpu", "seconds": "0.05"}
+        headers = {"host": "proxy.test", "x-amz-content-sha256": "UNSIGNED-PAYLOAD"}
+        headers["authorization"] = get_v4_signature(
+            "clientKey", "clientSecret", "proxy.test", "us-east-1", "s3", "GET", "/_profile", headers, params
+        )
+        verifier = SignatureVerifier(KeyStore({"clientKey": "clientSecret"}))
+        with mock.patch.object(main, "profiler", Profiler()), mock.patch.object(main, "verifier", verifier):
+            response = await self.client.get("/_profile", params=params)
+            self.assertEqual(response.status_code, 403)
+            response = await self.client.get("/_profile", params=params, headers=headers)
+            self.assertEqual(response.status_code, 200)
+
+    async def test_one_profile_at_a_time(self):
+        with mock.patch.object(main, "profiler", Profiler()):
+            first = asyncio.ensure_future(self.client.get("/_profile", params={"mode": "lag", "seconds": "0.2"}))
+            await asyncio.sleep(0.05)
+            response = await self.client.get("/_profile", params={"mode": "cpu", "seconds": "0.1"})
+            self.assertEqual(response.status_code, 409)
+            self.assertEqual((await first).status_code, 200)
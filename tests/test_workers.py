@@ -0,0 +1,86 @@
+import os
+import tempfile
+import time
+from unittest import IsolatedAsyncioTestCase, mock
+
+from s3proxy import main
+from s3proxy.aws import AwsAccessProvider
+from s3proxy.broker import BrokeredAccessProvider, CredentialBroker
+from s3proxy.workers import Supervisor, Worker
+
+
+class TestCredentialBroker(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.broker = CredentialBroker(
+            {"default": AwsAccessProvider("proxyKey", "proxySecret")}, os.path.join(directory.name, "broker.sock")
+        )
+        await self.broker.start()
+        self.addAsyncCleanup(self.broker.close)
+
+    async def test_credentials_are_brokered(self):
+        provider = BrokeredAccessProvider(self.broker.path, "default")
+        self.addAsyncCleanup(provider.close)
+        credentials = await provider.get_access_credentials()
+        self.assertEqual((credentials.access_key, credentials.secret_key), ("proxyKey", "proxySecret"))
+        await provider.get_access_credentials()
+        self.assertEqual(self.broker.served, 1)
+
+    async def test_unknown_backend_fails(self):
+        provider = BrokeredAccessProvider(self.broker.path, "other")
+        self.addAsyncCleanup(provider.close)
+        with self.assertRaisesRegex(Exception, "No credentials of backend other"):
+            await provider.get_access_credentials()
+
+    async def test_role_credentials_are_brokered(self):
+        with mock.patch.object(main.settings, "CREDENTIAL_BROKER_SOCKET", self.broker.path):
+            assumed = main.create_aws_provider("default", "key", "secret", role_arn="arn:aws:iam::1:role/proxy")
+            self.addAsyncCleanup(assumed.close)
+            static = main.create_aws_provider("default", "key", "secret")
+        self.assertIsInstance(assumed, BrokeredAccessProvider)
+        self.assertIsInstance(static, AwsAccessProvider)
+
+
+def create_worker(alive=True, heartbeat=0.0, started=None):
+    process = mock.Mock(pid=1, exitcode=None if alive else 1)
+    process.is_alive.return_value = alive
+    worker = Worker(process, mock.Mock(value=heartbeat))
+    worker.started = started if started is not None else time.time()
+    return worker
+
+
+class TestSupervisor(IsolatedAsyncioTestCase):
+    async def test_dead_and_stalled_workers_are_replaced(self):
+        supervisor = Supervisor("127.0.0.1", 5000, 3, worker_timeout=10)
+        now = time.time()
+        healthy = create_worker(heartbeat=now)
+        dead = create_worker(alive=False)
+        stalled = create_worker(heartbeat=now - 11, started=now - 60)
+        supervisor.workers = [healthy, dead, stalled]
+        replacements = [create_worker(), create_worker()]
+        with mock.patch.object(supervisor, "spawn", side_effect=replacements):
+            supervisor.check()
+        self.assertEqual(supervisor.workers, [healthy] + replacements)
+        stalled.process.kill.assert_called_once()
+        self.assertEqual(supervisor.restarts, 2)
+
+    def test_starting_worker_is_not_stalled(self):
+        worker = create_worker(started=time.time() - 5)
+        self.assertFalse(worker.is_stalled(10, time.time()))
+        self.assertTrue(worker.is_stalled(1, time.time()))
+
+    async def test_restart_is_aborted_when_replacement_is_not_ready(self):
+        supervisor = Supervisor("127.0.0.1", 5000, 3, worker_timeout=10)
+        now = time.time()
+        workers = [create_worker(heartbeat=now) for _ in range(3)]
+        supervisor.workers = list(workers)
+        ready = create_worker(heartbeat=now)
+        stalled = create_worker(started=now - 60)
+        supervisor.start_draining = mock.Mock()
+        with mock.patch.object(supervisor, "spawn", side_effect=[ready, stalled]) as spawn:
+            await supervisor.restart()
+        self.assertEqual(supervisor.workers, [ready] + workers[1:])
+        supervisor.start_draining.assert_called_once_with(workers[0])
+        stalled.process.kill.assert_called_once()
+        self.assertEqual(spawn.call_count, 2)